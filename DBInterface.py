@@ -1,11 +1,38 @@
+import asyncio
+import io
+import json
+import asyncpg
 import pandas as pd
-from fields import FieldEnum, SPFields, SGFields, DTypeEnum, SPDTypes, SGDTypes
-from connections import ApiConnection, DBConnection
+from fields import FieldEnum, SPFields, SGFields, DTypeEnum, SPDTypes, SGDTypes, dtype_wiki2copy, dtype_wiki2pandas
+from binary_copy import encode_frame, decode_frame
+from transform import compile_plan
+from connections import ApiConnection, AsyncCargoClient, DBConnection
+from metrics import registry
 from postgres_conf import QueryCreator
+from dimensions import DimensionMap, SP_DIMENSION_COLUMNS, SG_DIMENSION_COLUMNS
+from aggregates import AggregateTable, SP_AGGREGATES, SG_AGGREGATES
+from etl_state import CheckpointStore
+from result_cache import ResultCache
+
+
+SP_READ_FILTERS = {'team': ['team'], 'player': ['name'], 'champion': ['champion'], 'tournament': ['tournament']}
+SG_READ_FILTERS = {
+    'team': ['team1', 'team2'],
+    'player': ['team_1_players', 'team_2_players'],
+    'champion': ['team_1_picks', 'team_2_picks'],
+    'tournament': ['tournament'],
+}
 
 
 class APIInterface():
-    """Base class for interfacing with tables from the lol_fandom database api"""
+    """
+    Base class for interfacing with tables from the lol_fandom database api
+    Every request waits on the process wide ApiConnection.rate_limiter, 
+    and requests rejected for maxlag or too many requests are retried after it backs off
+    """
+    max_throttle_retries = 5
+    response_cache = None
+
     def __init__(
             self,
             fields: FieldEnum,
@@ -30,115 +57,566 @@ class APIInterface():
         return clean_query
 
 
-    def raw_query_api(self, offset: int, start_date: str, end_date: str, limit: int = 50) -> pd.DataFrame:
+    def raw_query_api(self, offset: int, start_date: str, end_date: str, limit: int = 50) -> list[dict]:
         """
         Query API with fields specified in self.fields
-        Return raw Dataframe of query made to lolfandom api
+        Return raw rows of query made to lolfandom api, or of the cached response when there is one
         """
+        if self.response_cache is None:
+            return self.fetch_raw_query(offset, start_date, end_date, limit)
+
+        query_args = self.cargo_query_args(offset, start_date, end_date, limit)
+        query_result = self.response_cache.get(query_args, (start_date, end_date))
+        if query_result is None:
+            query_result = self.fetch_raw_query(offset, start_date, end_date, limit)
+            self.response_cache.put(query_args, query_result, (start_date, end_date))
+        else:
+            registry.inc('etl_cache_hits_total', table=self.cargotable_name)
+        return query_result
+
+
+    def fetch_raw_query(self, offset: int, start_date: str, end_date: str, limit: int = 50) -> list[dict]:
+        """Query API for one page, throttled by ApiConnection.rate_limiter"""
+        query_result = self.fetch_query(self.cargo_query_args(offset, start_date, end_date, limit))
+        registry.inc('etl_rows_fetched_total', len(query_result), table=self.cargotable_name)
+        return query_result
+
+
+    def fetch_query(self, query_args: dict) -> list[dict]:
+        """Run any cargo query, throttled by ApiConnection.rate_limiter"""
         client = ApiConnection.get_client()
+        limiter = ApiConnection.rate_limiter
+        reauthenticated = False
+
+        for attempt in range(self.max_throttle_retries + 1):
+            registry.inc('etl_rate_limiter_wait_seconds_total', limiter.acquire())
+            try:
+                with registry.timer('etl_api_request_seconds', table=self.cargotable_name):
+                    query_result = self.cargo_query(client, query_args)
+            except Exception as e:
+                if ApiConnection.is_throttle_error(e) and attempt < self.max_throttle_retries:
+                    registry.inc('etl_api_retries_total', table=self.cargotable_name, reason='throttle')
+                    limiter.backoff()
+                    continue
+                if ApiConnection.is_auth_error(e) and not reauthenticated:
+                    registry.inc('etl_api_retries_total', table=self.cargotable_name, reason='auth')
+                    client = ApiConnection.reauthenticate(client)
+                    reauthenticated = True
+                    continue
+                raise
+            limiter.recover()
+            break
+
+        return query_result
+
+
+    async def async_query_api(
+            self, client: AsyncCargoClient, offset: int, start_date: str, end_date: str, limit: int = 50
+        ) -> pd.DataFrame:
+        """
+        Query the lolfandom api through an AsyncCargoClient on the running event loop
+        Return cleaned query will all specified fields
+        """
+        raw_query = await self.async_raw_query_api(client, offset, start_date, end_date, limit)
+        return self.clean_raw_query(raw_query)
+
+
+    async def async_raw_query_api(
+            self, client: AsyncCargoClient, offset: int, start_date: str, end_date: str, limit: int = 50
+        ) -> list[dict]:
+        """
+        Query API with fields specified in self.fields through an AsyncCargoClient
+        Return raw rows of query made to lolfandom api, or of the cached response when there is one
+        """
+        query_args = self.cargo_query_args(offset, start_date, end_date, limit)
+        if self.response_cache is not None:
+            query_result = self.response_cache.get(query_args, (start_date, end_date))
+            if query_result is not None:
+                registry.inc('etl_cache_hits_total', table=self.cargotable_name)
+                return query_result
+
+        query_result = await self.async_fetch_query(client, query_args)
+        registry.inc('etl_rows_fetched_total', len(query_result), table=self.cargotable_name)
+
+        if self.response_cache is not None:
+            self.response_cache.put(query_args, query_result, (start_date, end_date))
+        return query_result
+
+
+    async def async_fetch_query(self, client: AsyncCargoClient, query_args: dict) -> list[dict]:
+        """Run any cargo query through an AsyncCargoClient, throttled by ApiConnection.rate_limiter"""
+        limiter = ApiConnection.rate_limiter
 
-        query_result = client.cargo_client.query(
-            tables=f'{self.cargotable_name}={self.cargo_suffix}',
+        for attempt in range(self.max_throttle_retries + 1):
+            registry.inc('etl_rate_limiter_wait_seconds_total', await limiter.acquire_async())
+            try:
+                with registry.timer('etl_api_request_seconds', table=self.cargotable_name):
+                    query_result = await client.query(**query_args)
+            except Exception as e:
+                if ApiConnection.is_throttle_error(e) and attempt < self.max_throttle_retries:
+                    registry.inc('etl_api_retries_total', table=self.cargotable_name, reason='throttle')
+                    limiter.backoff()
+                    continue
+                raise
+            limiter.recover()
+            break
+
+        return query_result
+
+
+    def probe(self, start_date: str, end_date: str) -> tuple:
+        """
+        Return the row count and highest cargo row id of a window in one single row query,
+        either changes whenever a row of the window is added, edited or deleted
+        """
+        return self.get_signature(self.fetch_query(self.probe_query_args(start_date, end_date)))
+
+
+    async def async_probe(self, client: AsyncCargoClient, start_date: str, end_date: str) -> tuple:
+        """probe through an AsyncCargoClient"""
+        return self.get_signature(await self.async_fetch_query(client, self.probe_query_args(start_date, end_date)))
+
+
+    @staticmethod
+    def get_signature(query_result: list[dict]) -> tuple:
+        return tuple(sorted(query_result[0].items())) if query_result else ()
+
+
+    def cargo_query(self, client, query_args: dict) -> list[dict]:
+        """Run a cargo query with an authenticated client"""
+        return client.cargo_client.query(**query_args)
+
+
+    @property
+    def cargo_tables(self) -> str:
+        """Cargo tables argument of this interface's queries"""
+        return f'{self.cargotable_name}={self.cargo_suffix}'
+
+
+    def cargo_query_args(self, offset: int, start_date: str, end_date: str, limit: int) -> dict:
+        """Return keyword arguments of the cargo query for one page"""
+        return dict(
+            tables=self.cargo_tables,
             fields=self.fields.get_suffixed(self.cargo_suffix),
             limit=limit,
             offset=offset,
             where=(
-                f"{self.cargo_suffix}.DateTime_UTC >= '{start_date} 00:00:00' AND "
-                f"{self.cargo_suffix}.DateTime_UTC <= '{end_date} 00:00:00'"
+                f"{self.cargo_suffix}.DateTime_UTC >= '{start_date}' AND "
+                f"{self.cargo_suffix}.DateTime_UTC < '{end_date}'"
             ),
-            order_by=f"{self.cargo_suffix}.DateTime_UTC"
+            order_by=f"{self.cargo_suffix}.DateTime_UTC, {self.cargo_suffix}._ID"
+        )
+
+
+    def probe_query_args(self, start_date: str, end_date: str) -> dict:
+        """Return keyword arguments of the cargo query summarising a window for probe"""
+        return dict(
+            tables=self.cargo_tables,
+            fields=f'COUNT(*)=row_count, MAX({self.cargo_suffix}._ID)=max_id',
+            limit=1,
+            where=(
+                f"{self.cargo_suffix}.DateTime_UTC >= '{start_date}' AND "
+                f"{self.cargo_suffix}.DateTime_UTC < '{end_date}'"
+            )
         )
-        query_result = pd.DataFrame(query_result)
-        query_result.columns = [c.replace(' ', '_') for c in query_result.columns]
-     
-        return query_result
 
 
-    def clean_raw_query(self, query: pd.DataFrame) -> None:
+    def clean_raw_query(self, query: list[dict]) -> pd.DataFrame:
         """
         Clean query, fill in missing columns, coerce datatypes, unpack delimited strings
+        using the transform plan compiled once for self.fields and self.field_dtypes
         """
-        queried_fields = self.fields.list_values()
-        found, missing = get_found_and_missing(queried_fields, query.columns)
-        
-        for m in missing:
-            query[m] = pd.NA
-        query = query[queried_fields]
+        return compile_plan(self.fields, self.field_dtypes)(query)
 
-        coercible_dtype_map, special_dtypes = self.field_dtypes.split_dtypes()
-        query = query.astype(coercible_dtype_map)
 
-        for col, dtype in special_dtypes.items():
-            if 'delimiter:' in dtype.split(' '):
-                query[col] = query[col].str.split(dtype[-1])
+class JoinedAPIInterface(APIInterface):
+    """
+    Fetches two cargo tables sharing join_field in one paginated query, 
+    left joining joined onto primary so a page holds every joined row of its primary rows,
+    and primary rows without any joined row once.
+    Fields are aliased with their table's suffix, split_raw_query separates each row into both tables' rows.
+    """
+    def __init__(self, primary: APIInterface, joined: APIInterface, join_field: str = 'GameId') -> None:
+        super().__init__(primary.fields, primary.field_dtypes, primary.cargo_suffix, primary.cargotable_name)
+        self.primary = primary
+        self.joined = joined
+        self.join_field = join_field
+        self.parts = (primary, joined)
+
+
+    @property
+    def cargo_tables(self) -> str:
+        return f'{self.cargotable_name}={self.cargo_suffix}, {self.joined.cargotable_name}={self.joined.cargo_suffix}'
 
-        query = query.rename(self.fields.invert(), axis=1)
-        return query
+
+    def cargo_query_args(self, offset: int, start_date: str, end_date: str, limit: int) -> dict:
+        """Return keyword arguments of the joined cargo query for one page, ordered so pages never overlap"""
+        primary, joined = self.cargo_suffix, self.joined.cargo_suffix
+        return dict(
+            tables=self.cargo_tables,
+            join_on=f'{primary}.{self.join_field}={joined}.{self.join_field}',
+            fields=', '.join(
+                f'{part.cargo_suffix}.{field.value}={part.cargo_suffix}_{field.value}'
+                for part in self.parts for field in part.fields
+            ),
+            limit=limit,
+            offset=offset,
+            where=(
+                f"{primary}.DateTime_UTC >= '{start_date}' AND "
+                f"{primary}.DateTime_UTC < '{end_date}'"
+            ),
+            order_by=f"{primary}.DateTime_UTC, {primary}._ID, {joined}._ID"
+        )
+
+
+    def probe_query_args(self, start_date: str, end_date: str) -> dict:
+        """Return keyword arguments of the query summarising a window of the join for probe"""
+        primary, joined = self.cargo_suffix, self.joined.cargo_suffix
+        return dict(
+            tables=self.cargo_tables,
+            join_on=f'{primary}.{self.join_field}={joined}.{self.join_field}',
+            fields=f'COUNT(*)=row_count, MAX({primary}._ID)=max_id, MAX({joined}._ID)=max_joined_id',
+            limit=1,
+            where=(
+                f"{primary}.DateTime_UTC >= '{start_date}' AND "
+                f"{primary}.DateTime_UTC < '{end_date}'"
+            )
+        )
+
+
+    def split_raw_query(self, query: list[dict]) -> tuple[list[dict], list[dict]]:
+        """
+        Split raw joined rows into raw rows of primary, once per join_field value, 
+        and of joined, skipping the empty joined half of primary rows without a match
+        """
+        primary_rows, joined_rows, seen = [], [], set()
+        primary_prefixes = (self.cargo_suffix + '_', self.cargo_suffix + ' ')
+        joined_prefixes = (self.joined.cargo_suffix + '_', self.joined.cargo_suffix + ' ')
+        for row in query:
+            primary_row, joined_row = {}, {}
+            for key, value in row.items():
+                if key.startswith(primary_prefixes):
+                    primary_row[key[len(primary_prefixes[0]):]] = value
+                elif key.startswith(joined_prefixes):
+                    joined_row[key[len(joined_prefixes[0]):]] = value
+
+            join_value = self.get_join_value(primary_row)
+            if join_value is None or join_value not in seen:
+                seen.add(join_value)
+                primary_rows.append(primary_row)
+            if self.get_join_value(joined_row) is not None:
+                joined_rows.append(joined_row)
+        return primary_rows, joined_rows
+
+
+    def get_join_value(self, row: dict) -> str | None:
+        return row.get(self.join_field) or None
+
+
+    def clean_raw_query(self, query: list[dict]) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """Split and clean a joined query into the frames of primary and joined"""
+        return tuple(part.clean_raw_query(rows) for part, rows in zip(self.parts, self.split_raw_query(query)))
 
     
 class LocalInterface():
-    """Interface for inserting into the local postgreSQL database"""
+    """
+    Interface for inserting into the local postgreSQL database
+    on_conflict sets what happens to rows already in the table, see QueryCreator.get_insert_query
+    partition_by must match the TableCreator of a partitioned table, missing partitions are created before inserting.
+    dimension_columns must match the TableCreator of a normalized table,
+    the strings of those columns are replaced by their dimension keys before inserting.
+    When notify_channel is set, every batch which inserted or updated rows sends a NOTIFY on that channel
+    with a JSON payload of the table, the row counts and the newest datetime_utc, delivered once the batch commits.
+    aggregates maps summary table names to their definitions, see aggregates.SP_AGGREGATES,
+    each summary is updated with the rows a batch changed in the batch's transaction.
+    read_filters maps each filter of read to the columns it matches, see SP_READ_FILTERS.
+    """
+    conflict_policies = ('ignore', 'update', 'update_changed')
+    result_cache_bytes = 256 * 2**20
+
     def __init__(self, table_name: str, fields: FieldEnum, 
-                 field_wikidtypes: DTypeEnum, schema_name: str, on_conflict: str = ''):
+                 field_wikidtypes: DTypeEnum, schema_name: str, on_conflict: str = 'ignore', 
+                 conflicts: list[str] = None, partition_by: str = None,
+                 dimension_columns: dict[str, tuple[str, str]] = None, aggregates: dict = None,
+                 read_filters: dict[str, list[str]] = None):
+        if on_conflict not in self.conflict_policies:
+            raise ValueError(f'on_conflict must be one of {self.conflict_policies}, not {on_conflict}')
         self.table_name = table_name
         self.temp_table_name = 'temp_' + self.table_name
         self.fields = fields
         self.field_wikidtypes = field_wikidtypes
         self.schema_name = schema_name
+        self.on_conflict = on_conflict
+        self.conflicts = [] if conflicts is None else conflicts
+        self.dimensions = None if dimension_columns is None else DimensionMap(schema_name, dimension_columns)
+        self.column_types = {}
+        for name, value in fields.__members__.items():
+            wiki_dtype = field_wikidtypes[value]
+            if self.dimensions is not None and name in self.dimensions.columns:
+                key_column = self.dimensions.key_column(name)
+                self.column_types[key_column] = self.dimensions.key_type(name, wiki_dtype.startswith('List'))
+            else:
+                self.column_types[name] = dtype_wiki2copy[wiki_dtype]
+        self.qc = QueryCreator(
+            schema_name, table_name, fields, field_wikidtypes, self.conflicts, partition_by, self.dimensions
+        )
+        self.partitions = set()
+        self.notify_channel = None
+        self.delta_table_name = 'delta_' + self.table_name
+        self.aggregates = [
+            AggregateTable(schema_name, table_name, name, keys, rows, self.qc.get_column_name)
+            for name, (keys, rows) in ({} if aggregates is None else aggregates).items()
+        ]
+        self.read_filters = {} if read_filters is None else read_filters
+        self.checkpoints = CheckpointStore(schema_name, table_name)
+        self.result_cache = ResultCache(self.result_cache_bytes)
 
 
-    async def insert_new(self, entries: pd.DataFrame) -> None:
-        table_str = ', '.join(entries.columns)
-        entries = entries.replace({pd.NA: None})
+    async def insert_new(self, entries: pd.DataFrame) -> dict[str, int]:
+        """
+        Stage entries in this connection's temp table and insert them into the target table.
+        The temp table is created once per pooled connection and truncated for each batch.
+        Returns number of rows inserted, updated and left unchanged.
+        """
+        table = self.table_name
+        if self.dimensions is not None:
+            with registry.timer('etl_load_seconds', table=table, step='dimensions'):
+                entries = await self.dimensions.encode(entries)
+        await self.ensure_partitions(entries)
+        with registry.timer('etl_load_seconds', table=table, step='encode'):
+            copy_payload = encode_frame(entries, self.column_types)
+        delta_table_name = self.delta_table_name if self.aggregates else None
+        insert_query = self.qc.get_insert_query(
+            self.temp_table_name, list(entries.columns), self.on_conflict, delta_table_name
+        )
 
-        conn = await DBConnection.get_async_con()
-        create_temp_query = self.get_create_temp_query()
+        with registry.timer('etl_load_seconds', table=table, step='acquire'):
+            conn = await DBConnection.get_pool().acquire()
+        try:
+            async with conn.transaction():
+                with registry.timer('etl_load_seconds', table=table, step='truncate'):
+                    await conn.execute(f"TRUNCATE {self.temp_table_name};")
+                    if self.aggregates:
+                        await conn.execute(f"TRUNCATE {self.delta_table_name};")
+                with registry.timer('etl_load_seconds', table=table, step='copy'):
+                    await conn.copy_to_table(
+                        self.temp_table_name, 
+                        source=io.BytesIO(copy_payload),
+                        columns=list(entries.columns),
+                        format='binary'
+                    )
+                with registry.timer('etl_load_seconds', table=table, step='insert'):
+                    result = await conn.fetchrow(insert_query)
+                for aggregate in self.aggregates:
+                    await aggregate.apply(conn, self.delta_table_name)
+                if self.notify_channel is not None and result['inserted'] + result['updated']:
+                    await conn.execute(
+                        "SELECT pg_notify($1, $2);", self.notify_channel, self.get_notify_payload(entries, result)
+                    )
+        finally:
+            await DBConnection.get_pool().release(conn)
+        self.result_cache.clear()
 
-        await conn.execute(create_temp_query)
-        
-        await conn.copy_records_to_table(
-            self.temp_table_name, 
-            records=entries.itertuples(index=False)
-        )
-        on_conflict = f"ON CONFLICT ON CONSTRAINT {self.table_name}_unique DO NOTHING"
-        await conn.execute(
-            f"INSERT INTO {self.schema_name}.{self.table_name} ({table_str}) "
-            f"SELECT {table_str} FROM {self.temp_table_name} {on_conflict};"
-        )
+        inserted, updated = result['inserted'], result['updated']
+        counts = {'inserted': inserted, 'updated': updated, 'unchanged': len(entries) - inserted - updated}
+        for k, v in counts.items():
+            registry.inc(f'etl_rows_{k}_total', v, table=table)
+        return counts
+
+
+    def get_notify_payload(self, entries: pd.DataFrame, result) -> str:
+        max_datetime = pd.to_datetime(entries['datetime_utc']).max() if 'datetime_utc' in entries else None
+        return json.dumps({
+            'table': f'{self.schema_name}.{self.table_name}',
+            'inserted': result['inserted'],
+            'updated': result['updated'],
+            'max_datetime_utc': None if pd.isna(max_datetime) else max_datetime.isoformat(),
+        })
+
+
+    async def read(
+            self, start_date: str = None, end_date: str = None, columns: list[str] = None, **filters
+        ) -> pd.DataFrame:
+        """
+        Return rows with datetime_utc from start_date up to end_date matching every filter,
+        filters being the names in self.read_filters, e.g. team='T1', with a value or list of values.
+        Rows are streamed with binary COPY and decoded into the dtypes entries are cleaned into,
+        columns of a normalized table hold dimension keys while filters still take their values.
+        Results are cached until this table's checkpoint watermark moves on, requires an open pool.
+        """
+        columns = list(self.column_types) if columns is None else [self.qc.get_column_name(c) for c in columns]
+        query, args = self.get_read_query(columns, start_date, end_date, filters)
+        key = (query, tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args))
+        watermark = await self.checkpoints.watermark()
+        self.result_cache.validate(watermark)
+        frame = self.result_cache.get(key)
+        if frame is not None:
+            registry.inc('etl_read_cache_hits_total', table=self.table_name)
+            return frame
+
+        chunks = []
+        async def collect(chunk: bytes) -> None:
+            chunks.append(chunk)
+
+        with registry.timer('etl_read_seconds', table=self.table_name, step='copy'):
+            async with DBConnection.get_pool().acquire() as conn:
+                await conn.copy_from_query(query, *args, output=collect, format='binary')
+        with registry.timer('etl_read_seconds', table=self.table_name, step='decode'):
+            frame = await asyncio.get_running_loop().run_in_executor(
+                None, self.decode_rows, b''.join(chunks), columns
+            )
+        registry.inc('etl_rows_read_total', len(frame), table=self.table_name)
+        self.result_cache.put(key, frame, watermark)
+        return frame.copy()
+
+
+    def get_read_query(
+            self, columns: list[str], start_date: str | None, end_date: str | None, filters: dict
+        ) -> tuple[str, list]:
+        """Return the select query of read and its arguments"""
+        conditions, args = [], []
+        if start_date is not None:
+            args.append(pd.Timestamp(start_date).to_pydatetime())
+            conditions.append(f"datetime_utc >= ${len(args)}")
+        if end_date is not None:
+            args.append(pd.Timestamp(end_date).to_pydatetime())
+            conditions.append(f"datetime_utc < ${len(args)}")
+        for name, values in filters.items():
+            if name not in self.read_filters:
+                raise ValueError(f'read filters must be among {list(self.read_filters)}, not {name}')
+            args.append([values] if isinstance(values, str) else list(values))
+            matches = [self.get_filter_condition(column, f"${len(args)}::text[]") for column in self.read_filters[name]]
+            conditions.append('(' + ' OR '.join(matches) + ')')
+
+        where_str = '' if not conditions else ' WHERE ' + ' AND '.join(conditions)
+        query = f"SELECT {', '.join(columns)} FROM {self.schema_name}.{self.table_name}{where_str} ORDER BY datetime_utc"
+        return query, args
+
+
+    def get_filter_condition(self, column: str, values: str) -> str:
+        """Return condition of column holding any of values, or for list columns sharing any element with them"""
+        is_list = self.field_wikidtypes[self.fields[column]].startswith('List')
+        if self.dimensions is not None and column in self.dimensions.columns:
+            dimension = self.dimensions.dimensions[self.dimensions.columns[column][0]]
+            values = f"ARRAY(SELECT id FROM {dimension.target_table} WHERE value = ANY({values}))"
+            column = self.dimensions.key_column(column)
+        return f"{column} && {values}" if is_list else f"{column} = ANY({values})"
+
+
+    def decode_rows(self, payload: bytes, columns: list[str]) -> pd.DataFrame:
+        """Decode a binary COPY of columns, casting each field column to the pandas dtype it is cleaned into"""
+        frame = decode_frame(payload, {column: self.column_types[column] for column in columns})
+        for name, value in self.fields.__members__.items():
+            pandas_dtype = dtype_wiki2pandas.get(self.field_wikidtypes[value])
+            if name in frame.columns and pandas_dtype is not None:
+                frame[name] = frame[name].astype(pandas_dtype)
+        return frame
+
+
+    async def ensure_partitions(self, entries: pd.DataFrame) -> None:
+        """Create the partitions entries fall into which this interface has not seen yet"""
+        if self.qc.partition_by is None or not len(entries):
+            return
+        missing = [p for p in self.qc.get_partitions(entries[self.qc.partition_key]) if p[0] not in self.partitions]
+        if not missing:
+            return
+        with registry.timer('etl_load_seconds', table=self.table_name, step='partition'):
+            async with DBConnection.get_pool().acquire() as conn:
+                for name, start, end in missing:
+                    try:
+                        await conn.execute(self.qc.get_create_partition_query(name, start, end))
+                    except (asyncpg.DuplicateTableError, asyncpg.UniqueViolationError):
+                        # created concurrently by another loader
+                        pass
+                    self.partitions.add(name)
 
 
     def get_create_temp_query(self):
-        tc = QueryCreator('', self.temp_table_name, self.fields, self.field_wikidtypes, [])
+        tc = QueryCreator('', self.temp_table_name, self.fields, self.field_wikidtypes, [], dimensions=self.dimensions)
         return tc.get_create_temp_query()
 
 
+    def get_create_delta_query(self):
+        return f"""
+            CREATE TEMPORARY TABLE {self.delta_table_name} (
+            sign SMALLINT, 
+            {self.qc.get_field_query()});
+        """
+
+
+    async def setup_aggregates(self) -> None:
+        """Create the summary tables which do not exist yet, each built from the rows already loaded"""
+        async with DBConnection.get_pool().acquire() as conn:
+            for aggregate in self.aggregates:
+                await aggregate.setup(conn)
+
+
+    async def rebuild_aggregates(self, check: bool = False) -> dict[str, int]:
+        """
+        Recompute every summary table from the whole table, 
+        with check only count the summary rows which differ from the recompute instead
+        """
+        counts = {}
+        async with DBConnection.get_pool().acquire() as conn:
+            for aggregate in self.aggregates:
+                if check:
+                    counts[aggregate.name] = await aggregate.check(conn)
+                else:
+                    await aggregate.rebuild(conn)
+        return counts
+
+
 class Interface():
     def __init__(
             self, schema_name: str, table_name: str, fields: FieldEnum, 
-            field_dtypes: DTypeEnum, cargotable_name: str, cargo_suffix: str, on_conflict: str = ''
+            field_dtypes: DTypeEnum, cargotable_name: str, cargo_suffix: str, on_conflict: str = 'ignore',
+            conflicts: list[str] = None, partition_by: str = None, 
+            dimension_columns: dict[str, tuple[str, str]] = None, aggregates: dict = None,
+            read_filters: dict[str, list[str]] = None
     ) -> None:
         self.api_interface = APIInterface(
             fields, field_dtypes, cargo_suffix, cargotable_name
         )
         self.local_interface = LocalInterface(
-            table_name, fields, field_dtypes, schema_name, on_conflict
+            table_name, fields, field_dtypes, schema_name, on_conflict, conflicts, partition_by, dimension_columns,
+            aggregates, read_filters
         )
 
 
+    async def read(self, start_date: str = None, end_date: str = None, columns: list[str] = None, **filters):
+        """Return rows of the local table, see LocalInterface.read"""
+        return await self.local_interface.read(start_date, end_date, columns, **filters)
+
+
 class SGInterface(Interface):
-    def __init__(self):
-        on_conflict = """"""
+    def __init__(
+            self, on_conflict: str = 'ignore', partition_by: str = None, normalized: bool = False,
+            aggregated: bool = False
+        ):
         super().__init__(
-            schema_name='fandom_schema', table_name='scoreboard_games', fields=SGFields, field_dtypes=SGDTypes,
-            cargotable_name='ScoreboardGames', cargo_suffix='SG'
+            schema_name='fandom_schema', 
+            table_name='scoreboard_games_normalized' if normalized else 'scoreboard_games', 
+            fields=SGFields, field_dtypes=SGDTypes,
+            cargotable_name='ScoreboardGames', cargo_suffix='SG', on_conflict=on_conflict,
+            conflicts=['game_id', 'match_id'], partition_by=partition_by,
+            dimension_columns=SG_DIMENSION_COLUMNS if normalized else None,
+            aggregates=SG_AGGREGATES if aggregated else None, read_filters=SG_READ_FILTERS
     )
 
 
 class SPInterface(Interface):
-    def __init__(self):
+    def __init__(
+            self, on_conflict: str = 'ignore', partition_by: str = None, normalized: bool = False,
+            aggregated: bool = False
+        ):
         super().__init__(
-            schema_name='fandom_schema', table_name='scoreboard_players', fields=SPFields, field_dtypes=SPDTypes,
-            cargotable_name='ScoreboardPlayers', cargo_suffix='SP', 
+            schema_name='fandom_schema', 
+            table_name='scoreboard_players_normalized' if normalized else 'scoreboard_players', 
+            fields=SPFields, field_dtypes=SPDTypes,
+            cargotable_name='ScoreboardPlayers', cargo_suffix='SP', on_conflict=on_conflict,
+            conflicts=['name', 'game_id', 'match_id'], partition_by=partition_by,
+            dimension_columns=SP_DIMENSION_COLUMNS if normalized else None,
+            aggregates=SP_AGGREGATES if aggregated else None, read_filters=SP_READ_FILTERS
     )
 
 
@@ -1,90 +1,1046 @@
 import asyncio
+import json
 import time
-from collections.abc import Iterable, Awaitable
+from collections import deque
+from collections.abc import AsyncIterator, Iterable, Awaitable
 import concurrent.futures
+import os
 import random
-from DBInterface import Interface, SPInterface, SGInterface
-from pandas import DataFrame, date_range, Timedelta
+import socket
+from dataclasses import dataclass, field
+from DBInterface import Interface, JoinedAPIInterface, SPInterface, SGInterface
+from connections import DBConnection, ApiConnection, AsyncCargoClient
+from etl_state import CheckpointStore, DeadLetterStore, FingerprintStore, LeaseStore, window_days
+from transform import (
+    clean_changed_rows, clean_changed_rows_ipc, frame_from_ipc, get_fingerprint, get_process_context,
+    split_malformed_rows, pa
+)
+from response_cache import ResponseCache
+from parquet_export import ParquetExporter
+from fields import dtype_wiki2copy
+from metrics import registry
+from pandas import DataFrame, Timedelta, Timestamp, concat
+
+
+class WindowPlanner:
+    """
+    Plans the datetime windows queried from the api.
+    Window widths adapt to the row counts reported for finished windows, 
+    widening across sparse periods and narrowing over dense ones
+    so each window fits in about target_pages pages.
+    """
+    datetime_format = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(
+            self,
+            start_date: str,
+            end_date: str,
+            page_size: int,
+            target_pages: float = 1.5,
+            initial_width: Timedelta = Timedelta(days=1),
+            min_width: Timedelta = Timedelta(hours=1),
+            max_width: Timedelta = Timedelta(days=32),
+            max_growth: float = 4,
+            covered: list[tuple[str, str]] = None,
+            windows: list[tuple[str, str]] = None
+        ) -> None:
+        self.cursor = Timestamp(start_date)
+        self.end = Timestamp(end_date)
+        self.page_size = page_size
+        self.target_pages = target_pages
+        self.width = initial_width
+        self.min_width = min_width
+        self.max_width = max_width
+        self.max_growth = max_growth
+        self.covered = sorted(
+            (Timestamp(s), Timestamp(e)) for s, e in ([] if covered is None else covered)
+        )
+        self.last_report = None
+        self.fixed_windows = None if windows is None else deque(
+            w for w in windows if (Timestamp(w[0]), Timestamp(w[1])) not in self.covered
+        )
+
+    def next_window(self) -> tuple[str, str] | None:
+        """
+        Return the next (start, end) window, or None once the date range is covered.
+        Spans inside already covered windows are skipped.
+        When the planner was given fixed windows they are returned in order instead.
+        """
+        if self.fixed_windows is not None:
+            return self.fixed_windows.popleft() if self.fixed_windows else None
+        self.skip_covered()
+        if self.cursor >= self.end:
+            return None
+        window_end = min(self.cursor + self.width, self.end, self.next_covered_start())
+        window = (self.cursor.strftime(self.datetime_format), window_end.strftime(self.datetime_format))
+        self.cursor = window_end
+        return window
+
+    def skip_covered(self) -> None:
+        """Move the cursor past any covered window it falls inside"""
+        for start, end in self.covered:
+            if start <= self.cursor < end:
+                self.cursor = end
+
+    def next_covered_start(self) -> Timestamp:
+        """Return the start of the first covered window after the cursor"""
+        for start, _ in self.covered:
+            if start > self.cursor:
+                return start
+        return self.end
+
+    def report(self, window: tuple[str, str], rows: int) -> None:
+        """Resize the following windows from the rows found in a finished window, kept as last_report"""
+        self.last_report = (window, rows)
+        window_width = Timestamp(window[1]) - Timestamp(window[0])
+
+        if rows:
+            width = window_width * (self.target_pages * self.page_size / rows)
+        else:
+            width = window_width * self.max_growth
+        width = min(width, self.width * self.max_growth)
+        self.width = max(self.min_width, min(self.max_width, width))
+
+
+@dataclass
+class Page:
+    """
+    One page of a window moving through the extract, transform and load stages,
+    entries holds the raw cargo rows until the transform stage replaces them with a DataFrame
+    """
+    job: 'APIETL'
+    window: tuple[str, str]
+    offset: int
+    entries: list[dict] | DataFrame
+    fingerprint: tuple | None = None
+    failed: bool = False
+
+
+@dataclass
+class WindowProgress:
+    """
+    Pages of a window loaded so far, the window is complete once every extracted page is loaded or dead lettered.
+    Dead lettered pages are kept out of loaded_offsets so the window resumes from the first of them.
+    """
+    first_offset: int = 0
+    pages_queued: int = 0
+    pages_expected: int | None = None
+    loaded_offsets: set = field(default_factory=set)
+    failed_offsets: set = field(default_factory=set)
+    rows: int = 0
+    failed: bool = False
+
+    @property
+    def complete(self) -> bool:
+        return (
+            self.pages_expected is not None
+            and len(self.loaded_offsets) + len(self.failed_offsets) == self.pages_expected
+        )
+
+
+class QueueDepth:
+    """Samples the depth of a stage's input queue"""
+    def __init__(self, name: str, queue: asyncio.Queue) -> None:
+        self.name = name
+        self.queue = queue
+        self.samples = 0
+        self.total = 0
+        self.max = 0
+
+    def sample(self) -> None:
+        depth = self.queue.qsize()
+        self.samples += 1
+        self.total += depth
+        self.max = max(self.max, depth)
+
+    def summary(self) -> str:
+        mean = self.total / self.samples if self.samples else 0
+        return f"{self.name}: depth = {self.queue.qsize()}/{self.queue.maxsize}, mean = {mean:.1f}, max = {self.max}"
 
 
 class APIETL:
-    def __init__( self, rate: float, n_workers: int, start_date: str, end_date: str, interface):
+    def __init__( 
+            self, rate: float, n_workers: int, start_date: str, end_date: str | None, interface, 
+            async_http: bool = False, resume: bool = True, incremental: bool = False, 
+            lookback: Timedelta = Timedelta(days=3), weight: float = 1,
+            response_cache: ResponseCache = None, transform_mode: str = 'thread', leased: bool = False,
+            export: ParquetExporter = None, tail: bool = False, tail_span: Timedelta = Timedelta(days=1),
+            poll_interval: float = 60, notify_channel: str = None, joined=None
+        ):
+        """
+        ETL job for one table.
+        Backfills start_date to end_date, skipping windows completed by earlier runs when resume is set.
+        In incremental mode only the span from the loaded high-water mark minus lookback 
+        to end_date is fetched again, end_date of None meaning the current time.
+        weight sets the job's share of workers when scheduled alongside other tables.
+        Cargo responses are served from and stored in response_cache when one is given,
+        in its replay mode the windows recorded in the cache are replayed without any api calls.
+        transform_mode of process cleans pages on the scheduler's process pool instead of its threads, 
+        returning them as Arrow IPC streams, which requires pyarrow.
+        With leased set, windows of lease_width are taken from a lease table shared with every other process 
+        running the same backfill instead of being planned locally, 
+        so any number of processes on any number of hosts can split one date range.
+        Every loaded batch is also appended to export when one is given.
+        With tail set the job runs until cancelled, polling the days from tail_span ago up to now 
+        every poll_interval seconds and fetching again only the days whose rows changed, see tail_windows.
+        Every committed batch which inserted or updated rows sends a NOTIFY on notify_channel,
+        which defaults to etl_loaded in tail mode.
+        With joined set to another interface, e.g. SPInterface alongside SGInterface, 
+        both tables are extracted together by one joined cargo query on GameId, see JoinedAPIInterface,
+        and each half is transformed, loaded and checkpointed by self.joined, a job which is never fed windows itself.
+        """
+        if transform_mode not in ('thread', 'process'):
+            raise ValueError(f'transform_mode must be thread or process, not {transform_mode}')
+        if transform_mode == 'process' and pa is None:
+            raise ImportError('pyarrow is required for the process transform mode')
+        if leased and incremental:
+            raise ValueError('leased windows are only supported for backfills, not incremental runs')
+        if tail and (leased or incremental or response_cache is not None):
+            raise ValueError('tail mode can not be combined with leased, incremental or cached runs')
         self.n_workers = n_workers
         self.rate = rate
         self.start_date = start_date
         self.end_date = end_date
+        self.resume = resume
+        self.incremental = incremental
+        self.lookback = lookback
+        self.weight = weight
         self.interface = interface
+        self.table = interface()
+        self.response_cache = response_cache
+        self.table.api_interface.response_cache = response_cache
+        self.export = export
         self.query_limit = 500
-
-    async def rate_limited_dates(self, queue: asyncio.Queue):
-        """Generates offsets at a controlled rate and inserts them into the queue"""
-        for i in date_range(self.start_date, self.end_date):
-            date_tuple = tuple( 
-                i.strftime('%Y-%m-%d') for i in (i, i + Timedelta(days=1))
+        self.async_http = async_http
+        self.transform_mode = transform_mode
+        self.executor = None
+        self.process_executor = None
+        self.async_client = None
+        self.planner = None
+        self.checkpoints = None
+        self.leased = leased
+        self.leases = None
+        self.lease_width = Timedelta(days=1)
+        self.lease_ttl = 300
+        self.lease_poll = 10
+        self.max_attempts = 3
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.max_retries = 4
+        self.retry_base = 0.5
+        self.retry_cap = 30
+        self.dead_letters = None
+        self.tail = tail
+        self.tail_span = tail_span
+        self.poll_interval = poll_interval
+        self.tail_signatures = {}
+        self.extracting_job = self
+        self.failed_windows = set()
+        if tail and notify_channel is None:
+            notify_channel = 'etl_loaded'
+        self.table.local_interface.notify_channel = notify_channel
+        self.joined = None
+        if joined is not None:
+            self.joined = APIETL(
+                rate, n_workers, start_date, end_date, joined, async_http=async_http, resume=resume,
+                incremental=incremental, lookback=lookback, weight=weight, transform_mode=transform_mode,
+                export=export, notify_channel=notify_channel
             )
-            await queue.put(date_tuple)
-            await asyncio.sleep(1 / self.rate)
-        await queue.join()
-        queue.shutdown()
+            self.joined.extracting_job = self
+            self.table.api_interface = JoinedAPIInterface(self.table.api_interface, self.joined.table.api_interface)
+            self.table.api_interface.response_cache = response_cache
+
+        self.pending = deque()
+        self.lookahead = n_workers
+        self.windows = {}
+        self.known_fingerprints = {}
+        self.fingerprinted_days = {}
+        self.load_queue = None
+        self.load_batch_rows = 5000
+        self.feed_done = False
+        self.served = 0
+        self.api_calls = 0
+        self.windows_done = 0
+        self.rows = 0
+        self.pages_unchanged = 0
+        self.rows_unchanged = 0
+        self.load_counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    @property
+    def name(self) -> str:
+        return self.table.local_interface.table_name
 
     async def run(self):
-        """Runs ETL process, starts rate limited queue and create pool of workers"""
-        self.queue = asyncio.Queue(maxsize=self.n_workers)
-        queue_input = asyncio.create_task(self.rate_limited_dates(self.queue))
+        """Runs ETL process for this table alone"""
+        scheduler = ETLScheduler([self], self.n_workers, self.rate, async_http=self.async_http)
+        await scheduler.run()
 
-        workers = [
-            asyncio.create_task(self.worker(i)) 
-            for i in range(self.n_workers)
-        ]
+    @property
+    def extracted_jobs(self) -> list['APIETL']:
+        """Return the jobs loading the pages this job extracts"""
+        return [self] if self.joined is None else [self, self.joined]
 
-        await asyncio.gather(*workers)
-        queue_input.cancel()
+    async def setup(self) -> None:
+        """Register this table's temp table on pooled connections and plan its windows"""
+        if self.joined is not None:
+            await self.joined.setup()
+        local_interface = self.table.local_interface
+        await DBConnection.register_init_query(
+            local_interface.temp_table_name, local_interface.get_create_temp_query()
+        )
+        if local_interface.aggregates:
+            await DBConnection.register_init_query(
+                local_interface.delta_table_name, local_interface.get_create_delta_query()
+            )
+            await local_interface.setup_aggregates()
+        self.checkpoints = CheckpointStore(local_interface.schema_name, local_interface.table_name)
+        self.fingerprints = FingerprintStore(local_interface.schema_name, local_interface.table_name)
+        await self.fingerprints.setup()
+        if local_interface.dimensions is not None:
+            await local_interface.dimensions.setup()
+        if self.export is not None:
+            api_interface = self.table.api_interface
+            column_types = {
+                name: dtype_wiki2copy[api_interface.field_dtypes[value]] 
+                for name, value in api_interface.fields.__members__.items()
+            }
+            self.export.add_table(self.name, column_types, local_interface.conflicts)
+        self.dead_letters = DeadLetterStore(local_interface.schema_name, local_interface.table_name)
+        await self.dead_letters.setup()
+        self.planner = await self.get_planner()
+        if self.leased:
+            await self.seed_leases()
 
-    async def worker(self, worker_i):
+    async def get_planner(self) -> WindowPlanner:
+        """
+        Set up the checkpoint table and plan windows for this run,
+        resuming from checkpoints or from the high-water mark in incremental mode
+        """
+        await self.checkpoints.setup()
+        start_date, end_date = self.start_date, self.end_date
+        if end_date is None:
+            end_date = Timestamp.now('UTC').tz_localize(None).ceil('h')
+
+        self.resume_offsets, covered = {}, []
+        if self.incremental:
+            high_water_mark = await self.checkpoints.high_water_mark()
+            if self.joined is not None and high_water_mark is not None:
+                joined_mark = await self.joined.checkpoints.high_water_mark()
+                high_water_mark = None if joined_mark is None else min(high_water_mark, joined_mark)
+            if high_water_mark is not None:
+                lookback_start = (high_water_mark - self.lookback).floor('D')
+                start_date = max(Timestamp(start_date), lookback_start)
+        elif self.resume:
+            completed, self.resume_offsets = await self.checkpoints.load()
+            if self.joined is not None:
+                # a joined window is only done once both tables completed it
+                joined_completed, joined_offsets = await self.joined.checkpoints.load()
+                completed = [window for window in completed if window in set(joined_completed)]
+                for window, offset in joined_offsets.items():
+                    self.resume_offsets[window] = min(offset, self.resume_offsets.get(window, offset))
+            covered = completed + list(self.resume_offsets)
+
+        windows = None
+        if self.response_cache is not None and self.response_cache.mode == 'replay':
+            windows = self.response_cache.recorded_windows(
+                self.table.api_interface.cargo_tables, start_date, end_date
+            )
+
+        return WindowPlanner(start_date, end_date, self.query_limit, covered=covered, windows=windows)
+
+    async def seed_leases(self) -> None:
+        """
+        Set up the lease table and add this run's windows to it.
+        Windows are cut at fixed lease_width steps from start_date so every process seeds the same windows.
+        """
+        local_interface = self.table.local_interface
+        self.leases = LeaseStore(
+            local_interface.schema_name, local_interface.table_name, self.owner,
+            lease_ttl=self.lease_ttl, max_attempts=self.max_attempts
+        )
+        await self.leases.setup()
+        width = self.lease_width
+        seeder = WindowPlanner(
+            self.planner.cursor, self.planner.end, self.query_limit, 
+            initial_width=width, min_width=width, max_width=width
+        )
+        windows = []
+        while (window := seeder.next_window()) is not None:
+            windows.append(window)
+        await self.leases.seed(windows)
+
+    async def leased_windows(self) -> AsyncIterator[tuple[tuple[str, str], int]]:
+        """
+        Generates windows claimed from the lease table with the offset to resume them from.
+        While no window can be claimed but others are still leased, 
+        polls every lease_poll seconds in case their owner stops and their lease expires.
+        Windows whose lease expired on their last attempt are marked failed, 
+        and every failed window is reported once no window is left.
+        """
+        while True:
+            for window in await self.leases.fail_expired():
+                registry.inc('etl_lease_windows_failed_total', table=self.name)
+                print(f"{self.name} gave up on window = {window[0]} to {window[1]} after {self.max_attempts} attempts")
+            window = await self.leases.claim()
+            if window is not None and any(window in job.windows for job in self.extracted_jobs):
+                # reclaimed after its lease expired while this process is still loading it
+                continue
+            if window is not None:
+                yield window, min([await job.checkpoints.resume_offset(window) for job in self.extracted_jobs])
+            elif await self.leases.outstanding():
+                await asyncio.sleep(self.lease_poll)
+            else:
+                break
+        failed = await self.leases.failed()
+        if failed:
+            windows = ', '.join(f'{start} to {end}' for start, end in failed)
+            print(f"{self.name} windows given up on after {self.max_attempts} attempts: {windows}")
+
+    async def heartbeat_leases(self) -> None:
+        """Extend this process' leases every third of lease_ttl"""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            await self.leases.heartbeat()
+
+    async def tail_windows(self) -> AsyncIterator[tuple[tuple[str, str], int]]:
+        """
+        Generates the recent days whose cargo rows changed, forever.
+        Every poll_interval seconds each day from tail_span ago up to now is probed with a single row query
+        of its row count and newest row id, only days whose signature moved since their last fetch are yielded.
+        Days still being extracted or loaded are left for the next poll.
+        """
+        datetime_format = WindowPlanner.datetime_format
+        while True:
+            now = Timestamp.now('UTC').tz_localize(None)
+            day = (now - self.tail_span).floor('D')
+            for window in list(self.tail_signatures):
+                if Timestamp(window[0]) < day:
+                    del self.tail_signatures[window]
+
+            while day <= now:
+                window = (day.strftime(datetime_format), (day + Timedelta(days=1)).strftime(datetime_format))
+                day += Timedelta(days=1)
+                in_flight = any(window in job.windows for job in self.extracted_jobs)
+                if in_flight or any(w == window for w, _ in self.pending):
+                    continue
+                try:
+                    signature = await self.with_retries('probe', self.probe_window, window)
+                except Exception as e:
+                    print(f"{self.name} probe failed for window = {window[0]} to {window[1]}: {e!r}")
+                    continue
+                changed = self.tail_signatures.get(window) != signature
+                registry.inc('etl_tail_probes_total', table=self.name, changed=str(changed).lower())
+                if changed:
+                    self.tail_signatures[window] = signature
+                    yield window, 0
+            await asyncio.sleep(self.poll_interval)
+
+    async def probe_window(self, window: tuple[str, str]) -> tuple:
+        """Return the signature of a window, see APIInterface.probe"""
+        api_interface = self.table.api_interface
+        if self.async_client is not None:
+            return await api_interface.async_probe(self.async_client, window[0], window[1])
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, api_interface.probe, window[0], window[1])
+
+    async def planned_windows(self, cond: asyncio.Condition):
+        """
+        Generates windows from the planner into self.pending, at most self.lookahead ahead of the workers,
+        api requests made for them are throttled by ApiConnection.rate_limiter
+        """
+        async def put(item):
+            async with cond:
+                await cond.wait_for(lambda: len(self.pending) < self.lookahead)
+                self.pending.append(item)
+                cond.notify_all()
+
+        if self.tail:
+            async for window, offset in self.tail_windows():
+                await put((window, offset))
+        elif self.leased:
+            async for window, offset in self.leased_windows():
+                await put((window, offset))
+        else:
+            for window, offset in self.resume_offsets.items():
+                await put((window, offset))
+            while (window := self.planner.next_window()) is not None:
+                await put((window, 0))
+
+        async with cond:
+            self.feed_done = True
+            cond.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.feed_done and not self.pending
+
+    def is_transient_error(self, error: Exception) -> bool:
+        return ApiConnection.is_transient_error(error) or DBConnection.is_transient_error(error)
+
+    async def with_retries(self, stage: str, func, *args):
+        """
+        Await func(*args), retrying transient errors up to max_retries times 
+        after a full jitter exponential backoff. Permanent errors are raised straight away.
+        The raised error's attempts attribute holds the number of attempts made, for dead letters.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await func(*args)
+            except Exception as e:
+                transient = self.is_transient_error(e)
+                registry.inc(
+                    'etl_errors_total', table=self.name, stage=stage, kind='transient' if transient else 'permanent'
+                )
+                if not transient or attempt == self.max_retries:
+                    e.attempts = attempt + 1
+                    raise
+            registry.inc('etl_stage_retries_total', table=self.name, stage=stage)
+            await asyncio.sleep(random.uniform(0, min(self.retry_cap, self.retry_base * 2 ** attempt)))
+
+    async def dead_letter(
+            self, window: tuple[str, str], offset: int, stage: str, error: Exception, payload: str | None = None
+        ) -> None:
+        """Persist permanently failed work with the attempts made on it, never raising so the stage carries on"""
+        registry.inc('etl_dead_letters_total', table=self.name, stage=stage)
+        print(f"{self.name} {stage} failed for window = {window[0]} to {window[1]}, offset = {offset}: {error!r}")
+        try:
+            await self.with_retries(
+                'dead_letter', self.dead_letters.record, window, offset, stage, error, payload,
+                getattr(error, 'attempts', 1)
+            )
+        except Exception as e:
+            print(f"{self.name} could not store dead letter: {e!r}")
+
+    async def extract_window(self, worker_i: int, window: tuple[str, str], offset: int, transform_queue: asyncio.Queue):
+        """
+        Extract stage for one window in the api database.
+        Pages through the window until a short page comes back, passing each raw page on to the transform stage.
+        A page which still fails after retries is dead lettered and the rest of the window is left for a later run,
+        a leased window is released for retrying once its queued pages are loaded 
+        and a tailed window is fetched again on the next poll.
+        """
+        jobs = self.extracted_jobs
+        if not offset:
+            for job in jobs:
+                await self.with_retries('checkpoint', job.checkpoints.reset_window, window)
+        for job in jobs:
+            job.windows[window] = WindowProgress(first_offset=offset)
+        first_offset = offset
+        window_rows = 0
+        while True:
+            try:
+                with registry.timer('etl_extract_page_seconds', table=self.name):
+                    raw_query = await self.with_retries(
+                        'extract', self.worker_api_call, self.table, window, offset
+                    )
+            except Exception as e:
+                await self.dead_letter(window, offset, 'extract', e)
+                self.tail_signatures.pop(window, None)
+                for job in jobs:
+                    await job.abandon_window(window)
+                return
+            self.api_calls += 1
+            window_rows += len(raw_query)
+
+            last_page = len(raw_query) < self.query_limit
+            pages = [raw_query]
+            if self.joined is not None:
+                loop = asyncio.get_running_loop()
+                pages = await loop.run_in_executor(self.executor, self.table.api_interface.split_raw_query, raw_query)
+            for job, rows in zip(jobs, pages):
+                if last_page:
+                    job.windows[window].pages_expected = (offset - first_offset) // self.query_limit + 1
+                await transform_queue.put(Page(job, window, offset, rows))
+                job.windows[window].pages_queued += 1
+
+            if last_page:
+                break
+            offset += self.query_limit
+
+        self.planner.report(window, window_rows)
+        registry.inc('etl_windows_extracted_total', table=self.name)
+        registry.inc('etl_window_rows_total', window_rows, table=self.name)
+        registry.set('etl_last_window_rows', window_rows, table=self.name)
+
+    async def abandon_window(self, window: tuple[str, str]) -> None:
+        """Drop a window whose extraction failed once the pages already queued are loaded, so it can be extracted again"""
+        progress = self.windows[window]
+        progress.failed = True
+        progress.pages_expected = progress.pages_queued
+        if progress.complete:
+            await self.finish_window(window)
+
+    async def finish_window(self, window: tuple[str, str]) -> None:
+        """
+        Forget a window whose pages are all loaded or dead lettered.
+        Once every job extracted with it has finished the window, 
+        its lease is completed, or released for retrying if any of them failed.
+        """
+        extracting_job = self.extracting_job
+        if self.windows[window].failed:
+            extracting_job.failed_windows.add(window)
+        last = not any(window in job.windows for job in extracting_job.extracted_jobs if job is not self)
+        if last and extracting_job.leases is not None:
+            if window in extracting_job.failed_windows:
+                await extracting_job.leases.release(window)
+            else:
+                await extracting_job.leases.complete(window)
+        if last:
+            extracting_job.failed_windows.discard(window)
+        del self.windows[window]
+        self.forget_fingerprints(window)
+
+    def forget_fingerprints(self, window: tuple[str, str]) -> None:
+        """Drop the cached fingerprints of the days a finished window covered, no other window touches them"""
+        for day in window_days(window, whole=True):
+            self.known_fingerprints.pop(day, None)
+            self.fingerprinted_days.pop(day, None)
+
+    async def known_row_hashes(self, window: tuple[str, str]) -> set[str]:
+        """
+        Return the row hashes stored for the days of a window, loading days not cached yet in one query.
+        A lookup which fails is dropped from the cache so the next page of its days tries again.
+        """
+        days = window_days(window)
+        missing = [day for day in days if day not in self.known_fingerprints]
+        if missing:
+            loading = asyncio.ensure_future(self.with_retries('checkpoint', self.fingerprints.load_days, missing))
+            for day in missing:
+                self.known_fingerprints[day] = loading
+        known = set()
+        for day in days:
+            loading = self.known_fingerprints[day]
+            try:
+                known.update((await loading).get(day, ()))
+            except Exception:
+                for cached_day in [d for d, cached in self.known_fingerprints.items() if cached is loading]:
+                    del self.known_fingerprints[cached_day]
+                raise
+        return known
+
+    async def worker_api_call(self, worker_interface: Interface, window: tuple[str], offset: int):
+        """
+        Extract a raw page from api, on the run's shared executor 
+        or directly on the event loop when using the async http client
+        """
+        if self.async_client is not None:
+            return await worker_interface.api_interface.async_raw_query_api(
+                self.async_client, offset, window[0], window[1], self.query_limit
+            )
+
+        loop = asyncio.get_running_loop()
+        query_result = await loop.run_in_executor(
+            self.executor,
+            worker_interface.api_interface.raw_query_api,
+            offset, window[0], window[1], self.query_limit
+        )
+
+        return query_result
+
+    async def transform_page(self, page: Page) -> None:
+        """
+        Transform stage for one page, cleaning it on the shared executor then queueing it for loading.
+        Only rows whose hashes are not stored for their day are kept.
+        If the page fails to clean, rows which fail on their own are dead lettered and the rest are kept,
+        if none does the error is raised for the transformer to drop the page.
+        """
+        known = await self.known_row_hashes(page.window)
+
+        loop = asyncio.get_running_loop()
+        api_interface = self.table.api_interface
+        rows = page.entries
+        try:
+            with registry.timer('etl_transform_seconds', table=self.name, mode=self.transform_mode):
+                if self.transform_mode == 'process':
+                    buffer, page.fingerprint = await loop.run_in_executor(
+                        self.process_executor, clean_changed_rows_ipc, 
+                        api_interface.fields, api_interface.field_dtypes, rows, known
+                    )
+                    page.entries = await loop.run_in_executor(self.executor, frame_from_ipc, buffer)
+                else:
+                    page.entries, page.fingerprint = await loop.run_in_executor(
+                        self.executor, clean_changed_rows, 
+                        api_interface.fields, api_interface.field_dtypes, rows, known
+                    )
+        except Exception as e:
+            valid, malformed = await loop.run_in_executor(
+                self.executor, split_malformed_rows, api_interface.fields, api_interface.field_dtypes, rows
+            )
+            if not malformed:
+                # no row fails on its own, so the page failed for another reason, e.g. a broken process pool
+                raise
+            print(f"{self.name} transform failed for window = {page.window[0]} to {page.window[1]}, "
+                  f"offset = {page.offset} on {len(malformed)} malformed rows: {e!r}")
+            for row, error in malformed:
+                registry.inc('etl_errors_total', table=self.name, stage='transform', kind='permanent')
+                await self.dead_letter(page.window, page.offset, 'transform', error, json.dumps([row]))
+            page.entries, _ = await loop.run_in_executor(
+                self.executor, clean_changed_rows, api_interface.fields, api_interface.field_dtypes, valid, known
+            )
+            # fingerprint the whole page so malformed rows are only dead lettered again once they change
+            page.fingerprint = get_fingerprint(rows)
+        if known:
+            unchanged_rows = page.fingerprint[0] - len(page.entries)
+            unchanged_page = unchanged_rows == page.fingerprint[0]
+            self.pages_unchanged += unchanged_page
+            self.rows_unchanged += unchanged_rows
+            registry.inc('etl_pages_unchanged_total', unchanged_page, table=self.name)
+            registry.inc('etl_rows_skipped_total', unchanged_rows, table=self.name)
+        await self.load_queue.put(page)
+
+    async def load_stage(self) -> None:
         """
-        Worker in pool which retrieves date from async queue and performs etl process for that date in the api database.
+        Load stage for this table.
+        Batches whichever pages are waiting, up to load_batch_rows rows, into one insert.
         """
-        worker_interface = self.interface()
         while True:
             try:
-                date_tuple = await self.queue.get()
+                page = await self.load_queue.get()
             except asyncio.QueueShutDown:
                 break
-            
-            for i in range(5):
-                offset = i * self.query_limit
-                query_result = await self.worker_api_call(worker_interface, date_tuple, offset)
-                await self.worker_insert_entries(query_result, worker_interface)
-                print(f"{worker_i = :<5} on date = { date_tuple[0]: <8} processed {len(query_result):<5} entries")
-
-                if not len(query_result):
+
+            batch, batch_rows = [page], len(page.entries)
+            while batch_rows < self.load_batch_rows:
+                try:
+                    page = self.load_queue.get_nowait()
+                except (asyncio.QueueEmpty, asyncio.QueueShutDown):
                     break
-            self.queue.task_done()
+                batch.append(page)
+                batch_rows += len(page.entries)
+
+            try:
+                await self.load_batch(batch)
+            except Exception as e:
+                registry.inc('etl_errors_total', table=self.name, stage='checkpoint', kind='permanent')
+                print(f"{self.name} could not checkpoint batch of {len(batch)} pages: {e!r}")
+
+    async def insert_pages(self, pages: list[Page]) -> None:
+        """
+        Insert pages in one statement, retrying transient errors.
+        If it fails permanently the pages are inserted one at a time 
+        and each page which still fails is dead lettered with its cleaned rows.
+        """
+        frames = [page.entries for page in pages if len(page.entries)]
+        if not frames:
+            return
+        try:
+            with registry.timer('etl_load_batch_seconds', table=self.name):
+                counts = await self.with_retries(
+                    'load', self.worker_insert_entries, concat(frames, ignore_index=True), self.table
+                )
+        except Exception as e:
+            if len(frames) == 1:
+                page = next(page for page in pages if len(page.entries))
+                payload = page.entries.to_json(orient='records', date_format='iso')
+                await self.dead_letter(page.window, page.offset, 'load', e, payload)
+                # fetch a tailed day again on the next poll even if its cargo rows do not change
+                self.extracting_job.tail_signatures.pop(page.window, None)
+                # leave the page's fingerprint unrecorded so a later refresh of its window loads it again
+                page.entries, page.fingerprint, page.failed = page.entries.iloc[:0], None, True
+                return
+            for page in pages:
+                await self.insert_pages([page])
+            return
+        for k, v in counts.items():
+            self.load_counts[k] += v
+
+    async def load_batch(self, batch: list[Page]) -> None:
+        """Insert a batch of pages, export them, then checkpoint every window they belong to"""
+        await self.insert_pages(batch)
+        registry.inc('etl_load_batches_total', table=self.name)
+        if self.export is not None:
+            await self.export_pages(batch)
+        registry.inc('etl_pages_loaded_total', len(batch), table=self.name)
+
+        touched = {}
+        for page in batch:
+            progress = self.windows[page.window]
+            if page.failed:
+                progress.failed_offsets.add(page.offset)
+                progress.failed = True
+            else:
+                progress.loaded_offsets.add(page.offset)
+            progress.rows += len(page.entries)
+            touched.setdefault(page.window, []).append(page)
 
-    async def worker_api_call(self, worker_interface: Interface, date_tuple: tuple[str], offset: int):
-        """Extract data from api"""
+        touched_days = set()
+        for page in batch:
+            if page.fingerprint is not None:
+                for day, row_hashes in page.fingerprint[2].items():
+                    self.fingerprinted_days.setdefault(day, set()).update(row_hashes)
+                    touched_days.add(day)
+        await self.with_retries('checkpoint', self.fingerprints.record_days, {
+            day: self.fingerprinted_days[day] for day in touched_days
+        })
+        for window, pages in touched.items():
+            await self.with_retries('checkpoint', self.checkpoint_window, window, pages)
+
+    async def export_pages(self, pages: list[Page]) -> None:
+        """Append loaded pages to the parquet export, a failed export is counted and does not stop loading"""
+        frames = [page.entries for page in pages if len(page.entries)]
+        if not frames:
+            return
         loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self.export.write, self.name, concat(frames, ignore_index=True))
+        except Exception as e:
+            registry.inc('etl_errors_total', table=self.name, stage='export', kind='permanent')
+            print(f"{self.name} export of {len(frames)} pages failed: {e!r}")
+
+    async def checkpoint_window(self, window: tuple[str, str], pages: list[Page]) -> None:
+        """
+        Record loaded pages of a window, resuming later from the first offset not loaded yet.
+        The window is marked complete once every page is loaded, unless its extraction failed part way.
+        """
+        progress = self.windows[window]
+        next_offset = progress.first_offset
+        while next_offset in progress.loaded_offsets:
+            next_offset += self.query_limit
+        entries = concat([page.entries for page in pages], ignore_index=True)
+        await self.checkpoints.record_page(window, next_offset, entries)
+
+        if progress.complete:
+            if not progress.failed:
+                await self.checkpoints.complete_window(window)
+                self.windows_done += 1
+                self.rows += progress.rows
+                registry.inc('etl_windows_completed_total', table=self.name)
+            await self.finish_window(window)
+
+    async def worker_insert_entries(self, query_result: DataFrame, worker_interface: Interface) -> dict[str, int]:
+        return await worker_interface.local_interface.insert_new(query_result)
+
+    def progress(self) -> str:
+        """Return one line summary of this table's progress"""
+        cursor = '' if self.planner is None else f", planned up to {self.planner.cursor}"
+        if self.planner is not None and self.planner.last_report is not None:
+            (start, end), rows = self.planner.last_report
+            cursor += f", last window = {start} to {end} with {rows} rows, next width = {self.planner.width}"
+        return (
+            f"{self.name}: windows = {self.windows_done}, api calls = {self.api_calls}, "
+            f"rows = {self.rows}, unchanged pages = {self.pages_unchanged}, "
+            f"unchanged rows = {self.rows_unchanged}, loaded = {self.load_counts}{cursor}"
+        )
+
+
+class ETLScheduler:
+    """
+    Runs any number of APIETL table jobs at once on one pool of workers,
+    sharing one executor, one connection pool and the process wide rate limiter.
+    Each free worker takes the next window of the job furthest behind its weighted share.
 
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            query_result = await loop.run_in_executor(
-                pool,
-                worker_interface.api_interface.query_api,
-                offset, date_tuple[0], date_tuple[1], self.query_limit
+    Work is pipelined through three stages connected by bounded queues, 
+    so extraction keeps using the rate budget while Postgres is loading:
+    extract workers fetch raw pages, transformers clean them,
+    and one loader per table batches cleaned pages into a single insert.
+    Jobs joined onto another job's extraction get a loader of their own but are never given windows.
+    """
+    def __init__(
+            self, jobs: list[APIETL], n_workers: int, rate: float, 
+            async_http: bool = False, progress_interval: float = 60,
+            n_transformers: int = 2, queue_pages: int = None, sample_interval: float = 1,
+            n_processes: int = None, metrics_sinks: list = None, metrics_interval: float = 10,
+            compact_interval: float = 300
+        ) -> None:
+        self.jobs = jobs
+        self.table_jobs = [j for job in jobs for j in job.extracted_jobs]
+        self.n_workers = n_workers
+        self.rate = rate
+        self.async_http = async_http
+        self.progress_interval = progress_interval
+        self.n_processes = os.cpu_count() if n_processes is None else n_processes
+        self.n_transformers = n_transformers
+        if any(job.transform_mode == 'process' for job in jobs):
+            self.n_transformers = max(n_transformers, self.n_processes)
+        self.queue_pages = 2 * n_workers if queue_pages is None else queue_pages
+        self.sample_interval = sample_interval
+        self.metrics_sinks = [] if metrics_sinks is None else metrics_sinks
+        self.metrics_interval = metrics_interval
+        self.compact_interval = compact_interval
+        self.exports = list({id(job.export): job.export for job in self.table_jobs if job.export is not None}.values())
+
+    async def run(self):
+        """
+        Runs ETL process, starts every job's window feed and create the pool of workers for each stage.
+        Metrics are pushed to metrics_sinks every metrics_interval seconds 
+        and summarised at the end of the run.
+        """
+        start_time = time.perf_counter()
+        for sink in self.metrics_sinks:
+            registry.add_sink(sink)
+        await DBConnection.open_pool(self.n_workers + len(self.jobs))
+        start_logins = ApiConnection.login_count
+        ApiConnection.rate_limiter.set_rate(self.rate)
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.n_workers + self.n_transformers, thread_name_prefix='api_worker'
+        )
+        process_executor = None
+        if any(job.transform_mode == 'process' for job in self.jobs):
+            # workers are started by a forkserver, forking this process while its threads hold locks can deadlock
+            process_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.n_processes, mp_context=get_process_context()
             )
+        async_client = AsyncCargoClient() if self.async_http else None
+        self.cond = asyncio.Condition()
+        self.transform_queue = asyncio.Queue(maxsize=self.queue_pages)
+        self.queue_depths = [QueueDepth('transform', self.transform_queue)]
+        feeds, monitors = [], []
 
-        return query_result
+        try:
+            for job in self.table_jobs:
+                job.executor, job.async_client = executor, async_client
+                job.process_executor = process_executor
+                job.lookahead = self.n_workers
+                job.load_queue = asyncio.Queue(maxsize=self.queue_pages)
+                self.queue_depths.append(QueueDepth(f'load {job.name}', job.load_queue))
+            for job in self.jobs:
+                await job.setup()
+            feeds = [asyncio.create_task(job.planned_windows(self.cond)) for job in self.jobs]
+            monitors = [
+                asyncio.create_task(self.report_progress()),
+                asyncio.create_task(self.sample_queue_depths()),
+                asyncio.create_task(self.flush_metrics()),
+                asyncio.create_task(self.compact_exports())
+            ] + [asyncio.create_task(job.heartbeat_leases()) for job in self.jobs if job.leased]
+
+            workers = [asyncio.create_task(self.worker(i)) for i in range(self.n_workers)]
+            transformers = [asyncio.create_task(self.transformer()) for _ in range(self.n_transformers)]
+            loaders = [asyncio.create_task(job.load_stage()) for job in self.table_jobs]
 
-    async def worker_insert_entries(self, query_result: DataFrame, worker_interface: Interface):
-        await worker_interface.local_interface.insert_new(query_result)
-        return None
+            await asyncio.gather(*workers)
+            self.transform_queue.shutdown()
+            await asyncio.gather(*transformers)
+            for job in self.table_jobs:
+                job.load_queue.shutdown()
+            await asyncio.gather(*loaders)
+            for export in self.exports:
+                await asyncio.get_running_loop().run_in_executor(executor, export.compact)
+        finally:
+            for task in feeds + monitors:
+                task.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            if process_executor is not None:
+                process_executor.shutdown(wait=False, cancel_futures=True)
+            if async_client is not None:
+                await async_client.close()
+            await DBConnection.close_pool()
+            print(f"api logins during run = {ApiConnection.login_count - start_logins}")
+            print(f"rate limiter stats = {ApiConnection.rate_limiter.stats()}")
+            for cache in {job.response_cache for job in self.jobs if job.response_cache is not None}:
+                print(f"response cache stats = {cache.stats()}")
+            for queue_depth in self.queue_depths:
+                print(queue_depth.summary())
+            for job in self.table_jobs:
+                print(job.progress())
+            print(registry.summary(time.perf_counter() - start_time))
+            registry.close_sinks()
+
+    def next_job(self) -> APIETL | None:
+        """Return the job with pending windows which has been served least relative to its weight"""
+        ready = [job for job in self.jobs if job.pending]
+        if not ready:
+            return None
+        return min(ready, key=lambda job: job.served / job.weight)
+
+    async def worker(self, worker_i):
+        """
+        Extract worker in pool which takes the next window from the fairest job and extracts its pages.
+        A window failing unexpectedly is left for a later run and the worker moves on.
+        Exits once every job's feed is exhausted.
+        """
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(
+                    lambda: any(job.pending for job in self.jobs) or all(job.finished for job in self.jobs)
+                )
+                job = self.next_job()
+                if job is None:
+                    break
+                window, offset = job.pending.popleft()
+                job.served += 1
+                self.cond.notify_all()
+
+            try:
+                await job.extract_window(worker_i, window, offset, self.transform_queue)
+            except Exception as e:
+                registry.inc('etl_errors_total', table=job.name, stage='extract', kind='permanent')
+                print(f"{job.name} extract worker {worker_i} failed on window = {window[0]} to {window[1]}: {e!r}")
+                started = [j for j in job.extracted_jobs if window in j.windows]
+                for j in started:
+                    if j.windows[window].pages_expected is None:
+                        await j.abandon_window(window)
+                if not started and job.leases is not None:
+                    await job.leases.release(window)
+
+    async def transformer(self):
+        """Transform worker which cleans raw pages until the extract stage has finished"""
+        while True:
+            try:
+                page = await self.transform_queue.get()
+            except asyncio.QueueShutDown:
+                break
+            try:
+                await page.job.transform_page(page)
+            except Exception as e:
+                kind = 'transient' if page.job.is_transient_error(e) else 'permanent'
+                registry.inc('etl_errors_total', table=page.job.name, stage='transform', kind=kind)
+                await self.drop_page(page, e)
+
+    async def drop_page(self, page: Page, error: Exception) -> None:
+        """
+        Dead letter a page which failed to transform and pass it on to loading empty,
+        so its window finishes without being marked complete and is extracted again by a later run, lease or poll
+        """
+        job = page.job
+        if isinstance(page.entries, DataFrame):
+            payload = page.entries.to_json(orient='records', date_format='iso')
+        else:
+            payload = json.dumps(page.entries)
+        await job.dead_letter(page.window, page.offset, 'transform', error, payload)
+
+        job.extracting_job.tail_signatures.pop(page.window, None)
+        page.entries, page.fingerprint, page.failed = DataFrame(), None, True
+        await job.load_queue.put(page)
+
+    async def report_progress(self):
+        """Print per table progress and queue depths every progress_interval seconds"""
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            for queue_depth in self.queue_depths:
+                print(queue_depth.summary())
+            for job in self.table_jobs:
+                print(job.progress())
+
+    async def sample_queue_depths(self):
+        while True:
+            await asyncio.sleep(self.sample_interval)
+            for queue_depth in self.queue_depths:
+                queue_depth.sample()
+                registry.set('etl_queue_depth', queue_depth.queue.qsize(), queue=queue_depth.name)
+
+    async def compact_exports(self):
+        """Compact the parquet exports in a background thread every compact_interval seconds"""
+        loop = asyncio.get_running_loop()
+        while self.exports:
+            await asyncio.sleep(self.compact_interval)
+            for export in self.exports:
+                try:
+                    await loop.run_in_executor(None, export.compact)
+                except Exception as e:
+                    registry.inc('etl_errors_total', table='export', stage='compact', kind='permanent')
+                    print(f"export compaction failed: {e!r}")
+
+    async def flush_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            registry.flush()
 
 
 async def main():
     sp_etl = APIETL(2, 5, '2016-10-15', '2024-11-01', SPInterface)
-    await sp_etl.run()
-    
     sg_etl = APIETL(2, 5, '2016-01-01', '2025-01-01', SGInterface)
-    await sg_etl.run()
+
+    scheduler = ETLScheduler([sp_etl, sg_etl], n_workers=10, rate=2)
+    await scheduler.run()
     
 
 if __name__ == '__main__':
@@ -0,0 +1,181 @@
+from collections.abc import Callable
+
+import asyncpg
+from asyncpg import Connection
+from metrics import registry
+
+
+# Aggregates map each summary table name to its key columns and one or more row mappings.
+# A row mapping maps every key and measure column to an SQL expression over one loaded row,
+# with {field} standing for the column the field is stored in.
+# Each loaded row contributes one summary row per mapping and measures are summed by key,
+# the first measure counts rows and summary rows whose count drops to zero are removed.
+SP_AGGREGATES = {
+    'player_stats': (['player', 'tournament'], [{
+        'player': '{name}',
+        'tournament': '{tournament}',
+        'games': '1',
+        'wins': "({win} = 'Yes')::int",
+        'kills': '{kills}',
+        'deaths': '{deaths}',
+        'assists': '{assists}',
+        'gold': '{gold}',
+        'cs': '{cs}',
+        'champ_damage': '{champ_damage}',
+        'vision_score': '{vision_score}',
+    }]),
+    'champion_stats': (['champion', 'tournament'], [{
+        'champion': '{champion}',
+        'tournament': '{tournament}',
+        'games': '1',
+        'wins': "({win} = 'Yes')::int",
+        'kills': '{kills}',
+        'deaths': '{deaths}',
+        'assists': '{assists}',
+    }]),
+}
+
+SG_AGGREGATES = {
+    'team_stats': (['team', 'tournament'], [
+        {
+            'team': '{team1}',
+            'tournament': '{tournament}',
+            'games': '1',
+            'wins': '({winner} = 1)::int',
+            'gold': '{team_1_gold}',
+            'gold_against': '{team_2_gold}',
+            'kills': '{team_1_kills}',
+            'kills_against': '{team_2_kills}',
+        },
+        {
+            'team': '{team2}',
+            'tournament': '{tournament}',
+            'games': '1',
+            'wins': '({winner} = 2)::int',
+            'gold': '{team_2_gold}',
+            'gold_against': '{team_1_gold}',
+            'kills': '{team_2_kills}',
+            'kills_against': '{team_1_kills}',
+        },
+    ]),
+}
+
+
+class AggregateTable:
+    """
+    Summary table of a loaded table, named <table>_<name>, kept up to date from the rows each batch changed.
+    LocalInterface.insert_new writes every inserted row, every new version of an updated row with sign 1
+    and the previous version of every updated row with sign -1 to a delta table in the insert's transaction,
+    apply then adds the signed measures of the delta to the summary before the batch commits.
+    get_column_name maps fields to the columns they are stored in, see QueryCreator.get_column_name.
+    """
+    def __init__(
+            self, schema_name: str, source_table: str, name: str, keys: list[str],
+            rows: list[dict[str, str]], get_column_name: Callable[[str], str]
+        ) -> None:
+        self.schema_name = schema_name
+        self.source_table = f'{schema_name}.{source_table}'
+        self.name = f'{source_table}_{name}'
+        self.target_table = f'{schema_name}.{self.name}'
+        self.keys = keys
+        self.measures = [c for c in rows[0] if c not in keys]
+        self.count_column = self.measures[0]
+        self.rows = [
+            {column: expression.format_map(ColumnNames(get_column_name)) for column, expression in row.items()}
+            for row in rows
+        ]
+
+    def get_rows_query(self, table: str, signed: bool = False) -> str:
+        """Return query of the summary rows contributed by each row of table, measures multiplied by sign if signed"""
+        selects = []
+        for row in self.rows:
+            columns = [f'{row[k]} AS {k}' for k in self.keys]
+            columns += [f"{'sign * ' if signed else ''}({row[m]}) AS {m}" for m in self.measures]
+            selects.append(f"SELECT {', '.join(columns)} FROM {table}")
+        return '\nUNION ALL\n'.join(selects)
+
+    def get_summary_query(self, table: str, signed: bool = False) -> str:
+        key_str = ', '.join(self.keys)
+        measure_str = ', '.join(f'coalesce(sum({m}), 0) AS {m}' for m in self.measures)
+        return f"""
+            SELECT {key_str}, {measure_str} FROM (
+            {self.get_rows_query(table, signed)}
+            ) contributed GROUP BY {key_str}
+        """
+
+    def get_create_query(self) -> str:
+        return f"""
+            CREATE TABLE {self.target_table} AS {self.get_summary_query(self.source_table)} WITH NO DATA;
+            ALTER TABLE {self.target_table} ADD CONSTRAINT {self.name}_keys
+             UNIQUE NULLS NOT DISTINCT ({', '.join(self.keys)});
+        """
+
+    def get_rebuild_query(self) -> str:
+        return f"""
+            TRUNCATE {self.target_table};
+            INSERT INTO {self.target_table} {self.get_summary_query(self.source_table)};
+        """
+
+    def get_apply_query(self, delta_table: str) -> str:
+        """
+        Return query adding the signed summary of delta_table to the summary table.
+        Keys are upserted in order so concurrent loaders lock summary rows in the same order.
+        """
+        key_str = ', '.join(self.keys)
+        set_str = ', '.join(f'{m} = target.{m} + EXCLUDED.{m}' for m in self.measures)
+        return f"""
+            INSERT INTO {self.target_table} AS target ({key_str}, {', '.join(self.measures)})
+            {self.get_summary_query(delta_table, signed=True)} ORDER BY {key_str}
+            ON CONFLICT ON CONSTRAINT {self.name}_keys DO UPDATE SET {set_str};
+            DELETE FROM {self.target_table} WHERE {self.count_column} <= 0;
+        """
+
+    def get_check_query(self) -> str:
+        """Return query counting summary rows which differ from the summary recomputed from the source table"""
+        key_match = ' AND '.join(f'kept.{k} IS NOT DISTINCT FROM rebuilt.{k}' for k in self.keys)
+        differs = ' OR '.join(
+            f'abs(kept.{m} - rebuilt.{m}) > 1e-6 * greatest(1, abs(rebuilt.{m}))' for m in self.measures
+        )
+        return f"""
+            SELECT count(*) FROM (SELECT *, TRUE AS present FROM {self.target_table}) kept
+            FULL JOIN ({self.get_summary_query(self.source_table)}) rebuilt ON {key_match}
+            WHERE kept.present IS NULL OR rebuilt.{self.count_column} IS NULL OR {differs};
+        """
+
+    async def setup(self, conn: Connection) -> None:
+        """Create the summary table if it does not exist yet, built from the rows already loaded"""
+        exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL;", self.target_table)
+        if exists:
+            return
+        try:
+            async with conn.transaction():
+                await conn.execute(self.get_create_query())
+                await conn.execute(self.get_rebuild_query())
+        except (asyncpg.DuplicateTableError, asyncpg.UniqueViolationError):
+            # created concurrently by another loader
+            pass
+
+    async def apply(self, conn: Connection, delta_table: str) -> None:
+        with registry.timer('etl_aggregate_seconds', table=self.name, step='apply'):
+            await conn.execute(self.get_apply_query(delta_table))
+
+    async def rebuild(self, conn: Connection) -> None:
+        """Recompute the whole summary, blocking loads into the source table until it commits"""
+        with registry.timer('etl_aggregate_seconds', table=self.name, step='rebuild'):
+            async with conn.transaction():
+                await conn.execute(f"LOCK TABLE {self.source_table} IN SHARE MODE;")
+                await conn.execute(self.get_rebuild_query())
+
+    async def check(self, conn: Connection) -> int:
+        """Return the number of summary rows which differ from a full recompute"""
+        return await conn.fetchval(self.get_check_query())
+
+
+class ColumnNames(dict):
+    """Mapping of field names to the columns they are stored in, for formatting expressions"""
+    def __init__(self, get_column_name: Callable[[str], str]) -> None:
+        super().__init__()
+        self.get_column_name = get_column_name
+
+    def __missing__(self, field: str) -> str:
+        return self.get_column_name(field)
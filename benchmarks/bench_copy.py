@@ -0,0 +1,46 @@
+import argparse
+import time
+import pandas as pd
+from binary_copy import encode_frame
+from fields import SPFields, SPDTypes, dtype_wiki2copy
+from benchmarks.synthetic import synthetic_rows, typed_frame
+
+
+def records_path(entries: pd.DataFrame) -> list[tuple]:
+    """Previous insert_new path, materialising the records handed to copy_records_to_table"""
+    entries = entries.replace({pd.NA: None})
+    return list(entries.itertuples(index=False))
+
+
+def best_of(repeats: int, func, *args) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare binary COPY encoding with the record tuple path')
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    entries = typed_frame(SPFields, SPDTypes, synthetic_rows(SPFields, SPDTypes, args.rows))
+    column_types = {
+        name: dtype_wiki2copy[SPDTypes[value]] for name, value in SPFields.__members__.items()
+    }
+
+    records_time = best_of(args.repeats, records_path, entries)
+    binary_time = best_of(args.repeats, encode_frame, entries, column_types)
+    payload_size = len(encode_frame(entries, column_types))
+
+    print(f"rows = {args.rows}, binary payload = {payload_size / 2**20:.1f} MiB")
+    print(f"replace + itertuples: {records_time:.3f}s ({args.rows / records_time:,.0f} rows/s)")
+    print(f"binary encode_frame:  {binary_time:.3f}s ({args.rows / binary_time:,.0f} rows/s)")
+    print(f"speedup = {records_time / binary_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import resource
+import time
+from functools import partial
+
+import numpy as np
+from connections import ApiConnection, DBConnection
+from DBInterface import Interface
+from ETL import APIETL, ETLScheduler
+from metrics import JsonLinesSink
+from fields import SPFields, SPDTypes, SGFields, SGDTypes
+from postgres_conf import TableCreator, SP_INDEXES, SG_INDEXES
+from dimensions import SP_DIMENSION_COLUMNS, SG_DIMENSION_COLUMNS
+from benchmarks.fake_cargo import FakeCargoStore, FakeCargoClient
+
+TABLES = {
+    'sp': ('scoreboard_players', SPFields, SPDTypes, 'ScoreboardPlayers', 'SP', ['name', 'game_id', 'match_id']),
+    'sg': ('scoreboard_games', SGFields, SGDTypes, 'ScoreboardGames', 'SG', ['game_id', 'match_id']),
+}
+INDEXES = {'sp': SP_INDEXES, 'sg': SG_INDEXES}
+DIMENSION_COLUMNS = {'sp': SP_DIMENSION_COLUMNS, 'sg': SG_DIMENSION_COLUMNS}
+
+
+async def create_tables(schema_name: str, tables: list[str], partition_by: str = None, normalized: bool = False) -> None:
+    conn = await DBConnection.get_async_con()
+    try:
+        await conn.execute(f"CREATE SCHEMA {schema_name};")
+    finally:
+        await conn.close()
+    for table in tables:
+        table_name, fields, field_dtypes, _, _, conflicts = TABLES[table]
+        await TableCreator(
+            schema_name, table_name, fields, field_dtypes, conflicts, partition_by, INDEXES[table],
+            DIMENSION_COLUMNS[table] if normalized else None
+        )()
+
+
+async def get_schema_size(schema_name: str) -> int:
+    """Return bytes used by every table of the schema, with its partitions, indexes and toast"""
+    conn = await DBConnection.get_async_con()
+    try:
+        return await conn.fetchval(
+            """
+            SELECT coalesce(sum(pg_total_relation_size(c.oid)), 0) FROM pg_class c 
+            JOIN pg_namespace n ON n.oid = c.relnamespace 
+            WHERE n.nspname = $1 AND c.relkind = 'r';
+            """,
+            schema_name
+        )
+    finally:
+        await conn.close()
+
+
+async def drop_schema(schema_name: str) -> None:
+    conn = await DBConnection.get_async_con()
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema_name} CASCADE;")
+    finally:
+        await conn.close()
+
+
+def get_interface(args, schema_name: str, table: str) -> partial:
+    table_name, fields, field_dtypes, cargotable_name, cargo_suffix, conflicts = TABLES[table]
+    return partial(
+        Interface, schema_name=schema_name, table_name=table_name, fields=fields, 
+        field_dtypes=field_dtypes, cargotable_name=cargotable_name, cargo_suffix=cargo_suffix,
+        on_conflict=args.on_conflict, conflicts=conflicts, partition_by=args.partition_by,
+        dimension_columns=DIMENSION_COLUMNS[table] if args.normalized else None
+    )
+
+
+def get_jobs(args, schema_name: str) -> list[APIETL]:
+    """Return one job per table, or one sg job extracting sp along with it when args.joined is set"""
+    if args.joined:
+        job = APIETL(
+            args.rate, args.workers, args.start, args.end, get_interface(args, schema_name, 'sg'), 
+            resume=False, leased=args.nodes > 1, joined=get_interface(args, schema_name, 'sp')
+        )
+        job.lease_poll = 0.5
+        return [job]
+    jobs = []
+    for table in args.tables:
+        job = APIETL(
+            args.rate, args.workers, args.start, args.end, get_interface(args, schema_name, table), 
+            resume=False, leased=args.nodes > 1
+        )
+        job.lease_poll = 0.5
+        jobs.append(job)
+    return jobs
+
+
+def run_node(args, schema_name: str) -> tuple[int, int, int, list[float], float]:
+    """
+    Run one ETL process with its own fake api client and rate budget, 
+    returns its rows loaded, api calls, injected errors, page latencies and peak rss
+    """
+    set_connection_params(args)
+    store = FakeCargoStore(args.start, args.end, args.games_per_day)
+    client = FakeCargoClient(store, latency=args.latency, error_rate=args.error_rate)
+    ApiConnection.set_client_factory(lambda: client)
+    try:
+        jobs = get_jobs(args, schema_name)
+        sinks = [] if args.metrics_jsonl is None else [JsonLinesSink(args.metrics_jsonl)]
+        asyncio.run(ETLScheduler(jobs, args.workers, args.rate, metrics_sinks=sinks).run())
+    finally:
+        ApiConnection.set_client_factory()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    rows = sum(j.rows for job in jobs for j in job.extracted_jobs)
+    return rows, client.calls, client.errors, client.latencies, peak_rss
+
+
+def run_benchmark(args) -> None:
+    """Run args.nodes ETL processes splitting the date range through the lease table, one runs in process"""
+    schema_name = f'etl_bench_{os.getpid()}'
+    asyncio.run(create_tables(schema_name, args.tables, args.partition_by, args.normalized))
+    try:
+        start = time.perf_counter()
+        if args.nodes > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=args.nodes) as executor:
+                results = list(executor.map(run_node, [args] * args.nodes, [schema_name] * args.nodes))
+        else:
+            results = [run_node(args, schema_name)]
+        wall_time = time.perf_counter() - start
+        schema_size = asyncio.run(get_schema_size(schema_name))
+    finally:
+        asyncio.run(drop_schema(schema_name))
+
+    rows = sum(r[0] for r in results)
+    calls = sum(r[1] for r in results)
+    errors = sum(r[2] for r in results)
+    latencies = np.array([latency for r in results for latency in r[3]]) * 1000
+    peak_rss = max(r[4] for r in results)
+
+    print(f"tables = {', '.join(args.tables)}, nodes = {args.nodes}, wall time = {wall_time:.2f}s")
+    print(f"rows loaded = {rows}, rows/s = {rows / wall_time:,.0f}")
+    print(f"api calls = {calls}, errors injected = {errors}, api calls per row = {calls / max(rows, 1):.4f}")
+    print(f"page latency p50 = {np.percentile(latencies, 50):.1f}ms, p99 = {np.percentile(latencies, 99):.1f}ms")
+    print(f"peak rss per node = {peak_rss:.0f} MiB")
+    print(f"tables on disk = {schema_size / 2 ** 20:.1f} MiB, bytes per row = {schema_size / max(rows, 1):.0f}")
+
+
+def set_connection_params(args) -> None:
+    DBConnection.db_host, DBConnection.db_port = args.host, args.port
+    DBConnection.db_username, DBConnection.db_password = args.user, args.password
+    DBConnection.db_name = args.dbname
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run APIETL end to end against a fake cargo api and a throwaway schema in a local postgres'
+    )
+    parser.add_argument('--start', default='2019-01-01')
+    parser.add_argument('--end', default='2019-04-01')
+    parser.add_argument('--games-per-day', type=float, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds slept per fake api call')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=1000)
+    parser.add_argument(
+        '--nodes', type=int, default=1, 
+        help='ETL processes splitting the backfill through the lease table, each with its own rate budget'
+    )
+    parser.add_argument('--on-conflict', choices=['ignore', 'update', 'update_changed'], default='ignore')
+    parser.add_argument('--metrics-jsonl', help='file metric snapshots are appended to during the run')
+    parser.add_argument('--partition-by', choices=['year', 'month'], default=None)
+    parser.add_argument('--normalized', action='store_true', help='load string columns as dimension table keys')
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES), default=['sp', 'sg'])
+    parser.add_argument('--joined', action='store_true', help='extract sp and sg together in one joined query')
+    parser.add_argument('--host', default=os.environ.get('PGHOST', 'localhost'))
+    parser.add_argument('--port', default=os.environ.get('PGPORT', '5432'))
+    parser.add_argument('--user', default=os.environ.get('PGUSER', 'postgres'))
+    parser.add_argument('--password', default=os.environ.get('PGPASSWORD', ''))
+    parser.add_argument('--dbname', default=os.environ.get('PGDATABASE', 'postgres'))
+    args = parser.parse_args()
+    if args.joined:
+        args.tables = ['sp', 'sg']
+
+    set_connection_params(args)
+    run_benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import concurrent.futures
+import os
+import time
+import pandas as pd
+from fields import FieldEnum, DTypeEnum, SPFields, SPDTypes
+from transform import compile_plan, clean_changed_rows, clean_changed_rows_ipc, frame_from_ipc, get_process_context
+from benchmarks.synthetic import synthetic_rows
+
+
+def legacy_clean(fields: FieldEnum, field_dtypes: DTypeEnum, rows: list[dict]) -> pd.DataFrame:
+    """Previous raw_query_api and clean_raw_query path, going through an object dtype frame"""
+    query = pd.DataFrame(rows)
+    query.columns = [c.replace(' ', '_') for c in query.columns]
+    query = query[fields.list_values()]
+
+    coercible_dtype_map, special_dtypes = field_dtypes.split_dtypes()
+    query = query.astype(coercible_dtype_map)
+    for col, dtype in special_dtypes.items():
+        if 'delimiter:' in dtype.split(' '):
+            query[col] = query[col].str.split(dtype[-1])
+
+    return query.rename(fields.invert(), axis=1)
+
+
+def best_of(repeats: int, func, *args) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def pool_throughput(pages: list[list[dict]], n_workers: int, use_processes: bool) -> float:
+    """Rows per second cleaning pages on a thread pool or on a process pool returning Arrow IPC streams"""
+    if use_processes:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, mp_context=get_process_context())
+        clean = clean_changed_rows_ipc
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+        clean = clean_changed_rows
+    with executor:
+        # warm up the workers so process start up is not timed
+        list(executor.map(clean, [SPFields] * n_workers, [SPDTypes] * n_workers, pages[:n_workers], [None] * n_workers))
+        start = time.perf_counter()
+        results = executor.map(clean, [SPFields] * len(pages), [SPDTypes] * len(pages), pages, [None] * len(pages))
+        for entries, _ in results:
+            if use_processes:
+                entries = frame_from_ipc(entries)
+        elapsed = time.perf_counter() - start
+    return sum(len(page) for page in pages) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the compiled transform plan with the previous cleaning path')
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--pages', type=int, default=200, help='pages cleaned by the thread and process pools')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    rows = synthetic_rows(SPFields, SPDTypes, args.rows)
+    plan = compile_plan(SPFields, SPDTypes)
+    pd.testing.assert_frame_equal(legacy_clean(SPFields, SPDTypes, rows), plan(rows))
+
+    legacy_time = best_of(args.repeats, legacy_clean, SPFields, SPDTypes, rows)
+    plan_time = best_of(args.repeats, plan, rows)
+
+    print(f"ScoreboardPlayers page of {args.rows} rows")
+    print(f"legacy clean_raw_query: {legacy_time * 1000:.2f}ms")
+    print(f"compiled plan:          {plan_time * 1000:.2f}ms")
+    print(f"speedup = {legacy_time / plan_time:.1f}x")
+
+    pages = [synthetic_rows(SPFields, SPDTypes, args.rows, seed=i) for i in range(args.pages)]
+    thread_rate = pool_throughput(pages, args.workers, use_processes=False)
+    process_rate = pool_throughput(pages, args.workers, use_processes=True)
+    print(f"{args.pages} pages on {args.workers} workers")
+    print(f"thread pool:  {thread_rate:,.0f} rows/s")
+    print(f"process pool: {process_rate:,.0f} rows/s")
+    print(f"speedup = {process_rate / thread_rate:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
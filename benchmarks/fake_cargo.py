@@ -0,0 +1,139 @@
+import re
+import random
+import threading
+import time
+from bisect import bisect_left
+from mwclient.errors import APIError
+from requests.exceptions import ConnectionError
+from pandas import Timestamp, Timedelta
+from fields import SPFields, SPDTypes, SGFields, SGDTypes
+from benchmarks.synthetic import synthetic_rows
+
+
+class FakeCargoStore:
+    """
+    Synthetic ScoreboardPlayers and ScoreboardGames rows for the same games,
+    games_per_day games spread evenly over each day from start_date to end_date.
+    """
+    tables = {
+        'ScoreboardPlayers': (SPFields, SPDTypes, 10),
+        'ScoreboardGames': (SGFields, SGDTypes, 1),
+    }
+
+    def __init__(self, start_date: str, end_date: str, games_per_day: float, seed: int = 0) -> None:
+        n_days = (Timestamp(end_date) - Timestamp(start_date)).days
+        n_games = int(n_days * games_per_day)
+        game_spacing = Timedelta(days=1) / games_per_day
+
+        self.rows = {}
+        self.datetimes = {}
+        for table, (fields, field_dtypes, rows_per_game) in self.tables.items():
+            rows = synthetic_rows(
+                fields, field_dtypes, n_games * rows_per_game, start_date, 
+                rows_per_game=rows_per_game, game_spacing=game_spacing, seed=seed
+            )
+            self.rows[table] = rows
+            self.datetimes[table] = [row['DateTime UTC'] for row in rows]
+        self.join_indexes = {}
+
+    def get_join_index(self, table: str, field: str) -> dict[str, list[dict]]:
+        """Return rows of table grouped by their value of field"""
+        if (table, field) not in self.join_indexes:
+            index = {}
+            for row in self.rows[table]:
+                index.setdefault(row.get(field), []).append(row)
+            self.join_indexes[table, field] = index
+        return self.join_indexes[table, field]
+
+
+class FakeCargoClient:
+    """
+    Offline stand in for EsportsClient.cargo_client implementing the query semantics APIInterface uses:
+    one table with an alias, suffixed fields, AND-ed comparisons of DateTime_UTC in where,
+    order by DateTime_UTC, limit and offset, 
+    and a second table left joined on an equality of one field as JoinedAPIInterface queries it.
+    Every call sleeps for latency seconds and raises an injected error with probability error_rate.
+    """
+    clause_pattern = re.compile(r"(\w+)\.(\w+)\s*(>=|<=|<|>|=)\s*'([^']*)'")
+
+    def __init__(
+            self, store: FakeCargoStore, latency: float = 0.0, error_rate: float = 0.0, 
+            error_kinds: tuple[str] = ('maxlag',), seed: int = 0
+        ) -> None:
+        self.store = store
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_kinds = error_kinds
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.latencies = []
+
+    @property
+    def cargo_client(self) -> 'FakeCargoClient':
+        return self
+
+    def query(
+            self, tables: str, fields: str, where: str = '', order_by: str = '', limit: int = 50, offset: int = 0, 
+            join_on: str = None, **kwargs
+        ) -> list[dict]:
+        start = time.perf_counter()
+        with self.lock:
+            self.calls += 1
+            fail = self.rng.random() < self.error_rate
+            error_kind = self.rng.choice(self.error_kinds)
+        if self.latency:
+            time.sleep(self.latency)
+
+        try:
+            if fail:
+                with self.lock:
+                    self.errors += 1
+                raise self.get_error(error_kind)
+            return self.select(tables, fields, where, int(limit), int(offset), join_on)
+        finally:
+            with self.lock:
+                self.latencies.append(time.perf_counter() - start)
+
+    def select(self, tables: str, fields: str, where: str, limit: int, offset: int, join_on: str = None) -> list[dict]:
+        aliases = [[part.strip() for part in alias.split('=')] for alias in tables.split(',')]
+        table, suffix = aliases[0]
+        rows, datetimes = self.store.rows[table], self.store.datetimes[table]
+
+        low, high = 0, len(rows)
+        for _, field, op, value in self.clause_pattern.findall(where):
+            if field != 'DateTime_UTC':
+                raise ValueError(f'FakeCargoClient only filters on DateTime_UTC, not {field}')
+            if op in ('>=', '>'):
+                low = max(low, bisect_left(datetimes, value) if op == '>=' else bisect_left(datetimes, value + '\0'))
+            elif op in ('<', '<='):
+                high = min(high, bisect_left(datetimes, value) if op == '<' else bisect_left(datetimes, value + '\0'))
+
+        sources = [{suffix: row} for row in rows[low:high]]
+        if join_on is not None:
+            joined_table, joined_suffix = aliases[1]
+            field = join_on.split('=')[0].split('.')[-1].replace('_', ' ')
+            index = self.store.get_join_index(joined_table, field)
+            sources = [
+                {**source, joined_suffix: joined_row}
+                for source in sources for joined_row in index.get(source[suffix].get(field), [{}])
+            ]
+
+        keys = [self.get_key(field, suffix) for field in fields.split(',')]
+        page = sources[offset:offset + limit]
+        return [{key: source[field_suffix].get(name) for field_suffix, name, key in keys} for source in page]
+
+    @staticmethod
+    def get_key(field: str, default_suffix: str) -> tuple[str, str, str]:
+        """Return the table suffix and stored name of a suffixed field, and the key cargo returns it under"""
+        field_suffix, _, field = field.strip().rpartition('.')
+        name, _, alias = field.partition('=')
+        name = name.replace('_', ' ')
+        return field_suffix or default_suffix, name, alias or name
+
+    @staticmethod
+    def get_error(error_kind: str) -> Exception:
+        if error_kind == 'connection':
+            return ConnectionError('Injected connection reset')
+        return APIError(error_kind, f'Injected {error_kind} error', {})
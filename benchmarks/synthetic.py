@@ -0,0 +1,55 @@
+import random
+from fields import FieldEnum, DTypeEnum
+from pandas import DataFrame, Timestamp, Timedelta
+from transform import compile_plan
+
+
+def synthetic_rows(
+        fields: FieldEnum,
+        field_dtypes: DTypeEnum,
+        n_rows: int,
+        start_date: str = '2019-01-01',
+        rows_per_game: int = 10,
+        game_spacing: Timedelta = Timedelta(minutes=45),
+        seed: int = 0
+    ) -> list[dict]:
+    """
+    Return rows shaped like cargo query results, keyed by the returned field names 
+    with every value a string, ordered by DateTime UTC.
+    Each game spans rows_per_game consecutive rows.
+    """
+    rng = random.Random(seed)
+    start = Timestamp(start_date)
+    rows = []
+    for i in range(n_rows):
+        game = i // rows_per_game
+        row = {}
+        for field in fields:
+            dtype = field_dtypes[field.value]
+            row[field.value.replace('_', ' ')] = synthetic_value(field.value, dtype, i, game, rng)
+        row['DateTime UTC'] = str((start + game * game_spacing).floor('s'))
+        rows.append(row)
+    return rows
+
+
+def synthetic_value(field: str, dtype: str, i: int, game: int, rng: random.Random) -> str:
+    if field == 'Name':
+        return f'Player {i % 10 + 10 * (game % 40)}'
+    if field == 'GameId':
+        return f'Game {game}'
+    if field == 'MatchId':
+        return f'Match {game // 3}'
+    if dtype == 'Integer':
+        return str(rng.randint(0, 20000))
+    if dtype == 'Float':
+        return f'{rng.uniform(0, 60000):.2f}'
+    if dtype == 'Datetime':
+        return str(Timestamp('2019-01-01') + Timedelta(seconds=rng.randint(0, 10**8)))
+    if 'delimiter:' in dtype.split(' '):
+        return dtype[-1].join(f'{field} {rng.randint(0, 200)}' for _ in range(rng.randint(1, 6)))
+    return f'{field} {rng.randint(0, 150)}'
+
+
+def typed_frame(fields: FieldEnum, field_dtypes: DTypeEnum, rows: list[dict]) -> DataFrame:
+    """Return rows typed and renamed the way APIInterface.clean_raw_query returns them"""
+    return compile_plan(fields, field_dtypes)(rows)
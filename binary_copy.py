@@ -0,0 +1,294 @@
+import struct
+from array import array
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+POSTGRES_EPOCH_US = 946_684_800_000_000
+TEXT_OID = 25
+ARRAY_ELEMENT_OIDS = {'int2[]': 21, 'int4[]': 23}
+NULL_LENGTH = np.frombuffer(struct.pack('>i', -1), np.uint8)
+INT_LIMITS = {'int2': np.iinfo(np.int16), 'int4': np.iinfo(np.int32)}
+
+
+def encode_frame(entries: DataFrame, column_types: dict[str, str]) -> bytes:
+    """
+    Encode entries as a complete binary COPY payload.
+    column_types maps each column to one of text, int2, int4, float8, timestamp, text[], int2[] or int4[].
+    Each column is encoded for all rows at once into a flat byte buffer 
+    and the columns are interleaved into rows with one scatter each, without a loop per row.
+    """
+    n_rows = len(entries)
+    field_count = np.frombuffer(struct.pack('>h', len(entries.columns)), np.uint8)
+    parts = [(np.full(n_rows, 2, np.int64), np.tile(field_count, n_rows))]
+    parts += [encode_column(entries[col], column_types[col]) for col in entries.columns]
+
+    _, rows = interleave(parts, n_rows)
+    return PGCOPY_HEADER + rows.tobytes() + PGCOPY_TRAILER
+
+
+def encode_column(column: Series, column_type: str) -> tuple[np.ndarray, np.ndarray]:
+    """Return byte length of each row's field and the concatenated encoded fields"""
+    mask = column.isna().to_numpy()
+
+    if column_type == 'int4':
+        values = narrow_ints(column.to_numpy(dtype='int64', na_value=0), 'int4', column.name).astype('>i4')
+    elif column_type == 'int2':
+        values = narrow_ints(column.to_numpy(dtype='int64', na_value=0), 'int2', column.name).astype('>i2')
+    elif column_type == 'float8':
+        values = column.to_numpy(dtype='float64', na_value=0.0).astype('>f8')
+    elif column_type == 'timestamp':
+        values = column.to_numpy(dtype='datetime64[us]').astype('int64')
+        values = np.where(mask, 0, values - POSTGRES_EPOCH_US).astype('>i8')
+    elif column_type == 'text':
+        return encode_text(column.to_numpy(dtype=object, na_value=''), mask)
+    elif column_type == 'text[]':
+        return encode_text_array(column.to_numpy(dtype=object), mask)
+    elif column_type in ARRAY_ELEMENT_OIDS:
+        return encode_int_array(column.to_numpy(dtype=object), mask, column_type, column.name)
+    else:
+        raise ValueError(f'No binary COPY encoding for column type {column_type}')
+
+    return encode_fixed(values, mask)
+
+
+def narrow_ints(values: np.ndarray, int_type: str, name: str) -> np.ndarray:
+    """Return int64 values after checking they fit int_type, as narrowing would silently wrap them"""
+    limits = INT_LIMITS[int_type]
+    if len(values) and (values.min() < limits.min or values.max() > limits.max):
+        raise ValueError(f'Column {name} has a value out of range for {int_type}')
+    return values
+
+
+def encode_fixed(values: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Encode big endian fixed width values, writing a null length for masked rows"""
+    n_rows, width = len(values), values.dtype.itemsize
+    fields = np.empty((n_rows, 4 + width), np.uint8)
+    fields[:, :4] = np.frombuffer(struct.pack('>i', width), np.uint8)
+    fields[:, 4:] = values.view(np.uint8).reshape(n_rows, width)
+
+    lengths = np.full(n_rows, 4 + width, np.int64)
+    if not mask.any():
+        return lengths, fields.reshape(-1)
+
+    fields[mask, :4] = NULL_LENGTH
+    lengths[mask] = 4
+    keep = np.ones(fields.shape, bool)
+    keep[mask, 4:] = False
+    return lengths, fields[keep]
+
+
+def encode_strings(strings) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return utf-8 byte length of each string and their concatenated bytes.
+    Strings are joined on NUL, which postgreSQL text cannot contain, and encoded in one call.
+    """
+    joined = np.frombuffer('\0'.join(strings).encode('utf-8'), np.uint8)
+    separators = np.flatnonzero(joined == 0)
+    bounds = np.concatenate([[-1], separators, [len(joined)]])
+    return np.diff(bounds) - 1, joined[joined != 0]
+
+
+def encode_text(strings: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    n_rows = len(strings)
+    if not n_rows:
+        return np.zeros(0, np.int64), np.zeros(0, np.uint8)
+    byte_lengths, payload = encode_strings(strings)
+    return with_length_headers(byte_lengths, payload, mask)
+
+
+def encode_text_array(lists: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Encode one dimensional TEXT[] values, empty lists as zero dimension arrays"""
+    counts, present = get_array_counts(lists, mask)
+    n_elements = counts.sum()
+    if n_elements:
+        element_lengths, element_payload = encode_strings(chain.from_iterable(present))
+        element_lengths, element_data = with_length_headers(
+            element_lengths, element_payload, np.zeros(n_elements, bool)
+        )
+    else:
+        element_lengths, element_data = np.zeros(0, np.int64), np.zeros(0, np.uint8)
+    return encode_array(counts, element_lengths, element_data, mask, TEXT_OID)
+
+
+def encode_int_array(
+        lists: np.ndarray, mask: np.ndarray, column_type: str, name: str
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """Encode one dimensional INT2[] or INT4[] values without null elements"""
+    counts, present = get_array_counts(lists, mask)
+    width = 2 if column_type == 'int2[]' else 4
+    values = np.fromiter(chain.from_iterable(present), np.int64, counts.sum())
+    values = narrow_ints(values, column_type[:-2], name).astype(f'>i{width}')
+    element_lengths, element_data = encode_fixed(values, np.zeros(len(values), bool))
+    return encode_array(counts, element_lengths, element_data, mask, ARRAY_ELEMENT_OIDS[column_type])
+
+
+def get_array_counts(lists: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Return the element count of each row and the non null rows"""
+    present = lists[~mask]
+    counts = np.zeros(len(lists), np.int64)
+    counts[~mask] = np.fromiter(map(len, present), np.int64, len(present))
+    return counts, present
+
+
+def encode_array(
+        counts: np.ndarray, element_lengths: np.ndarray, element_data: np.ndarray, mask: np.ndarray, oid: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """Wrap each row's encoded elements in a one dimensional array header"""
+    n_rows = len(counts)
+    if len(element_lengths):
+        row_of_element = np.repeat(np.arange(n_rows), counts)
+        elements_per_row = np.bincount(row_of_element, weights=element_lengths, minlength=n_rows).astype(np.int64)
+    else:
+        elements_per_row = np.zeros(n_rows, np.int64)
+
+    headers = np.zeros((n_rows, 5), '>i4')
+    headers[:, 0] = 1
+    headers[:, 2] = oid
+    headers[:, 3] = counts
+    headers[:, 4] = 1
+    header_lengths = np.full(n_rows, 20, np.int64)
+
+    empty = (counts == 0) & ~mask
+    headers[empty, 0] = 0
+    header_lengths[empty] = 12
+    header_lengths[mask] = 0
+    keep = np.arange(20)[None, :] < header_lengths[:, None]
+    header_data = headers.view(np.uint8).reshape(n_rows, 20)[keep]
+
+    payload_lengths, payload = interleave(
+        [(header_lengths, header_data), (elements_per_row, element_data)], n_rows
+    )
+    return with_length_headers(payload_lengths, payload, mask)
+
+
+def with_length_headers(
+        byte_lengths: np.ndarray, payload: np.ndarray, mask: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """Prefix each row's payload with its int32 length, or -1 for null rows"""
+    headers = byte_lengths.astype('>i4')
+    headers[mask] = -1
+    header_part = (np.full(len(byte_lengths), 4, np.int64), headers.view(np.uint8))
+    return interleave([header_part, (byte_lengths, payload)], len(byte_lengths))
+
+
+def interleave(parts: list[tuple[np.ndarray, np.ndarray]], n_rows: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenate row wise pieces, each given as per row byte lengths and concatenated bytes,
+    into one buffer where every row holds its pieces in order.
+    """
+    lengths = np.zeros(n_rows, np.int64)
+    for part_lengths, _ in parts:
+        lengths += part_lengths
+
+    out = np.empty(lengths.sum(), np.uint8)
+    destination = np.cumsum(lengths) - lengths
+    for part_lengths, data in parts:
+        source = np.cumsum(part_lengths) - part_lengths
+        index = np.repeat(destination - source, part_lengths) + np.arange(len(data))
+        out[index] = data
+        destination += part_lengths
+    return lengths, out
+
+
+def decode_frame(payload: bytes, column_types: dict[str, str]) -> DataFrame:
+    """
+    Decode a complete binary COPY payload whose columns are column_types, in order, 
+    into integer, float, datetime64[us], string and list columns.
+    Field boundaries are found in one sequential pass over the payload, in Python per row and field
+    as each field's position depends on the lengths before it.
+    Fixed width columns are then gathered at once, text and array fields are decoded one value at a time.
+    """
+    starts, lengths = get_field_bounds(payload, len(column_types))
+    data = np.frombuffer(payload, np.uint8)
+    return DataFrame({
+        name: decode_column(payload, data, starts[:, i], lengths[:, i], column_type)
+        for i, (name, column_type) in enumerate(column_types.items())
+    })
+
+
+def get_field_bounds(payload: bytes, n_fields: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return the start and byte length, -1 for nulls, of every field as arrays of shape (rows, n_fields)"""
+    if payload[:11] != PGCOPY_HEADER[:11]:
+        raise ValueError('Not a binary COPY payload')
+    unpack_int = struct.Struct('>i').unpack_from
+    unpack_short = struct.Struct('>h').unpack_from
+    position = 19 + unpack_int(payload, 15)[0]
+
+    starts, lengths = array('q'), array('q')
+    while True:
+        field_count = unpack_short(payload, position)[0]
+        position += 2
+        if field_count == -1:
+            break
+        if field_count != n_fields:
+            raise ValueError(f'Expected {n_fields} fields per row, not {field_count}')
+        for _ in range(field_count):
+            length = unpack_int(payload, position)[0]
+            position += 4
+            starts.append(position)
+            lengths.append(length)
+            if length > 0:
+                position += length
+
+    shape = (len(starts) // n_fields, n_fields)
+    return np.asarray(starts, np.int64).reshape(shape), np.asarray(lengths, np.int64).reshape(shape)
+
+
+def decode_column(payload: bytes, data: np.ndarray, starts: np.ndarray, lengths: np.ndarray, column_type: str):
+    mask = lengths < 0
+    present = np.flatnonzero(~mask)
+
+    if column_type in ('int2', 'int4', 'float8', 'timestamp'):
+        dtype = {'int2': '>i2', 'int4': '>i4', 'float8': '>f8', 'timestamp': '>i8'}[column_type]
+        width = np.dtype(dtype).itemsize
+        raw = data[starts[present, None] + np.arange(width)].reshape(-1).view(dtype)
+        if column_type == 'timestamp':
+            values = np.full(len(starts), np.datetime64('NaT', 'us'), 'datetime64[us]')
+            values[present] = (raw.astype(np.int64) + POSTGRES_EPOCH_US).view('datetime64[us]')
+            return values
+        if column_type == 'float8':
+            values = np.zeros(len(starts), np.float64)
+            values[present] = raw
+            return pd.arrays.FloatingArray(values, mask)
+        values = np.zeros(len(starts), np.int64)
+        values[present] = raw
+        return pd.arrays.IntegerArray(values, mask)
+
+    values = np.full(len(starts), None, dtype=object)
+    if column_type == 'text':
+        for i in present:
+            values[i] = payload[starts[i]:starts[i] + lengths[i]].decode('utf-8')
+        return pd.array(values, dtype='string')
+    if column_type == 'text[]' or column_type in ARRAY_ELEMENT_OIDS:
+        for i in present:
+            values[i] = decode_array(payload, int(starts[i]), column_type)
+        return values
+    raise ValueError(f'No binary COPY decoding for column type {column_type}')
+
+
+def decode_array(payload: bytes, start: int, column_type: str):
+    """Decode a one dimensional array field, into a list of strings or an int64 array"""
+    n_dims = struct.unpack_from('>i', payload, start)[0]
+    count = struct.unpack_from('>i', payload, start + 12)[0] if n_dims else 0
+    position = start + 12 + 8 * n_dims
+
+    if column_type != 'text[]':
+        width = 2 if column_type == 'int2[]' else 4
+        elements = np.frombuffer(payload, [('length', '>i4'), ('value', f'>i{width}')], count, position)
+        return elements['value'].astype(np.int64)
+
+    strings = []
+    for _ in range(count):
+        length = struct.unpack_from('>i', payload, position)[0]
+        position += 4
+        if length < 0:
+            strings.append(None)
+            continue
+        strings.append(payload[position:position + length].decode('utf-8'))
+        position += length
+    return strings
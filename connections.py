@@ -1,10 +1,21 @@
 from mwrogue.esports_client import EsportsClient
 from mwrogue.auth_credentials import AuthCredentials
+from mwclient.errors import APIError, LoginError, MaximumRetriesExceeded
+from requests.exceptions import HTTPError, Timeout, ConnectionError as RequestsConnectionError
 
 from sqlalchemy import create_engine
 import asyncpg
 import asyncio
+import threading
+import time
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from metrics import registry
+from rate_limiter import TokenBucket
 from .config_files.api_config import api_username, api_password
 from .config_files.local_config import local_username, local_password, local_dbname, local_ip, local_port
 
@@ -16,6 +27,15 @@ class DBConnection:
     db_name = local_dbname
     db_port = local_port
 
+    pool = None
+    _pool_users = 0
+    _init_queries = {}
+    transient_errors = (
+        asyncpg.PostgresConnectionError, asyncpg.TooManyConnectionsError, asyncpg.CannotConnectNowError,
+        asyncpg.DeadlockDetectedError, asyncpg.SerializationError, asyncpg.QueryCanceledError,
+        ConnectionError, TimeoutError
+    )
+
     @classmethod
     async def get_async_con(cls) -> asyncpg.Connection:
         return await asyncpg.connect(
@@ -25,8 +45,74 @@ class DBConnection:
             password=cls.db_password,
             database=cls.db_name
         )
+
+
+    @classmethod
+    async def open_pool(cls, size: int) -> asyncpg.Pool:
+        """
+        Open the shared connection pool with at most size connections,
+        or reuse the pool if another run already opened it.
+        """
+        if cls.pool is None:
+            cls.pool = await asyncpg.create_pool(
+                host=cls.db_host,
+                port=cls.db_port,
+                user=cls.db_username,
+                password=cls.db_password,
+                database=cls.db_name,
+                min_size=1,
+                max_size=size,
+                init=cls._init_connection
+            )
+        cls._pool_users += 1
+        return cls.pool
+
+
+    @classmethod
+    def get_pool(cls) -> asyncpg.Pool:
+        """Return the shared connection pool, which must already be open."""
+        if cls.pool is None:
+            raise RuntimeError('Connection pool is not open, call DBConnection.open_pool first')
+        return cls.pool
+
+
+    @classmethod
+    async def close_pool(cls) -> None:
+        """Release one user of the shared pool, closing it once no users remain."""
+        cls._pool_users -= 1
+        if cls._pool_users <= 0 and cls.pool is not None:
+            pool, cls.pool = cls.pool, None
+            cls._pool_users = 0
+            await pool.close()
+
+
+    @classmethod
+    async def register_init_query(cls, key: str, query: str) -> None:
+        """
+        Register a query run once on every new pooled connection,
+        e.g. creating a session temporary table.
+        Connections already in an open pool are recycled so they pick it up.
+        """
+        if cls._init_queries.get(key) == query:
+            return
+        cls._init_queries[key] = query
+        if cls.pool is not None:
+            await cls.pool.expire_connections()
+
+
+    @classmethod
+    async def _init_connection(cls, conn: asyncpg.Connection) -> None:
+        with registry.timer('etl_db_connection_init_seconds'):
+            for query in cls._init_queries.values():
+                await conn.execute(query)
     
 
+    @classmethod
+    def is_transient_error(cls, error: Exception) -> bool:
+        """Return whether a failed database call is worth retrying: dropped connections, deadlocks and timeouts"""
+        return isinstance(error, cls.transient_errors)
+
+
     @classmethod
     def get_alchemy_engine(cls):
         """Return an sql alchemy connection object to the local database."""
@@ -51,12 +137,132 @@ class ApiConnection:
     api_username = api_username
     api_password = api_password
 
+    session_ttl = 6 * 60 * 60
+    auth_error_codes = {'assertuserfailed', 'assertbotfailed', 'badtoken', 'notloggedin', 'readapidenied'}
+    throttle_error_codes = {'maxlag', 'ratelimited'}
+    rate_limiter = TokenBucket(rate=2)
+    login_count = 0
+    client_factory = None
+    _client = None
+    _client_created = 0.0
+    _lock = threading.Lock()
+
     @classmethod
-    def get_client(cls):
+    def get_client(cls) -> EsportsClient:
+        """
+        Return the process wide authenticated client, 
+        logging in only when there is none or its session has expired.
+        """
+        with cls._lock:
+            expired = time.monotonic() - cls._client_created > cls.session_ttl
+            if cls._client is None or expired:
+                cls._login()
+            return cls._client
+
+    @classmethod
+    def reauthenticate(cls, stale_client: EsportsClient = None) -> EsportsClient:
+        """
+        Log in again after stale_client hit an auth error.
+        If another thread already replaced stale_client its new client is returned instead.
+        """
+        with cls._lock:
+            if stale_client is None or cls._client is stale_client:
+                cls._login()
+            return cls._client
+
+    @classmethod
+    def create_client(cls) -> EsportsClient:
+        """Log in to the wiki, the default client_factory"""
         credentials = AuthCredentials(username=cls.api_username, password=cls.api_password)
-        client = EsportsClient('lol', credentials=credentials)
-        return client
+        return EsportsClient('lol', credentials=credentials)
+
+    @classmethod
+    def set_client_factory(cls, client_factory=None) -> None:
+        """
+        Replace how clients are created, e.g. with an offline stand in for benchmarks,
+        None restores logging in to the wiki. The cached client is dropped.
+        """
+        with cls._lock:
+            cls.client_factory = client_factory
+            cls._client = None
+
+    @classmethod
+    def is_auth_error(cls, error: Exception) -> bool:
+        """Return whether error means the session is no longer authenticated"""
+        if isinstance(error, LoginError):
+            return True
+        return isinstance(error, APIError) and error.code in cls.auth_error_codes
+
+    @classmethod
+    def is_throttle_error(cls, error: Exception) -> bool:
+        """Return whether error means the api wants requests slowed down"""
+        if isinstance(error, MaximumRetriesExceeded):
+            return True
+        if isinstance(error, APIError):
+            return error.code in cls.throttle_error_codes
+        if isinstance(error, HTTPError):
+            return error.response is not None and error.response.status_code == 429
+        if aiohttp is not None and isinstance(error, aiohttp.ClientResponseError):
+            return error.status == 429
+        return False
+
+    @classmethod
+    def is_transient_error(cls, error: Exception) -> bool:
+        """
+        Return whether a failed request is worth retrying:
+        throttling, timeouts, dropped connections and server errors
+        """
+        if cls.is_throttle_error(error):
+            return True
+        if isinstance(error, (TimeoutError, ConnectionError, Timeout, RequestsConnectionError)):
+            return True
+        if isinstance(error, HTTPError):
+            return error.response is not None and error.response.status_code >= 500
+        if aiohttp is not None:
+            if isinstance(error, aiohttp.ClientConnectionError):
+                return True
+            if isinstance(error, aiohttp.ClientResponseError):
+                return error.status >= 500
+        return False
+
+    @classmethod
+    def _login(cls) -> None:
+        client_factory = cls.create_client if cls.client_factory is None else cls.client_factory
+        cls._client = client_factory()
+        cls._client_created = time.monotonic()
+        cls.login_count += 1
 
     @classmethod
     def print_conn_info(cls):
         print(f"Api connection info: \napi username = {cls.api_username}")
+
+
+class AsyncCargoClient:
+    """
+    Minimal aiohttp client for cargoquery requests against the lol fandom api,
+    so cargo pages can be fetched on the event loop without a thread hop.
+    Requests are made anonymously.
+    """
+    api_url = 'https://lol.fandom.com/api.php'
+
+    def __init__(self, session_timeout: float = 60) -> None:
+        if aiohttp is None:
+            raise ImportError('aiohttp is required to use AsyncCargoClient')
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=session_timeout))
+
+    async def query(self, **kwargs) -> list[dict]:
+        """Run a cargoquery with the same keyword arguments as EsportsClient.cargo_client.query"""
+        params = {'action': 'cargoquery', 'format': 'json'}
+        params.update({k: str(v) for k, v in kwargs.items()})
+
+        async with self.session.get(self.api_url, params=params) as response:
+            response.raise_for_status()
+            result = await response.json()
+
+        if 'error' in result:
+            error = result['error']
+            raise APIError(error.get('code'), error.get('info'), params)
+        return [row['title'] for row in result['cargoquery']]
+
+    async def close(self) -> None:
+        await self.session.close()
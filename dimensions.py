@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from connections import DBConnection
+from metrics import registry
+
+
+DIMENSION_KEY_TYPES = {
+    'champions': 'int2',
+    'items': 'int2',
+    'summoner_spells': 'int2',
+    'teams': 'int4',
+    'players': 'int4',
+    'tournaments': 'int4',
+}
+
+SP_DIMENSION_COLUMNS = {
+    'name': ('players', 'player_id'),
+    'champion': ('champions', 'champion_id'),
+    'team': ('teams', 'team_id'),
+    'team_vs': ('teams', 'team_vs_id'),
+    'tournament': ('tournaments', 'tournament_id'),
+    'items': ('items', 'item_ids'),
+    'summoner_spells': ('summoner_spells', 'summoner_spell_ids'),
+}
+
+SG_DIMENSION_COLUMNS = {
+    'tournament': ('tournaments', 'tournament_id'),
+    'team1': ('teams', 'team1_id'),
+    'team2': ('teams', 'team2_id'),
+    'win_team': ('teams', 'win_team_id'),
+    'loss_team': ('teams', 'loss_team_id'),
+    'team_1_bans': ('champions', 'team_1_ban_ids'),
+    'team_2_bans': ('champions', 'team_2_ban_ids'),
+    'team_1_picks': ('champions', 'team_1_pick_ids'),
+    'team_2_picks': ('champions', 'team_2_pick_ids'),
+    'team_1_players': ('players', 'team_1_player_ids'),
+    'team_2_players': ('players', 'team_2_player_ids'),
+}
+
+key_type2psql = {'int2': 'SMALLINT', 'int4': 'INT', 'int2[]': 'SMALLINT[]', 'int4[]': 'INT[]'}
+key_type2serial = {'int2': 'SMALLSERIAL', 'int4': 'SERIAL'}
+
+
+class LRUCache:
+    """Mapping of at most max_entries items, evicting the least recently used"""
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys) -> tuple[dict, list]:
+        """Return found keys with their values, and the keys which were not found"""
+        found, missing = {}, []
+        for key in keys:
+            value = self.items.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                self.items.move_to_end(key)
+                found[key] = value
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, items: dict) -> None:
+        self.items.update(items)
+        for key in items:
+            self.items.move_to_end(key)
+        while len(self.items) > self.max_entries:
+            self.items.popitem(last=False)
+
+
+class Dimension:
+    """
+    Table interning the distinct values of a string attribute under small integer surrogate keys.
+    Keys are resolved through an in process LRU cache, values not seen yet are inserted in bulk.
+    One instance is shared per schema and dimension name, see Dimension.get.
+    """
+    instances = {}
+
+    def __init__(self, schema_name: str, name: str, key_type: str = 'int4', cache_entries: int = 100_000) -> None:
+        self.schema_name = schema_name
+        self.name = name
+        self.key_type = key_type
+        self.target_table = f'{schema_name}.dim_{name}'
+        self.cache = LRUCache(cache_entries)
+
+    @classmethod
+    def get(cls, schema_name: str, name: str) -> 'Dimension':
+        key = (schema_name, name)
+        if key not in cls.instances:
+            cls.instances[key] = cls(schema_name, name, DIMENSION_KEY_TYPES[name])
+        return cls.instances[key]
+
+    def get_create_query(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.target_table} (
+            id {key_type2serial[self.key_type]} PRIMARY KEY,
+            value VARCHAR (256) NOT NULL UNIQUE);
+        """
+
+    async def resolve(self, values) -> dict[str, int]:
+        """
+        Return the key of every value, inserting values which are not in the table yet.
+        Existing values are looked up before inserting so conflicts don't use up the key sequence.
+        """
+        found, missing = self.cache.get_many(values)
+        if not missing:
+            return found
+
+        with registry.timer('etl_dimension_resolve_seconds', dimension=self.name):
+            async with DBConnection.get_pool().acquire() as conn:
+                resolved = await self.select(conn, missing)
+                new = [v for v in missing if v not in resolved]
+                while new:
+                    rows = await conn.fetch(
+                        f"""
+                        INSERT INTO {self.target_table} (value) SELECT unnest($1::text[])
+                        ON CONFLICT (value) DO NOTHING RETURNING id, value;
+                        """,
+                        new
+                    )
+                    resolved.update((row['value'], row['id']) for row in rows)
+                    registry.inc('etl_dimension_values_inserted_total', len(rows), dimension=self.name)
+                    # values inserted concurrently by another loader are read back once it commits
+                    resolved.update(await self.select(conn, [v for v in new if v not in resolved]))
+                    new = [v for v in new if v not in resolved]
+
+        self.cache.put_many(resolved)
+        found.update(resolved)
+        return found
+
+    async def select(self, conn, values: list[str]) -> dict[str, int]:
+        if not values:
+            return {}
+        rows = await conn.fetch(
+            f"SELECT id, value FROM {self.target_table} WHERE value = ANY($1::text[]);", values
+        )
+        return {row['value']: row['id'] for row in rows}
+
+
+class DimensionMap:
+    """
+    Replaces string and string list columns of cleaned entries with keys into their dimension tables,
+    columns maps each column to its (dimension name, key column)
+    """
+    def __init__(self, schema_name: str, columns: dict[str, tuple[str, str]]) -> None:
+        self.schema_name = schema_name
+        self.columns = columns
+        self.dimensions = {name: Dimension.get(schema_name, name) for name, _ in columns.values()}
+
+    def key_column(self, column: str) -> str:
+        return self.columns[column][1] if column in self.columns else column
+
+    def key_type(self, column: str, is_list: bool) -> str:
+        key_type = self.dimensions[self.columns[column][0]].key_type
+        return key_type + '[]' if is_list else key_type
+
+    async def setup(self) -> None:
+        """Create the dimension tables if they do not exist yet"""
+        async with DBConnection.get_pool().acquire() as conn:
+            for dimension in self.dimensions.values():
+                await conn.execute(dimension.get_create_query())
+
+    async def encode(self, entries: pd.DataFrame) -> pd.DataFrame:
+        """Return entries with every mapped column replaced by its key column"""
+        values = {name: set() for name in self.dimensions}
+        for column, (name, _) in self.columns.items():
+            values[name].update(column_values(entries[column]))
+
+        keys = {}
+        for name, dimension_values in values.items():
+            keys[name] = await self.dimensions[name].resolve(dimension_values)
+
+        encoded = {}
+        for column in entries.columns:
+            if column not in self.columns:
+                encoded[column] = entries[column]
+                continue
+            name, key_column = self.columns[column]
+            encoded[key_column] = encode_column(entries[column], keys[name])
+        return pd.DataFrame(encoded, index=entries.index)
+
+
+def is_list_column(column: pd.Series) -> bool:
+    return isinstance(column.dtype, pd.ArrowDtype) or column.dtype == object
+
+
+def column_values(column: pd.Series) -> set[str]:
+    """Return distinct non null values of a string column, or of the elements of a list column"""
+    present = column[column.notna()]
+    if is_list_column(column):
+        return set(chain.from_iterable(present.to_numpy(dtype=object)))
+    return set(present.unique())
+
+
+def encode_column(column: pd.Series, keys: dict[str, int]) -> pd.Series:
+    """Map a string column to an Int64 key column, or a list column to a column of key arrays"""
+    mask = column.isna().to_numpy()
+    if not is_list_column(column):
+        return column.map(keys).astype('Int64')
+
+    lists = column.to_numpy(dtype=object)
+    present = lists[~mask]
+    counts = np.fromiter(map(len, present), np.int64, len(present))
+    flat = pd.Series(list(chain.from_iterable(present)), dtype=object).map(keys).to_numpy(dtype=np.int64)
+    encoded = np.full(len(lists), None, dtype=object)
+    for i, row_keys in zip(np.flatnonzero(~mask), np.split(flat, np.cumsum(counts)[:-1])):
+        encoded[i] = row_keys
+    return pd.Series(encoded, index=column.index, dtype=object)
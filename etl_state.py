@@ -0,0 +1,475 @@
+import asyncpg
+from connections import DBConnection
+from pandas import DataFrame, Timestamp, date_range
+
+
+class CheckpointStore:
+    """
+    Records the extraction units (table, window, offset) which have been loaded
+    and the max DateTime_UTC loaded per window, 
+    so that runs can resume after a crash and refresh incrementally from a high-water mark.
+    """
+    def __init__(self, schema_name: str, table_name: str, target_table: str = 'etl_checkpoints') -> None:
+        self.schema_name = schema_name
+        self.table_name = table_name
+        self.target_table = f'{schema_name}.{target_table}'
+
+
+    def get_create_query(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.target_table} (
+            table_name VARCHAR (256), 
+            window_start TIMESTAMP, 
+            window_end TIMESTAMP, 
+            next_offset INT DEFAULT 0, 
+            rows_loaded INT DEFAULT 0, 
+            max_datetime_utc TIMESTAMP, 
+            completed BOOLEAN DEFAULT FALSE, 
+            updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, 
+            PRIMARY KEY (table_name, window_start, window_end));
+        """
+
+
+    async def setup(self) -> None:
+        """Create the checkpoint table if it does not exist yet"""
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(self.get_create_query())
+
+
+    async def load(self) -> tuple[list[tuple[str, str]], dict[tuple[str, str], int]]:
+        """
+        Returns:
+        Windows already completed for this table, and
+        mapping of incomplete windows to the offset to resume them from
+        """
+        async with DBConnection.get_pool().acquire() as conn:
+            rows = await conn.fetch(
+                f"SELECT window_start, window_end, next_offset, completed FROM {self.target_table} "
+                f"WHERE table_name = $1 ORDER BY window_start;",
+                self.table_name
+            )
+
+        completed, incomplete = [], {}
+        for row in rows:
+            window = tuple(str(Timestamp(row[k])) for k in ('window_start', 'window_end'))
+            if row['completed']:
+                completed.append(window)
+            else:
+                incomplete[window] = row['next_offset']
+        return completed, incomplete
+
+
+    async def resume_offset(self, window: tuple[str, str]) -> int:
+        """Return the offset to resume a window from, 0 when it was never started or already completed"""
+        async with DBConnection.get_pool().acquire() as conn:
+            row = await conn.fetchrow(
+                f"SELECT next_offset, completed FROM {self.target_table} "
+                f"WHERE table_name = $1 AND window_start = $2 AND window_end = $3;",
+                self.table_name, *to_datetimes(window)
+            )
+        return 0 if row is None or row['completed'] else row['next_offset']
+
+
+    async def record_page(self, window: tuple[str, str], next_offset: int, entries: DataFrame) -> None:
+        """Record that a page of entries was loaded and the window should resume from next_offset"""
+        max_datetime = get_max_datetime(entries)
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(
+                f"""
+                INSERT INTO {self.target_table} AS c 
+                (table_name, window_start, window_end, next_offset, rows_loaded, max_datetime_utc, completed) 
+                VALUES ($1, $2, $3, $4, $5, $6, FALSE) 
+                ON CONFLICT (table_name, window_start, window_end) DO UPDATE SET 
+                next_offset = EXCLUDED.next_offset, 
+                rows_loaded = c.rows_loaded + EXCLUDED.rows_loaded, 
+                max_datetime_utc = GREATEST(c.max_datetime_utc, EXCLUDED.max_datetime_utc), 
+                completed = FALSE, 
+                updated_date = CURRENT_TIMESTAMP;
+                """,
+                self.table_name, *to_datetimes(window), next_offset, len(entries), max_datetime
+            )
+
+
+    async def complete_window(self, window: tuple[str, str]) -> None:
+        """Mark every page of a window as loaded"""
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(
+                f"""
+                INSERT INTO {self.target_table} (table_name, window_start, window_end, completed) 
+                VALUES ($1, $2, $3, TRUE) 
+                ON CONFLICT (table_name, window_start, window_end) DO UPDATE SET 
+                completed = TRUE, updated_date = CURRENT_TIMESTAMP;
+                """,
+                self.table_name, *to_datetimes(window)
+            )
+
+
+    async def reset_window(self, window: tuple[str, str]) -> None:
+        """Forget the progress of a window which is being extracted again from the start"""
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(
+                f"""
+                UPDATE {self.target_table} SET next_offset = 0, rows_loaded = 0, completed = FALSE, 
+                updated_date = CURRENT_TIMESTAMP 
+                WHERE table_name = $1 AND window_start = $2 AND window_end = $3;
+                """,
+                self.table_name, *to_datetimes(window)
+            )
+
+
+    async def high_water_mark(self) -> Timestamp | None:
+        """
+        Return the max DateTime_UTC loaded for this table,
+        falling back to the target table itself when nothing was checkpointed yet
+        """
+        async with DBConnection.get_pool().acquire() as conn:
+            mark = await conn.fetchval(
+                f"SELECT max(max_datetime_utc) FROM {self.target_table} WHERE table_name = $1;",
+                self.table_name
+            )
+            if mark is None:
+                mark = await conn.fetchval(
+                    f"SELECT max(datetime_utc) FROM {self.schema_name}.{self.table_name};"
+                )
+        return None if mark is None else Timestamp(mark)
+
+
+    async def watermark(self):
+        """
+        Return when this table's checkpoints last changed, which moves on with every loaded batch,
+        None when nothing was checkpointed yet
+        """
+        async with DBConnection.get_pool().acquire() as conn:
+            try:
+                return await conn.fetchval(
+                    f"SELECT max(updated_date) FROM {self.target_table} WHERE table_name = $1;",
+                    self.table_name
+                )
+            except asyncpg.UndefinedTableError:
+                return None
+
+
+class FingerprintStore:
+    """
+    Stores the hash of every raw row loaded, grouped by the day of its DateTime_UTC and keyed by (table, day),
+    so fingerprints match across runs however the planner split the date range into windows and pages.
+    A refetched row whose hash is stored for its day can skip cleaning and loading.
+    A day's hashes are replaced by the hashes seen for it in the latest run,
+    so a row edited back to an earlier version is loaded again.
+    """
+    def __init__(self, schema_name: str, table_name: str, target_table: str = 'etl_day_fingerprints') -> None:
+        self.schema_name = schema_name
+        self.table_name = table_name
+        self.target_table = f'{schema_name}.{target_table}'
+
+
+    def get_create_query(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.target_table} (
+            table_name VARCHAR (256), 
+            day VARCHAR (10), 
+            row_hashes TEXT[], 
+            updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, 
+            PRIMARY KEY (table_name, day));
+        """
+
+
+    async def setup(self) -> None:
+        """Create the fingerprint table if it does not exist yet"""
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(self.get_create_query())
+
+
+    async def load_days(self, days: list[str]) -> dict[str, set[str]]:
+        """Return mapping of day to the set of row hashes stored for it"""
+        async with DBConnection.get_pool().acquire() as conn:
+            rows = await conn.fetch(
+                f"SELECT day, row_hashes FROM {self.target_table} WHERE table_name = $1 AND day = ANY($2::varchar[]);",
+                self.table_name, days
+            )
+        return {row['day']: set(row['row_hashes'] or []) for row in rows}
+
+
+    async def record_days(self, days: dict[str, set[str]]) -> None:
+        """Replace the row hashes stored for each day"""
+        if not days:
+            return
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.executemany(
+                f"""
+                INSERT INTO {self.target_table} (table_name, day, row_hashes) 
+                VALUES ($1, $2, $3) 
+                ON CONFLICT (table_name, day) DO UPDATE SET 
+                row_hashes = EXCLUDED.row_hashes, 
+                updated_date = CURRENT_TIMESTAMP;
+                """,
+                [(self.table_name, day, sorted(row_hashes)) for day, row_hashes in days.items()]
+            )
+
+
+class LeaseStore:
+    """
+    Work queue of date windows shared by every ETL process loading a table.
+    A process claims a pending window with SELECT ... FOR UPDATE SKIP LOCKED so no two processes get the same one, 
+    and holds it while it heartbeats the lease.
+    Leases of processes which stopped heartbeating expire and are claimed again,
+    a window is given up on and marked failed after max_attempts claims, see fail_expired.
+    """
+    def __init__(
+            self, schema_name: str, table_name: str, owner: str, 
+            lease_ttl: float = 300, max_attempts: int = 3, target_table: str = 'etl_leases'
+        ) -> None:
+        self.schema_name = schema_name
+        self.table_name = table_name
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.target_table = f'{schema_name}.{target_table}'
+
+
+    def get_create_query(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.target_table} (
+            table_name VARCHAR (256), 
+            window_start TIMESTAMP, 
+            window_end TIMESTAMP, 
+            status VARCHAR (16) DEFAULT 'pending', 
+            owner VARCHAR (256), 
+            attempts INT DEFAULT 0, 
+            lease_expires TIMESTAMP, 
+            heartbeat_date TIMESTAMP, 
+            updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, 
+            PRIMARY KEY (table_name, window_start, window_end));
+            CREATE INDEX IF NOT EXISTS {self.target_table.split('.')[-1]}_claim_idx 
+            ON {self.target_table} (table_name, status, window_start);
+        """
+
+
+    async def setup(self) -> None:
+        """Create the lease table if it does not exist yet"""
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(self.get_create_query())
+
+
+    async def seed(self, windows: list[tuple[str, str]]) -> None:
+        """Add windows as pending work, windows already added by another process are left as they are"""
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.executemany(
+                f"""
+                INSERT INTO {self.target_table} (table_name, window_start, window_end) 
+                VALUES ($1, $2, $3) 
+                ON CONFLICT (table_name, window_start, window_end) DO NOTHING;
+                """,
+                [(self.table_name, *to_datetimes(window)) for window in windows]
+            )
+
+
+    async def claim(self) -> tuple[str, str] | None:
+        """
+        Lease the earliest window which is pending or whose lease expired,
+        returns None when no window can be claimed right now
+        """
+        async with DBConnection.get_pool().acquire() as conn:
+            row = await conn.fetchrow(
+                f"""
+                UPDATE {self.target_table} AS l SET 
+                status = 'leased', owner = $2, attempts = l.attempts + 1, 
+                lease_expires = now() + make_interval(secs => $3), heartbeat_date = now(), 
+                updated_date = CURRENT_TIMESTAMP 
+                FROM (
+                    SELECT table_name, window_start, window_end FROM {self.target_table} 
+                    WHERE table_name = $1 AND attempts < $4 
+                    AND (status = 'pending' OR (status = 'leased' AND lease_expires < now())) 
+                    ORDER BY window_start 
+                    LIMIT 1 
+                    FOR UPDATE SKIP LOCKED
+                ) AS c 
+                WHERE (l.table_name, l.window_start, l.window_end) = (c.table_name, c.window_start, c.window_end) 
+                RETURNING l.window_start, l.window_end;
+                """,
+                self.table_name, self.owner, float(self.lease_ttl), self.max_attempts
+            )
+        if row is None:
+            return None
+        return tuple(str(Timestamp(row[k])) for k in ('window_start', 'window_end'))
+
+
+    async def fail_expired(self) -> list[tuple[str, str]]:
+        """Mark windows whose lease expired on their last attempt as failed, returning them"""
+        async with DBConnection.get_pool().acquire() as conn:
+            rows = await conn.fetch(
+                f"""
+                UPDATE {self.target_table} SET 
+                status = 'failed', owner = NULL, lease_expires = NULL, updated_date = CURRENT_TIMESTAMP 
+                WHERE table_name = $1 AND status = 'leased' AND lease_expires < now() AND attempts >= $2 
+                RETURNING window_start, window_end;
+                """,
+                self.table_name, self.max_attempts
+            )
+        return [tuple(str(Timestamp(row[k])) for k in ('window_start', 'window_end')) for row in rows]
+
+
+    async def failed(self) -> list[tuple[str, str]]:
+        """Return the windows given up on, in order"""
+        async with DBConnection.get_pool().acquire() as conn:
+            rows = await conn.fetch(
+                f"""
+                SELECT window_start, window_end FROM {self.target_table} 
+                WHERE table_name = $1 AND status = 'failed' ORDER BY window_start;
+                """,
+                self.table_name
+            )
+        return [tuple(str(Timestamp(row[k])) for k in ('window_start', 'window_end')) for row in rows]
+
+
+    async def heartbeat(self) -> int:
+        """Extend every lease held by this owner, returns the number of leases held"""
+        async with DBConnection.get_pool().acquire() as conn:
+            status = await conn.execute(
+                f"""
+                UPDATE {self.target_table} SET 
+                lease_expires = now() + make_interval(secs => $3), heartbeat_date = now() 
+                WHERE table_name = $1 AND owner = $2 AND status = 'leased';
+                """,
+                self.table_name, self.owner, float(self.lease_ttl)
+            )
+        return int(status.split()[-1])
+
+
+    async def complete(self, window: tuple[str, str]) -> None:
+        """Mark a leased window as done"""
+        await self.set_status(window, 'done')
+
+
+    async def release(self, window: tuple[str, str]) -> None:
+        """
+        Give a leased window back after a failure so any process can retry it,
+        or mark it failed once it used up its attempts
+        """
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(
+                f"""
+                UPDATE {self.target_table} SET 
+                status = CASE WHEN attempts >= $5 THEN 'failed' ELSE 'pending' END, 
+                owner = NULL, lease_expires = NULL, updated_date = CURRENT_TIMESTAMP 
+                WHERE table_name = $1 AND window_start = $2 AND window_end = $3 AND owner = $4;
+                """,
+                self.table_name, *to_datetimes(window), self.owner, self.max_attempts
+            )
+
+
+    async def set_status(self, window: tuple[str, str], status: str) -> None:
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(
+                f"""
+                UPDATE {self.target_table} SET status = $5, lease_expires = NULL, updated_date = CURRENT_TIMESTAMP 
+                WHERE table_name = $1 AND window_start = $2 AND window_end = $3 AND owner = $4;
+                """,
+                self.table_name, *to_datetimes(window), self.owner, status
+            )
+
+
+    async def outstanding(self) -> int:
+        """
+        Return the number of windows still pending or leased, 
+        a leased window on its last attempt is outstanding until it is done or fail_expired gives up on it
+        """
+        async with DBConnection.get_pool().acquire() as conn:
+            return await conn.fetchval(
+                f"""
+                SELECT count(*) FROM {self.target_table} 
+                WHERE table_name = $1 AND (status = 'leased' OR (status = 'pending' AND attempts < $2));
+                """,
+                self.table_name, self.max_attempts
+            )
+
+
+    async def counts(self) -> dict[str, int]:
+        """Return the number of windows in each status"""
+        async with DBConnection.get_pool().acquire() as conn:
+            rows = await conn.fetch(
+                f"SELECT status, count(*) AS n FROM {self.target_table} WHERE table_name = $1 GROUP BY status;",
+                self.table_name
+            )
+        return {row['status']: row['n'] for row in rows}
+
+
+class DeadLetterStore:
+    """
+    Stores work which failed permanently with its error and payload, 
+    so the rest of the run carries on and the failures can be inspected and replayed later.
+    """
+    def __init__(self, schema_name: str, table_name: str, target_table: str = 'etl_dead_letters') -> None:
+        self.schema_name = schema_name
+        self.table_name = table_name
+        self.target_table = f'{schema_name}.{target_table}'
+
+
+    def get_create_query(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.target_table} (
+            id BIGSERIAL PRIMARY KEY, 
+            table_name VARCHAR (256), 
+            window_start TIMESTAMP, 
+            window_end TIMESTAMP, 
+            page_offset INT, 
+            stage VARCHAR (32), 
+            error_type VARCHAR (256), 
+            error_message TEXT, 
+            attempts INT, 
+            payload JSONB, 
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        """
+
+
+    async def setup(self) -> None:
+        """Create the dead letter table if it does not exist yet"""
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(self.get_create_query())
+
+
+    async def record(
+            self, window: tuple[str, str], offset: int, stage: str, 
+            error: Exception, payload: str | None = None, attempts: int = 1
+        ) -> None:
+        """Store a failed page or row, payload being its rows as a JSON string"""
+        async with DBConnection.get_pool().acquire() as conn:
+            await conn.execute(
+                f"""
+                INSERT INTO {self.target_table} 
+                (table_name, window_start, window_end, page_offset, stage, error_type, error_message, attempts, payload) 
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9::jsonb);
+                """,
+                self.table_name, *to_datetimes(window), offset, stage, 
+                type(error).__name__, str(error), attempts, payload
+            )
+
+
+    async def counts(self) -> dict[str, int]:
+        """Return the number of dead letters of this table per stage"""
+        async with DBConnection.get_pool().acquire() as conn:
+            rows = await conn.fetch(
+                f"SELECT stage, count(*) AS n FROM {self.target_table} WHERE table_name = $1 GROUP BY stage;",
+                self.table_name
+            )
+        return {row['stage']: row['n'] for row in rows}
+
+
+def get_max_datetime(entries: DataFrame):
+    """Return the max datetime_utc of entries as a datetime, or None"""
+    if 'datetime_utc' not in entries.columns or not len(entries):
+        return None
+    max_datetime = entries['datetime_utc'].max()
+    return None if max_datetime is None or max_datetime != max_datetime else Timestamp(max_datetime).to_pydatetime()
+
+
+def to_datetimes(window: tuple[str, str]):
+    return tuple(Timestamp(w).to_pydatetime() for w in window)
+
+
+def window_days(window: tuple[str, str], whole: bool = False) -> list[str]:
+    """Return the days a window overlaps, or only the days it fully covers if whole"""
+    start, end = Timestamp(window[0]), Timestamp(window[1])
+    first = start.ceil('D') if whole else start.floor('D')
+    last = end.floor('D') if whole else end.ceil('D')
+    return [day.strftime('%Y-%m-%d') for day in date_range(first, last, freq='D', inclusive='left')]
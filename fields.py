@@ -242,6 +242,17 @@ dtype_wiki2psql = {
     'List of String delimiter: ;': 'TEXT[]'
 }
 
+dtype_wiki2copy = {
+    'String': 'text',
+    'Integer': 'int4',
+    'Float': 'float8',
+    'Datetime': 'timestamp',
+    'Text': 'text',
+    'List of String, delimiter: ;': 'text[]',
+    'List of String, delimiter: ,': 'text[]',
+    'List of String delimiter: ;': 'text[]'
+}
+
 dtype_wiki2pandas = {
     'String': 'string',
     'Text': 'string',
@@ -0,0 +1,229 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Timer:
+    """Count, total, max and bucketed histogram of observed durations in seconds"""
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, float('inf'))
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.bucket_counts = [0] * len(self.buckets)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.bucket_counts[bisect_left(self.buckets, seconds)] += 1
+
+
+class Metrics:
+    """
+    Thread safe registry of counters, gauges and timers, each keyed by name and labels.
+    Recording a value only updates a dict under a lock,
+    sinks read snapshots of the registry on their own schedule so recording never waits on I/O.
+    """
+    def __init__(self) -> None:
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+        self.sinks = []
+        self._lock = threading.Lock()
+
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Add value to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Set a gauge to value"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Record a duration in a timer"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = Timer()
+            timer.observe(seconds)
+
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Time the enclosed block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+
+    def snapshot(self) -> dict:
+        """Return every metric as plain data"""
+        with self._lock:
+            return {
+                'time': time.time(),
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                'gauges': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self.gauges.items()
+                ],
+                'timers': [
+                    {
+                        'name': name, 'labels': dict(labels), 'count': t.count, 'sum': t.sum, 'max': t.max,
+                        'buckets': dict(zip(map(str, Timer.buckets), t.bucket_counts))
+                    }
+                    for (name, labels), t in self.timers.items()
+                ],
+            }
+
+
+    def render_prometheus(self) -> str:
+        """Return every metric in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines, typed = [], set()
+
+        def add(name, kind, labels, value):
+            if name not in typed:
+                lines.append(f'# TYPE {name} {kind}')
+                typed.add(name)
+            lines.append(f'{name}{format_labels(labels)} {value}')
+
+        for metric in snapshot['counters']:
+            add(metric['name'], 'counter', metric['labels'], metric['value'])
+        for metric in snapshot['gauges']:
+            add(metric['name'], 'gauge', metric['labels'], metric['value'])
+        for metric in snapshot['timers']:
+            name, labels = metric['name'], metric['labels']
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(Timer.buckets, metric['buckets'].values()):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else str(bound)
+                lines.append(f'{name}_bucket{format_labels({**labels, "le": le})} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {metric["sum"]}')
+            lines.append(f'{name}_count{format_labels(labels)} {metric["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+    def add_sink(self, sink) -> None:
+        sink.start(self)
+        self.sinks.append(sink)
+
+
+    def flush(self) -> None:
+        """Push the current metrics to every sink"""
+        for sink in self.sinks:
+            sink.flush(self)
+
+
+    def close_sinks(self) -> None:
+        for sink in self.sinks:
+            sink.flush(self)
+            sink.close()
+        self.sinks = []
+
+
+    def summary(self, wall_time: float) -> str:
+        """
+        Return an end of run summary of where time went, timers sorted by total time.
+        Stages run concurrently so their busy time can add up to more than the wall time.
+        """
+        snapshot = self.snapshot()
+        lines = [f'wall time = {wall_time:.2f}s']
+        for metric in sorted(snapshot['timers'], key=lambda m: m['sum'], reverse=True):
+            mean = metric['sum'] / metric['count'] if metric['count'] else 0.0
+            share = metric['sum'] / wall_time if wall_time else 0.0
+            lines.append(
+                f"{metric['name']}{format_labels(metric['labels'])}: total = {metric['sum']:.2f}s "
+                f"({share:.0%} of wall time), count = {metric['count']}, "
+                f"mean = {mean * 1000:.1f}ms, max = {metric['max'] * 1000:.1f}ms"
+            )
+        for metric in sorted(snapshot['counters'], key=lambda m: m['name']):
+            lines.append(f"{metric['name']}{format_labels(metric['labels'])} = {metric['value']:g}")
+        return '\n'.join(lines)
+
+
+class JsonLinesSink:
+    """Appends one JSON snapshot of every metric per flush to a file"""
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = None
+
+    def start(self, metrics: Metrics) -> None:
+        self.file = open(self.path, 'a')
+
+    def flush(self, metrics: Metrics) -> None:
+        self.file.write(json.dumps(metrics.snapshot()) + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class PrometheusSink:
+    """Serves the metrics in the Prometheus text format at http://host:port/metrics from a daemon thread"""
+    def __init__(self, port: int = 9108, host: str = '0.0.0.0') -> None:
+        self.port = port
+        self.host = host
+        self.server = None
+
+    def start(self, metrics: Metrics) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True, name='metrics_http').start()
+
+    def flush(self, metrics: Metrics) -> None:
+        pass
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+registry = Metrics()
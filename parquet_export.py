@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+from metrics import registry
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+copy2arrow = {
+    'text': 'string',
+    'int4': 'int64',
+    'float8': 'float64',
+    'timestamp': 'timestamp[us]',
+    'text[]': 'list<string>',
+}
+
+
+class ParquetExporter:
+    """
+    Appends loaded batches to a Parquet dataset under directory, hive partitioned as
+    table=<table>/year=<year>/month=<month>/part-<written ns>-<id>.parquet,
+    with list columns stored as Parquet lists and each file sorted by datetime_utc
+    so readers can prune row groups by time.
+
+    Each batch adds new files, a refetched row is appended again as a newer version.
+    compact rewrites partitions holding compact_min_files or more small files into one file,
+    keeping only the newest version of each row by the table's conflict columns.
+    Until a partition is compacted, readers may see older versions of changed rows alongside the new ones.
+    """
+    def __init__(
+            self,
+            directory: str,
+            compact_min_files: int = 8,
+            small_file_bytes: int = 32 * 2**20,
+            row_group_rows: int = 64_000,
+            compression: str = 'zstd'
+        ) -> None:
+        if pa is None:
+            raise ImportError('pyarrow is required for the parquet export')
+        self.directory = directory
+        self.compact_min_files = compact_min_files
+        self.small_file_bytes = small_file_bytes
+        self.row_group_rows = row_group_rows
+        self.compression = compression
+        self.schemas = {}
+        self.conflicts = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+
+    @staticmethod
+    def get_schema(column_types: dict[str, str]) -> 'pa.Schema':
+        return pa.schema([
+            (name, pa.list_(pa.string()) if copy_type == 'text[]' else pa.type_for_alias(copy2arrow[copy_type]))
+            for name, copy_type in column_types.items()
+        ])
+
+
+    def add_table(self, table_name: str, column_types: dict[str, str], conflicts: list[str]) -> None:
+        """Register a table's columns, as binary COPY column types, and the columns identifying a row"""
+        self.schemas[table_name] = self.get_schema(column_types)
+        self.conflicts[table_name] = list(conflicts)
+
+
+    def get_table_directory(self, table_name: str) -> str:
+        return os.path.join(self.directory, f'table={table_name}')
+
+
+    def write(self, table_name: str, entries: pd.DataFrame) -> int:
+        """Append cleaned entries of a registered table, one new file per year and month, returns files written"""
+        if not len(entries):
+            return 0
+        schema = self.schemas[table_name]
+        with registry.timer('etl_export_seconds', table=table_name, step='write'):
+            datetimes = pd.to_datetime(entries['datetime_utc'])
+            files = 0
+            for (year, month), group in entries.groupby(
+                    [datetimes.dt.year.fillna(0).astype(int), datetimes.dt.month.fillna(0).astype(int)], sort=False
+                ):
+                group = group.sort_values('datetime_utc', kind='stable')
+                table = pa.Table.from_pandas(group[schema.names], schema=schema, preserve_index=False)
+                self.write_file(table, self.get_partition_directory(table_name, year, month))
+                files += 1
+        registry.inc('etl_export_rows_total', len(entries), table=table_name)
+        return files
+
+
+    def get_partition_directory(self, table_name: str, year: int, month: int) -> str:
+        return os.path.join(self.get_table_directory(table_name), f'year={year}', f'month={month}')
+
+
+    def write_file(self, table: 'pa.Table', directory: str, written_ns: int = None) -> str:
+        """Write table to a new file in directory, atomically so readers never see a partial file"""
+        os.makedirs(directory, exist_ok=True)
+        written_ns = time.time_ns() if written_ns is None else written_ns
+        path = os.path.join(directory, f'part-{written_ns:020d}-{uuid.uuid4().hex[:8]}.parquet')
+        tmp_path = os.path.join(directory, '.' + os.path.basename(path) + '.tmp')
+        pq.write_table(table, tmp_path, row_group_size=self.row_group_rows, compression=self.compression)
+        os.replace(tmp_path, path)
+        return path
+
+
+    def compact(self) -> int:
+        """Compact every partition with enough small files, returns the number of partitions compacted"""
+        compacted = 0
+        with self._lock:
+            for table_name in self.schemas:
+                for directory, _, names in os.walk(self.get_table_directory(table_name)):
+                    parts = sorted(n for n in names if n.startswith('part-') and n.endswith('.parquet'))
+                    small = [
+                        n for n in parts
+                        if os.path.getsize(os.path.join(directory, n)) < self.small_file_bytes
+                    ]
+                    if len(small) >= self.compact_min_files:
+                        self.compact_files(table_name, directory, small)
+                        compacted += 1
+        return compacted
+
+
+    def compact_files(self, table_name: str, directory: str, names: list[str]) -> None:
+        """
+        Rewrite files into one, keeping the last version of each row in file order.
+        The new file is named after the newest input so later appends still sort after it.
+        """
+        with registry.timer('etl_export_seconds', table=table_name, step='compact'):
+            schema = self.schemas[table_name]
+            paths = [os.path.join(directory, n) for n in names]
+            table = pa.concat_tables([pq.read_table(path, schema=schema) for path in paths])
+            conflicts = self.conflicts[table_name]
+            if conflicts:
+                frame = table.to_pandas()
+                frame = frame.drop_duplicates(subset=conflicts, keep='last').sort_values('datetime_utc', kind='stable')
+                table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+            newest_ns = int(names[-1].split('-')[1])
+            self.write_file(table, directory, newest_ns)
+            for path in paths:
+                os.remove(path)
+        registry.inc('etl_export_compactions_total', table=table_name)
+
+
+    def read(self, table_name: str, filters=None, columns: list[str] = None) -> pd.DataFrame:
+        """
+        Read a table from the dataset with memory mapping,
+        filters being pyarrow filters pushed down to partitions and row groups,
+        e.g. [('year', '=', 2020), ('team', '=', 'T1')]
+        """
+        table = pq.read_table(
+            self.get_table_directory(table_name), columns=columns, filters=filters,
+            memory_map=True, partitioning='hive'
+        )
+        return table.to_pandas()
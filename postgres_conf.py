@@ -1,13 +1,19 @@
 from connections import DBConnection
 from asyncpg import Connection
 import asyncio
+import pandas as pd
 from fields import FieldEnum, DTypeEnum, dtype_wiki2psql, SPFields, SPDTypes, SGFields, SGDTypes
+from dimensions import DimensionMap, key_type2psql
 
 """
 GRANT SCHEMA fandom_schema;
 GRANT USAGE, CREATE ON SCHEMA fandom_schema to base_user;
 """
 
+SP_INDEXES = [('brin', ['datetime_utc']), ('btree', ['team']), ('btree', ['name']), ('btree', ['champion'])]
+SG_INDEXES = [('brin', ['datetime_utc']), ('btree', ['team1']), ('btree', ['team2']), ('btree', ['tournament'])]
+
+
 class TableCreator:
     def __init__(
             self,
@@ -15,34 +21,51 @@ class TableCreator:
             table_name: str,
             fields: FieldEnum,
             field_dtypes: DTypeEnum,
-            conflicts: list[str] = None
+            conflicts: list[str] = None,
+            partition_by: str = None,
+            indexes: list[tuple[str, list[str]]] = None,
+            dimension_columns: dict[str, tuple[str, str]] = None
     ) -> None:
+        """
+        partition_by of year or month range partitions the table on datetime_utc,
+        partitions are created by LocalInterface as rows for new date ranges are loaded.
+        indexes are (method, columns) pairs of secondary indexes, e.g. ('brin', ['datetime_utc'])
+        dimension_columns creates the normalized layout, see dimensions.DimensionMap,
+        along with any dimension tables which do not exist yet.
+        """
         self.table_name = table_name
         self.schema_name = schema_name
         conflicts = [] if conflicts is None else conflicts
-        self.qc = QueryCreator(schema_name, table_name, fields, field_dtypes, conflicts)
+        self.indexes = [] if indexes is None else indexes
+        self.dimensions = None if dimension_columns is None else DimensionMap(schema_name, dimension_columns)
+        self.qc = QueryCreator(schema_name, table_name, fields, field_dtypes, conflicts, partition_by, self.dimensions)
 
 
     async def __call__(self, force=False) -> str:
         """
         Creates table of name self.table_name with columns self.fields
-        of datatypes self
+        of datatypes self, its unique constraint and secondary indexes.
+        force drops any existing table along with its partitions first.
         """
         conn = await DBConnection.get_async_con()
-        table_exists = await self.get_exists(conn)
-
-        if (not table_exists) or force:
-            if table_exists: 
-                await conn.execute(f"""
-                    DELETE FROM {self.schema_name}.{self.table_name}; 
-                    DROP TABLE {self.schema_name}.{self.table_name};
-                """)
-
-            create_query = self.qc.get_create_query()
-            conflict_query = self.qc.get_conflict_query()
-            await conn.execute(create_query)
-            await conn.execute(conflict_query)
-            return 'Table Created'
+        try:
+            table_exists = await self.get_exists(conn)
+
+            if (not table_exists) or force:
+                if table_exists: 
+                    await conn.execute(f"DROP TABLE {self.schema_name}.{self.table_name} CASCADE;")
+
+                async with conn.transaction():
+                    if self.dimensions is not None:
+                        for dimension in self.dimensions.dimensions.values():
+                            await conn.execute(dimension.get_create_query())
+                    await conn.execute(self.qc.get_create_query())
+                    await conn.execute(self.qc.get_conflict_query())
+                    for method, columns in self.indexes:
+                        await conn.execute(self.qc.get_index_query(method, columns))
+                return 'Table Created'
+        finally:
+            await conn.close()
         
         return 'Table already found in database'
 
@@ -60,43 +83,104 @@ class TableCreator:
 
     
 class QueryCreator:
+    partition_key = 'datetime_utc'
+    partition_periods = {None: None, 'year': ('Y', '%Y'), 'month': ('M', '%Y_%m')}
+    index_methods = ('btree', 'brin', 'hash', 'gin')
+
     def __init__(
         self,
         schema_name: str,
         table_name: str,
         fields: FieldEnum,
         field_dtypes: DTypeEnum,
-        conflicts: list[str]
+        conflicts: list[str],
+        partition_by: str = None,
+        dimensions: DimensionMap = None
     ) -> None:
+        """
+        Partitioned tables need their partition key in every unique constraint, 
+        so datetime_utc is added to the conflict columns when partition_by is set.
+        With dimensions, columns interned in dimension tables are stored as their integer key columns.
+        """
+        if partition_by not in self.partition_periods:
+            raise ValueError(f'partition_by must be one of {list(self.partition_periods)}, not {partition_by}')
         self.table_name = table_name
         self.fields = fields
         self.field_wikidtypes = field_dtypes
         self.schema_name = schema_name
-        self.conflicts = conflicts
+        self.partition_by = partition_by
+        self.dimensions = dimensions
+        self.conflicts = [self.get_column_name(c) for c in conflicts]
+        if partition_by is not None and self.partition_key not in self.conflicts:
+            self.conflicts = self.conflicts + [self.partition_key]
+
+    def get_column_name(self, name: str) -> str:
+        """Return the column a field is stored in"""
+        return name if self.dimensions is None else self.dimensions.key_column(name)
 
     def get_field_query(self) -> str:
         res = []
 
         for name, value in self.fields.__members__.items():
-            res.append(f'{name} {dtype_wiki2psql[self.field_wikidtypes[value]]}')
+            wiki_dtype = self.field_wikidtypes[value]
+            if self.dimensions is not None and name in self.dimensions.columns:
+                key_type = self.dimensions.key_type(name, wiki_dtype.startswith('List'))
+                res.append(f'{self.get_column_name(name)} {key_type2psql[key_type]}')
+            else:
+                res.append(f'{name} {dtype_wiki2psql[wiki_dtype]}')
 
         res = ', \n'.join(res)
         return res
 
     def get_create_query(self) -> str:
         col_fields = self.get_field_query()
-        id_str = 'id SERIAL PRIMARY KEY, \n'
         created_str = 'created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP\n'
-        
-        col_fields = id_str + col_fields + ',\n' + created_str
+
+        if self.partition_by is None:
+            id_str = 'id SERIAL PRIMARY KEY, \n'
+            col_fields = id_str + col_fields + ',\n' + created_str
+            partition_str = ''
+        else:
+            id_str = 'id SERIAL, \n'
+            key_str = f'PRIMARY KEY (id, {self.partition_key})\n'
+            col_fields = id_str + col_fields + ',\n' + created_str.rstrip('\n') + ', \n' + key_str
+            partition_str = f' PARTITION BY RANGE ({self.partition_key})'
 
         create_query = f"""
             CREATE TABLE {self.schema_name}.{self.table_name} (
-            {col_fields});
+            {col_fields}){partition_str};
         """
 
         return create_query
 
+    def get_partitions(self, datetimes: pd.Series) -> list[tuple[str, pd.Timestamp, pd.Timestamp]]:
+        """Return (name, start, end) of the partitions holding datetimes"""
+        if self.partition_by is None:
+            return []
+        freq, name_format = self.partition_periods[self.partition_by]
+        periods = pd.Series(datetimes).dropna().dt.to_period(freq).unique()
+        return [
+            (f'{self.table_name}_p{period.strftime(name_format)}', period.start_time, (period + 1).start_time)
+            for period in sorted(periods)
+        ]
+
+    def get_create_partition_query(self, partition_name: str, start: pd.Timestamp, end: pd.Timestamp) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.schema_name}.{partition_name} 
+            PARTITION OF {self.schema_name}.{self.table_name} FOR VALUES FROM ('{start}') TO ('{end}');
+        """
+
+    def get_index_query(self, method: str, columns: list[str]) -> str:
+        """Return query creating a secondary index, built on every partition of a partitioned table"""
+        if method not in self.index_methods:
+            raise ValueError(f'index method must be one of {self.index_methods}, not {method}')
+        columns = [self.get_column_name(c) for c in columns]
+        index_name = f"{self.table_name}_{'_'.join(columns)}_{method}_idx"
+        return f"""
+            CREATE INDEX IF NOT EXISTS {index_name} 
+            ON {self.schema_name}.{self.table_name} USING {method} ({', '.join(columns)});
+        """
+
     def get_create_temp_query(self) -> str:
         col_fields = self.get_field_query()
         create_temp_query = f"""
@@ -105,6 +189,89 @@ class QueryCreator:
         """ 
         return create_temp_query
 
+    def get_insert_query(
+            self, temp_table_name: str, columns: list[str], on_conflict: str = 'ignore', delta_table_name: str = None
+        ) -> str:
+        """
+        Return query inserting columns from temp_table_name into the table, 
+        returning the number of rows inserted and updated.
+        on_conflict is one of
+        ignore: keep the existing row,
+        update: overwrite every non conflict column of the existing row,
+        update_changed: overwrite the existing row only when any of its values differ.
+        With delta_table_name, every inserted row and new version of an updated row is also written there
+        with sign 1, and the previous version of every updated row with sign -1.
+        """
+        column_str = ', '.join(columns)
+        select_query = f"SELECT {column_str} FROM {temp_table_name}"
+        conflict_str = f"ON CONFLICT ON CONSTRAINT {self.table_name}_unique"
+        returning_str = '' if delta_table_name is None else ', ' + ', '.join(f"target.{c}" for c in columns)
+
+        if on_conflict == 'ignore':
+            conflict_str += f" DO NOTHING RETURNING TRUE AS inserted{returning_str}"
+        elif on_conflict in ('update', 'update_changed'):
+            conflict_join = ', '.join(self.conflicts)
+            select_query = f"SELECT DISTINCT ON ({conflict_join}) {column_str} FROM {temp_table_name}"
+
+            update_columns = [c for c in columns if c not in self.conflicts]
+            set_str = ', '.join(f"{c} = EXCLUDED.{c}" for c in update_columns)
+            conflict_str += f" DO UPDATE SET {set_str}"
+            if on_conflict == 'update_changed':
+                target_str = ', '.join(f"target.{c}" for c in update_columns)
+                excluded_str = ', '.join(f"EXCLUDED.{c}" for c in update_columns)
+                conflict_str += f" WHERE ({target_str}) IS DISTINCT FROM ({excluded_str})"
+            conflict_str += f" RETURNING (xmax = 0) AS inserted{returning_str}"
+        else:
+            raise ValueError(f'on_conflict must be ignore, update or update_changed, not {on_conflict}')
+
+        old_str, delta_str = '', ''
+        if delta_table_name is not None:
+            old_str, delta_str = self.get_delta_ctes(temp_table_name, columns, on_conflict, delta_table_name)
+
+        return f"""
+            WITH {old_str}upserted AS (
+                INSERT INTO {self.schema_name}.{self.table_name} AS target ({column_str}) 
+                {select_query} 
+                {conflict_str}
+            ){delta_str}
+            SELECT count(*) FILTER (WHERE inserted) AS inserted, 
+            count(*) FILTER (WHERE NOT inserted) AS updated 
+            FROM upserted;
+        """
+
+    def get_delta_ctes(
+            self, temp_table_name: str, columns: list[str], on_conflict: str, delta_table_name: str
+        ) -> tuple[str, str]:
+        """
+        Return the CTEs of an insert query going before and after its upserted CTE 
+        which write the statement's signed changes to delta_table_name.
+        Every CTE reads the table as it was before the statement, so old holds the previous versions of rows.
+        """
+        column_str = ', '.join(columns)
+        delta_str = f"""
+            , delta AS (
+                INSERT INTO {delta_table_name} (sign, {column_str}) 
+                SELECT 1, {column_str} FROM upserted
+        """
+        if on_conflict == 'ignore':
+            return '', delta_str + ')'
+
+        conflict_join = ', '.join(self.conflicts)
+        old_columns = ', '.join(f"old.{c}" for c in columns)
+        old_match = ' AND '.join(f"old.{c} = upserted.{c}" for c in self.conflicts)
+        old_str = f"""
+            old AS (
+                SELECT {column_str} FROM {self.schema_name}.{self.table_name} 
+                WHERE ({conflict_join}) IN (SELECT {conflict_join} FROM {temp_table_name})
+            ),
+        """
+        delta_str += f"""
+                UNION ALL
+                SELECT -1, {old_columns} FROM old JOIN upserted ON {old_match} WHERE NOT upserted.inserted
+            )
+        """
+        return old_str, delta_str
+
     def get_conflict_query(self) -> str:
         field_join = ', '.join(self.conflicts)
         return f"""
@@ -114,9 +281,12 @@ class QueryCreator:
 
 async def main() -> None:
     sg_table_maker = TableCreator(
-        'fandom_schema', 'scoreboard_games', SGFields, SGDTypes, ['game_id', 'match_id'])
+        'fandom_schema', 'scoreboard_games', SGFields, SGDTypes, ['game_id', 'match_id'],
+        indexes=SG_INDEXES
+    )
     sp_table_maker = TableCreator(
-        'fandom_schema', 'scoreboard_players', SPFields, SPDTypes, ['name', 'game_id', 'match_id']
+        'fandom_schema', 'scoreboard_players', SPFields, SPDTypes, ['name', 'game_id', 'match_id'],
+        indexes=SP_INDEXES
     )
     print(await sg_table_maker(True))
     print(await sp_table_maker(True))
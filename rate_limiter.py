@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket which every api request passes through.
+    The rate is cut multiplicatively whenever the api signals throttling
+    and recovers additively back to the target rate after successful requests.
+    """
+    def __init__(
+            self,
+            rate: float,
+            burst: float = 1,
+            min_rate: float = 0.1,
+            backoff_factor: float = 0.5,
+            recovery_step: float = 0.05
+        ) -> None:
+        self.target_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.acquired = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.backoffs = 0
+
+
+    def reserve(self) -> float:
+        """
+        Take a token from the bucket, going into debt if it is empty.
+        Return how many seconds the caller must wait before making its request.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            self.acquired += 1
+            if wait:
+                self.waits += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+
+    def acquire(self) -> float:
+        """Block the calling thread until a request may be made, returns the seconds waited"""
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+    async def acquire_async(self) -> float:
+        """Wait on the event loop until a request may be made, returns the seconds waited"""
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+    def backoff(self) -> None:
+        """Cut the current rate after the api reported maxlag or too many requests"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+            self.backoffs += 1
+
+
+    def recover(self) -> None:
+        """Move the current rate one step back towards the target rate after a successful request"""
+        with self._lock:
+            self.rate = min(self.target_rate, self.rate + self.recovery_step)
+
+
+    def set_rate(self, rate: float) -> None:
+        """Set the target rate in requests per second, resetting any backoff"""
+        with self._lock:
+            self.target_rate = rate
+            self.rate = rate
+
+
+    def stats(self) -> dict:
+        """Return current rate and wait time statistics"""
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'target_rate': self.target_rate,
+                'acquired': self.acquired,
+                'waits': self.waits,
+                'total_wait': self.total_wait,
+                'mean_wait': self.total_wait / self.waits if self.waits else 0.0,
+                'max_wait': self.max_wait,
+                'backoffs': self.backoffs,
+            }
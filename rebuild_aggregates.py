@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+from connections import DBConnection
+from DBInterface import SPInterface, SGInterface
+
+
+async def rebuild(check: bool = False, normalized: bool = False) -> None:
+    """
+    Recompute every summary table of the players and games tables from scratch,
+    with check only report how many summary rows differ from a recompute
+    """
+    await DBConnection.open_pool(2)
+    try:
+        for interface in (SPInterface, SGInterface):
+            local_interface = interface(normalized=normalized, aggregated=True).local_interface
+            await local_interface.setup_aggregates()
+            counts = await local_interface.rebuild_aggregates(check)
+            for aggregate in local_interface.aggregates:
+                if check:
+                    print(f"{aggregate.name}: {counts[aggregate.name]} rows differ from a rebuild")
+                else:
+                    print(f"{aggregate.name}: rebuilt")
+    finally:
+        await DBConnection.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild or check the summary tables of aggregates.py')
+    parser.add_argument('--check', action='store_true', help='count differing summary rows instead of rebuilding')
+    parser.add_argument('--normalized', action='store_true', help='use the normalized tables')
+    args = parser.parse_args()
+    asyncio.run(rebuild(args.check, args.normalized))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from pandas import Timestamp, Timedelta
+
+
+class CacheMiss(KeyError):
+    """Raised in replay mode when a query has no cached response"""
+
+
+class ResponseCache:
+    """
+    Content addressed on-disk cache of cargo query responses.
+    Entries are keyed by a hash of the cargo table, fields, where clause, ordering, limit and offset
+    and stored as zlib compressed json, sharded by the first two characters of the key.
+
+    Responses for windows ending within recent of now expire after recent_ttl, 
+    as the wiki may still be edited, older windows never expire. Replay serves stale entries too.
+    The cache is kept under max_bytes by evicting the least recently used entries.
+
+    mode is one of
+    read_write: serve hits and store responses fetched on misses,
+    refresh: fetch every query and overwrite its entry,
+    replay: serve hits only, raising CacheMiss instead of querying the api.
+    """
+    modes = ('read_write', 'refresh', 'replay')
+    suffix = '.json.z'
+
+    def __init__(
+            self,
+            directory: str,
+            mode: str = 'read_write',
+            max_bytes: int = 4 * 2**30,
+            recent: Timedelta = Timedelta(days=14),
+            recent_ttl: Timedelta = Timedelta(hours=6),
+            compress_level: int = 6
+        ) -> None:
+        if mode not in self.modes:
+            raise ValueError(f'mode must be one of {self.modes}, not {mode}')
+        self.directory = directory
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.recent = recent
+        self.recent_ttl = recent_ttl
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, _, size in self.entries())
+        self.hits = 0
+        self.misses = 0
+
+
+    @staticmethod
+    def get_key(query_args: dict) -> str:
+        key_args = {k: str(query_args.get(k)) for k in ('tables', 'fields', 'where', 'order_by', 'limit', 'offset')}
+        return hashlib.sha256(json.dumps(key_args, sort_keys=True).encode()).hexdigest()
+
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+
+    def get(self, query_args: dict, window: tuple[str, str]) -> list[dict] | None:
+        """Return the cached response of a query, or None when it must be fetched"""
+        if self.mode == 'refresh':
+            return None
+
+        path = self.get_path(self.get_key(query_args))
+        try:
+            with open(path, 'rb') as f:
+                entry = json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            entry = None
+
+        if entry is not None and self.mode != 'replay' and self.is_stale(entry['fetched_at'], window[1]):
+            entry = None
+        if entry is None:
+            self.misses += 1
+            if self.mode == 'replay':
+                raise CacheMiss(f"No cached response for {query_args.get('tables')} where {query_args.get('where')}")
+            return None
+
+        self.hits += 1
+        os.utime(path)
+        return entry['rows']
+
+
+    def put(self, query_args: dict, rows: list[dict], window: tuple[str, str]) -> None:
+        """Store the response of a query and record its window and key in the tables' manifest"""
+        key = self.get_key(query_args)
+        path = self.get_path(key)
+        data = zlib.compress(
+            json.dumps({'fetched_at': time.time(), 'rows': rows}).encode(), self.compress_level
+        )
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temp_path, path)
+            self.size += len(data) - old_size
+            self.record_window(query_args['tables'], window, key)
+            if self.size > self.max_bytes:
+                self.evict()
+
+
+    def is_stale(self, fetched_at: float, window_end: str) -> bool:
+        now = Timestamp.now('UTC').tz_localize(None)
+        if Timestamp(window_end) < now - self.recent:
+            return False
+        return time.time() - fetched_at > self.recent_ttl.total_seconds()
+
+
+    def entries(self):
+        """Yield path, last use time and size of every cached entry"""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(self.suffix):
+                    stat = os.stat(os.path.join(root, name))
+                    yield os.path.join(root, name), stat.st_mtime, stat.st_size
+
+
+    def evict(self) -> None:
+        """
+        Remove least recently used entries until the cache is under 90% of max_bytes,
+        and drop the windows they belonged to from the manifests
+        """
+        target = 0.9 * self.max_bytes
+        evicted = set()
+        for path, _, size in sorted(self.entries(), key=lambda entry: entry[1]):
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
+            evicted.add(os.path.basename(path).removesuffix(self.suffix))
+        if evicted:
+            self.forget_keys(evicted)
+
+
+    def get_manifest_path(self, cargo_tables: str) -> str:
+        """Return the manifest of a cargo tables argument, so joined and single table queries keep separate manifests"""
+        name = re.sub(r'[^A-Za-z0-9]+', '_', cargo_tables).strip('_')
+        return os.path.join(self.directory, f'manifest-{name}.tsv')
+
+
+    def record_window(self, cargo_tables: str, window: tuple[str, str], key: str) -> None:
+        with open(self.get_manifest_path(cargo_tables), 'a') as f:
+            f.write(f'{window[0]}\t{window[1]}\t{key}\n')
+
+
+    def read_manifest(self, path: str) -> list[tuple[str, str, str]]:
+        try:
+            with open(path) as f:
+                lines = [tuple(line.rstrip('\n').split('\t')) for line in f]
+        except FileNotFoundError:
+            return []
+        # skips lines of manifests written before pages were keyed
+        return [line for line in lines if len(line) == 3]
+
+
+    def forget_keys(self, keys: set[str]) -> None:
+        """Rewrite every manifest without the windows any of keys was a page of"""
+        for name in os.listdir(self.directory):
+            if not (name.startswith('manifest-') and name.endswith('.tsv')):
+                continue
+            path = os.path.join(self.directory, name)
+            lines = self.read_manifest(path)
+            dropped = {(start, end) for start, end, key in lines if key in keys}
+            if not dropped:
+                continue
+            temp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'w') as f:
+                f.writelines(
+                    f'{start}\t{end}\t{key}\n' for start, end, key in lines if (start, end) not in dropped
+                )
+            os.replace(temp_path, path)
+
+
+    def recorded_windows(self, cargo_tables: str, start_date: str, end_date: str) -> list[tuple[str, str]]:
+        """Return the distinct windows recorded for a cargo tables argument within start_date to end_date, in order"""
+        windows = {(start, end) for start, end, _ in self.read_manifest(self.get_manifest_path(cargo_tables))}
+        start, end = Timestamp(start_date), Timestamp(end_date)
+        return sorted(w for w in windows if start <= Timestamp(w[0]) and Timestamp(w[1]) <= end)
+
+
+    def stats(self) -> dict:
+        return {'mode': self.mode, 'hits': self.hits, 'misses': self.misses, 'bytes': self.size}
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class ResultCache:
+    """
+    In memory cache of query results as DataFrames, bounded to max_bytes of frame memory
+    by evicting the least recently used results.
+    Results are tied to the load watermark they were read at, 
+    validate drops every result once the watermark moves on.
+    """
+    def __init__(self, max_bytes: int = 256 * 2**20) -> None:
+        self.max_bytes = max_bytes
+        self.results = OrderedDict()
+        self.size = 0
+        self.watermark = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+
+    def validate(self, watermark) -> None:
+        """Clear the cache if watermark differs from the one cached results were read at"""
+        with self._lock:
+            if watermark != self.watermark:
+                self.results.clear()
+                self.size = 0
+                self.watermark = watermark
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self.results.clear()
+            self.size = 0
+
+
+    def get(self, key) -> pd.DataFrame | None:
+        """Return a copy of the cached result, so callers can not modify the cached frame"""
+        with self._lock:
+            entry = self.results.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            return entry[0].copy()
+
+
+    def put(self, key, frame: pd.DataFrame, watermark) -> None:
+        """Cache a result read at watermark, unless the watermark has moved on since or it is too large"""
+        size = int(frame.memory_usage(deep=True).sum())
+        with self._lock:
+            if watermark != self.watermark or size > self.max_bytes:
+                return
+            if key in self.results:
+                self.size -= self.results.pop(key)[1]
+            self.results[key] = (frame, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.results.popitem(last=False)
+                self.size -= evicted_size
+
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'results': len(self.results), 'bytes': self.size}
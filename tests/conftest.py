@@ -0,0 +1,16 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import connections
+except ImportError:
+    # connections reads credentials from config_files, which are not checked in
+    class Placeholder:
+        pass
+
+    sys.modules['connections'] = types.SimpleNamespace(
+        DBConnection=Placeholder, ApiConnection=Placeholder, AsyncCargoClient=Placeholder
+    )
@@ -0,0 +1,144 @@
+import random
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from binary_copy import (
+    ARRAY_ELEMENT_OIDS, PGCOPY_HEADER, PGCOPY_TRAILER, POSTGRES_EPOCH_US, TEXT_OID, decode_frame, encode_frame
+)
+
+COLUMN_TYPES = {
+    'name': 'text',
+    'side': 'int2',
+    'kills': 'int4',
+    'length': 'float8',
+    'played': 'timestamp',
+    'items': 'text[]',
+    'roles': 'int2[]',
+    'champions': 'int4[]',
+}
+
+
+def reference_field(value, column_type: str) -> bytes:
+    """Encode one field the way the postgreSQL binary COPY format documents it"""
+    if value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and np.isnan(value)):
+        return struct.pack('>i', -1)
+    if column_type == 'text':
+        data = value.encode('utf-8')
+    elif column_type == 'int2':
+        data = struct.pack('>h', value)
+    elif column_type == 'int4':
+        data = struct.pack('>i', value)
+    elif column_type == 'float8':
+        data = struct.pack('>d', value)
+    elif column_type == 'timestamp':
+        data = struct.pack('>q', pd.Timestamp(value).as_unit('us').value // 1000 - POSTGRES_EPOCH_US)
+    else:
+        if column_type == 'text[]':
+            oid, elements = TEXT_OID, [s.encode('utf-8') for s in value]
+        else:
+            fmt = '>h' if column_type == 'int2[]' else '>i'
+            oid, elements = ARRAY_ELEMENT_OIDS[column_type], [struct.pack(fmt, v) for v in value]
+        if elements:
+            data = struct.pack('>iiiii', 1, 0, oid, len(elements), 1)
+            data += b''.join(struct.pack('>i', len(e)) + e for e in elements)
+        else:
+            data = struct.pack('>iii', 0, 0, oid)
+    return struct.pack('>i', len(data)) + data
+
+
+def reference_frame(entries: pd.DataFrame, column_types: dict[str, str]) -> bytes:
+    """Encode entries one row and one field at a time"""
+    rows = []
+    for row in entries.itertuples(index=False):
+        fields = [reference_field(value, column_types[col]) for col, value in zip(entries.columns, row)]
+        rows.append(struct.pack('>h', len(fields)) + b''.join(fields))
+    return PGCOPY_HEADER + b''.join(rows) + PGCOPY_TRAILER
+
+
+def make_frame(names, sides, kills, lengths, played, items, roles, champions) -> pd.DataFrame:
+    return pd.DataFrame({
+        'name': pd.array(names, dtype='string'),
+        'side': pd.array(sides, dtype='Int64'),
+        'kills': pd.array(kills, dtype='Int64'),
+        'length': pd.array(lengths, dtype='Float64'),
+        'played': pd.Series(pd.to_datetime(played, format='ISO8601')).astype('datetime64[us]'),
+        'items': pd.Series(items, dtype=object),
+        'roles': pd.Series(roles, dtype=object),
+        'champions': pd.Series(champions, dtype=object),
+    })
+
+
+def hand_frame() -> pd.DataFrame:
+    return make_frame(
+        names=['Faker', None, '', 'Café 寿司'],
+        sides=[1, 2, None, -1],
+        kills=[0, None, 2**31 - 1, -2**31],
+        lengths=[31.5, None, 0.0, -1e300],
+        played=['2019-01-01 12:00:00', None, '1999-12-31 23:59:59.999999', '2000-01-01'],
+        items=[['Doran', 'Boots'], None, [], ['ß']],
+        roles=[[1, 2, 3], [], None, [-32768, 32767]],
+        champions=[[], [7], [2**31 - 1, -2**31, 0], None],
+    )
+
+
+def random_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = random.Random(seed)
+
+    def maybe(value):
+        return None if rng.random() < 0.1 else value
+
+    return make_frame(
+        names=[maybe(''.join(rng.choice('abcé寿 ') for _ in range(rng.randint(0, 12)))) for _ in range(n_rows)],
+        sides=[maybe(rng.randint(-32768, 32767)) for _ in range(n_rows)],
+        kills=[maybe(rng.randint(-2**31, 2**31 - 1)) for _ in range(n_rows)],
+        lengths=[maybe(rng.uniform(-1e6, 1e6)) for _ in range(n_rows)],
+        played=[maybe(f'20{rng.randint(10, 24)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)} 0{rng.randint(0, 9)}:30:00')
+                for _ in range(n_rows)],
+        items=[maybe([f'item {rng.randint(0, 99)}' for _ in range(rng.randint(0, 6))]) for _ in range(n_rows)],
+        roles=[maybe([rng.randint(-32768, 32767) for _ in range(rng.randint(0, 5))]) for _ in range(n_rows)],
+        champions=[maybe([rng.randint(-2**31, 2**31 - 1) for _ in range(rng.randint(0, 5))]) for _ in range(n_rows)],
+    )
+
+
+@pytest.mark.parametrize('frame', [hand_frame(), random_frame(500)], ids=['hand', 'random'])
+def test_encode_frame_matches_reference_encoder(frame):
+    assert encode_frame(frame, COLUMN_TYPES) == reference_frame(frame, COLUMN_TYPES)
+
+
+@pytest.mark.parametrize('column_type', ['int2[]', 'int4[]'])
+def test_int_arrays_match_reference_encoder(column_type):
+    lists = [[1, -2, 3], [], None, [0], None, [], [5] * 40]
+    frame = pd.DataFrame({'values': pd.Series(lists, dtype=object)})
+    column_types = {'values': column_type}
+    assert encode_frame(frame, column_types) == reference_frame(frame, column_types)
+
+
+@pytest.mark.parametrize('frame', [hand_frame(), random_frame(500, seed=1), random_frame(0)], ids=['hand', 'random', 'empty'])
+def test_decode_frame_round_trips(frame):
+    decoded = decode_frame(encode_frame(frame, COLUMN_TYPES), COLUMN_TYPES)
+
+    assert list(decoded.columns) == list(frame.columns)
+    for col in ('name', 'side', 'kills', 'length', 'played'):
+        pd.testing.assert_series_equal(decoded[col], frame[col], check_dtype=False)
+    for col in ('items', 'roles', 'champions'):
+        assert [None if v is None else list(v) for v in decoded[col]] == list(frame[col])
+
+
+def test_decode_frame_rejects_other_payloads():
+    with pytest.raises(ValueError):
+        decode_frame(b'not a copy payload', COLUMN_TYPES)
+
+
+@pytest.mark.parametrize('column_type, value', [
+    ('int4', 2**31 + 5), ('int4', -2**31 - 1), ('int2', 70000), ('int2[]', [1, 32768]), ('int4[]', [-2**31 - 1]),
+])
+def test_out_of_range_ints_raise(column_type, value):
+    if column_type.endswith('[]'):
+        frame = pd.DataFrame({'kills': pd.Series([[0], value], dtype=object)})
+    else:
+        frame = pd.DataFrame({'kills': pd.array([0, value], dtype='Int64')})
+    with pytest.raises(ValueError, match='kills'):
+        encode_frame(frame, {'kills': column_type})
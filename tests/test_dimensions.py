@@ -0,0 +1,114 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+import dimensions
+from dimensions import Dimension, DimensionMap
+
+
+class FakeDimensionConnection:
+    """Connection to dimension tables held in memory, hidden values are inserted by another loader on insert"""
+    def __init__(self, hidden: set[str] = ()) -> None:
+        self.tables = {}
+        self.hidden = set(hidden)
+        self.queries = []
+
+    async def fetch(self, query, values):
+        table = self.tables.setdefault(query.split('dim_')[1].split()[0], {})
+        if query.lstrip().startswith('SELECT'):
+            self.queries.append(('select', sorted(values)))
+            return [{'id': table[v], 'value': v} for v in values if v in table]
+        self.queries.append(('insert', sorted(values)))
+        rows = []
+        for value in values:
+            if value in self.hidden:
+                # inserted concurrently by another loader, so the insert conflicts
+                self.hidden.discard(value)
+                table[value] = len(table) + 1
+                continue
+            if value not in table:
+                table[value] = len(table) + 1
+                rows.append({'id': table[value], 'value': value})
+        return rows
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = FakeDimensionConnection()
+
+    class Acquire:
+        async def __aenter__(self):
+            return conn
+
+        async def __aexit__(self, *exc):
+            return False
+
+    pool = type('FakePool', (), {'acquire': lambda self: Acquire()})()
+    monkeypatch.setattr(
+        dimensions, 'DBConnection', type('FakeDBConnection', (), {'get_pool': staticmethod(lambda: pool)})
+    )
+    monkeypatch.setattr(Dimension, 'instances', {})
+    return conn
+
+
+def test_resolve_inserts_new_values_in_bulk_and_reuses_cached_keys(conn):
+    dimension = Dimension('fandom_schema', 'teams')
+
+    async def run():
+        first = await dimension.resolve(['T1', 'Gen.G'])
+        second = await dimension.resolve(['T1', 'DRX'])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == {'T1': 1, 'Gen.G': 2}
+    assert second == {'T1': 1, 'DRX': 3}
+    assert conn.queries == [
+        ('select', ['Gen.G', 'T1']), ('insert', ['Gen.G', 'T1']),
+        ('select', ['DRX']), ('insert', ['DRX']),
+    ]
+    assert dimension.cache.hits == 1
+
+
+def test_resolve_reads_back_evicted_and_concurrently_inserted_values(conn):
+    dimension = Dimension('fandom_schema', 'teams', cache_entries=2)
+
+    async def run():
+        await dimension.resolve(['T1', 'Gen.G', 'DRX'])
+        inserts = sum(kind == 'insert' for kind, _ in conn.queries)
+        # T1 was evicted from the cache, its existing key is selected instead of inserted again
+        keys = await dimension.resolve(['T1'])
+        assert sum(kind == 'insert' for kind, _ in conn.queries) == inserts
+        return keys
+
+    assert asyncio.run(run()) == {'T1': conn.tables['teams']['T1']}
+
+    conn.hidden = {'KT'}
+    conn.queries.clear()
+    assert asyncio.run(dimension.resolve(['KT'])) == {'KT': conn.tables['teams']['KT']}
+    assert conn.queries == [('select', ['KT']), ('insert', ['KT']), ('select', ['KT'])]
+
+
+def test_encode_replaces_string_and_list_columns_with_keys(conn):
+    dimension_map = DimensionMap('fandom_schema', {
+        'team': ('teams', 'team_id'),
+        'team_vs': ('teams', 'team_vs_id'),
+        'items': ('items', 'item_ids'),
+    })
+    entries = pd.DataFrame({
+        'team': pd.array(['T1', None, 'DRX'], dtype='string'),
+        'team_vs': pd.array(['DRX', 'T1', 'T1'], dtype='string'),
+        'items': pd.Series([['Boots', 'Doran'], [], None], dtype=object),
+        'kills': pd.array([1, 2, 3], dtype='Int64'),
+    })
+
+    encoded = asyncio.run(dimension_map.encode(entries))
+
+    teams, items = conn.tables['teams'], conn.tables['items']
+    assert list(encoded.columns) == ['team_id', 'team_vs_id', 'item_ids', 'kills']
+    assert encoded['team_id'].tolist() == [teams['T1'], pd.NA, teams['DRX']]
+    assert encoded['team_vs_id'].tolist() == [teams['DRX'], teams['T1'], teams['T1']]
+    assert [None if v is None else list(v) for v in encoded['item_ids']] == [[items['Boots'], items['Doran']], [], None]
+    assert encoded['kills'].tolist() == [1, 2, 3]
+    # both team columns are resolved through one lookup of the shared dimension
+    assert sum(kind == 'select' and 'T1' in values for kind, values in conn.queries) == 1
@@ -0,0 +1,192 @@
+import asyncio
+
+import pytest
+from pandas import DataFrame
+
+import ETL
+from DBInterface import SGInterface
+from ETL import APIETL, ETLScheduler, Page, WindowProgress
+
+WINDOW = ('2020-01-01 00:00:00', '2020-01-02 00:00:00')
+
+
+class FakeDeadLetters:
+    def __init__(self) -> None:
+        self.records = []
+
+    async def record(self, window, offset, stage, error, payload=None, attempts=1):
+        self.records.append((window, offset, stage, type(error).__name__, payload, attempts))
+
+
+class FakeCheckpoints:
+    def __init__(self) -> None:
+        self.recorded = []
+        self.completed = []
+
+    async def record_page(self, window, next_offset, entries):
+        self.recorded.append((window, next_offset))
+
+    async def complete_window(self, window):
+        self.completed.append(window)
+
+
+class FakeFingerprints:
+    async def load_days(self, days):
+        return {}
+
+    async def record_days(self, days):
+        pass
+
+
+def make_job() -> APIETL:
+    job = APIETL(1, 1, '2020-01-01', '2020-01-02', SGInterface)
+    job.dead_letters = FakeDeadLetters()
+    job.load_queue = asyncio.Queue()
+    job.checkpoints = FakeCheckpoints()
+    job.fingerprints = FakeFingerprints()
+    job.retry_base = 0
+    return job
+
+
+def test_failed_transform_is_dead_lettered_and_its_window_finishes():
+    async def run():
+        job = make_job()
+        job.windows[WINDOW] = WindowProgress(pages_expected=1)
+        job.tail_signatures[WINDOW] = (('row_count', 1),)
+        page = Page(job, WINDOW, 0, [{'GameId': 'a'}])
+
+        await ETLScheduler([job], 1, 1).drop_page(page, ValueError('bad page'))
+
+        assert job.dead_letters.records == [(WINDOW, 0, 'transform', 'ValueError', '[{"GameId": "a"}]', 1)]
+        assert WINDOW not in job.tail_signatures
+        queued = job.load_queue.get_nowait()
+        assert queued is page and page.failed and len(page.entries) == 0 and page.fingerprint is None
+
+    asyncio.run(run())
+
+
+def test_dead_letters_record_the_attempts_made():
+    async def run():
+        job = make_job()
+        job.is_transient_error = lambda error: isinstance(error, ConnectionError)
+
+        async def fail():
+            raise ConnectionError('api down')
+
+        with pytest.raises(ConnectionError) as raised:
+            await job.with_retries('extract', fail)
+        assert raised.value.attempts == job.max_retries + 1
+
+        await job.dead_letter(WINDOW, 0, 'extract', raised.value)
+        assert job.dead_letters.records[-1][-1] == job.max_retries + 1
+
+    asyncio.run(run())
+
+
+def test_window_resumes_from_a_dropped_page():
+    async def run():
+        job = make_job()
+        job.windows[WINDOW] = WindowProgress(pages_expected=2)
+        dropped = Page(job, WINDOW, 0, DataFrame(), failed=True)
+        loaded = Page(job, WINDOW, job.query_limit, DataFrame())
+
+        await job.load_batch([dropped, loaded])
+
+        assert job.checkpoints.recorded == [(WINDOW, 0)]
+        assert job.checkpoints.completed == []
+        assert WINDOW not in job.windows
+
+    asyncio.run(run())
+
+
+class FakeLeases:
+    def __init__(self) -> None:
+        self.calls = []
+
+    async def release(self, window):
+        self.calls.append(('release', window))
+
+    async def complete(self, window):
+        self.calls.append(('complete', window))
+
+
+def test_lease_is_released_once_the_window_finishes():
+    async def run():
+        job = make_job()
+        job.leases = FakeLeases()
+        job.windows[WINDOW] = WindowProgress(pages_expected=2)
+
+        await job.load_batch([Page(job, WINDOW, 0, DataFrame(), failed=True)])
+        assert job.leases.calls == []
+        await job.load_batch([Page(job, WINDOW, job.query_limit, DataFrame())])
+        assert job.leases.calls == [('release', WINDOW)]
+
+    asyncio.run(run())
+
+
+def test_malformed_rows_are_dead_lettered_and_the_rest_loaded():
+    async def run():
+        job = make_job()
+        page = Page(job, WINDOW, 0, [{'GameId': 'a', 'Team1Score': '1'}, {'GameId': 'b', 'Team1Score': 'one'}])
+        await job.transform_page(page)
+
+        assert [record[2:4] for record in job.dead_letters.records] == [('transform', 'ValueError')]
+        assert job.load_queue.get_nowait().entries['game_id'].tolist() == ['a']
+
+    asyncio.run(run())
+
+
+def test_page_failures_not_caused_by_a_row_are_raised(monkeypatch):
+    def broken(*args):
+        raise RuntimeError('process pool is broken')
+
+    monkeypatch.setattr(ETL, 'clean_changed_rows', broken)
+
+    async def run():
+        job = make_job()
+        with pytest.raises(RuntimeError):
+            await job.transform_page(Page(job, WINDOW, 0, [{'GameId': 'a'}]))
+        assert job.dead_letters.records == []
+        assert job.load_queue.empty()
+
+    asyncio.run(run())
+
+
+def test_dead_lettered_load_forgets_the_tail_signature():
+    async def run():
+        job = make_job()
+        job.tail_signatures[WINDOW] = (('row_count', 1),)
+
+        async def fail(entries, table):
+            raise ValueError('bad row')
+
+        job.worker_insert_entries = fail
+        page = Page(job, WINDOW, 0, DataFrame({'game_id': ['a']}))
+        await job.insert_pages([page])
+
+        assert page.failed
+        assert WINDOW not in job.tail_signatures
+
+    asyncio.run(run())
+
+
+def test_failed_fingerprint_lookup_is_not_cached():
+    async def run():
+        job = make_job()
+        job.is_transient_error = lambda error: False
+        calls = []
+
+        async def load_days(days):
+            calls.append(days)
+            if len(calls) == 1:
+                raise ConnectionError('connection lost')
+            return {'2020-01-01': {'hash'}}
+
+        job.fingerprints.load_days = load_days
+        with pytest.raises(ConnectionError):
+            await job.known_row_hashes(WINDOW)
+        assert job.known_fingerprints == {}
+        assert await job.known_row_hashes(WINDOW) == {'hash'}
+        assert len(calls) == 2
+
+    asyncio.run(run())
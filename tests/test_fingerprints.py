@@ -0,0 +1,34 @@
+from benchmarks.synthetic import synthetic_rows
+from etl_state import window_days
+from fields import SGFields, SGDTypes
+from transform import clean_changed_rows, get_fingerprint
+
+
+def merge_days(fingerprints: list[tuple]) -> dict[str, set[str]]:
+    days = {}
+    for _, _, day_hashes in fingerprints:
+        for day, row_hashes in day_hashes.items():
+            days.setdefault(day, set()).update(row_hashes)
+    return days
+
+
+def test_day_fingerprints_do_not_depend_on_page_split():
+    rows = synthetic_rows(SGFields, SGDTypes, 300, rows_per_game=1)
+    whole = merge_days([get_fingerprint(rows)])
+    split = merge_days([get_fingerprint(rows[i:i + 70]) for i in range(0, len(rows), 70)])
+    assert whole == split
+    assert all(len(day) == 10 for day in whole)
+
+
+def test_known_rows_are_skipped():
+    rows = synthetic_rows(SGFields, SGDTypes, 50, rows_per_game=1)
+    known = set().union(*merge_days([get_fingerprint(rows[:30])]).values())
+    entries, fingerprint = clean_changed_rows(SGFields, SGDTypes, rows, known)
+    assert len(entries) == 20
+    assert fingerprint[0] == 50
+
+
+def test_window_days():
+    assert window_days(('2020-01-01 06:00:00', '2020-01-03 00:00:00')) == ['2020-01-01', '2020-01-02']
+    assert window_days(('2020-01-01 06:00:00', '2020-01-03 00:00:00'), whole=True) == ['2020-01-02']
+    assert window_days(('2020-01-01 06:00:00', '2020-01-01 18:00:00'), whole=True) == []
@@ -0,0 +1,10 @@
+from ETL import WindowPlanner
+
+
+def test_report_keeps_the_window_row_count_and_resizes():
+    planner = WindowPlanner('2020-01-01', '2020-02-01', page_size=500)
+    window = planner.next_window()
+    planner.report(window, 1500)
+
+    assert planner.last_report == (('2020-01-01 00:00:00', '2020-01-02 00:00:00'), 1500)
+    assert planner.next_window() == ('2020-01-02 00:00:00', '2020-01-02 12:00:00')
@@ -0,0 +1,76 @@
+import asyncio
+
+import DBInterface
+from DBInterface import SGInterface
+from benchmarks.synthetic import synthetic_rows, typed_frame
+from binary_copy import encode_frame
+from fields import SGFields, SGDTypes
+
+
+class FakeConnection:
+    def __init__(self, payload: bytes) -> None:
+        self.payload = payload
+        self.copies = []
+
+    async def copy_from_query(self, query, *args, output, format):
+        self.copies.append((query, args))
+        await output(self.payload)
+
+
+class FakePool:
+    def __init__(self, conn: FakeConnection) -> None:
+        self.conn = conn
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                return pool.conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+
+def make_interface(monkeypatch, watermarks):
+    local_interface = SGInterface(partition_by=None).local_interface
+    frame = typed_frame(SGFields, SGDTypes, synthetic_rows(SGFields, SGDTypes, 20, rows_per_game=1))
+    conn = FakeConnection(encode_frame(frame, local_interface.column_types))
+    monkeypatch.setattr(
+        DBInterface, 'DBConnection', type('FakeDBConnection', (), {'get_pool': staticmethod(lambda: FakePool(conn))})
+    )
+    marks = iter(watermarks)
+
+    async def watermark():
+        return next(marks)
+
+    monkeypatch.setattr(local_interface.checkpoints, 'watermark', watermark)
+    return local_interface, conn, frame
+
+
+def test_filtered_read_is_served_from_cache(monkeypatch):
+    local_interface, conn, frame = make_interface(monkeypatch, [1, 1])
+
+    async def read_twice():
+        first = await local_interface.read('2019-01-01', team='T1', player=['Faker', 'Keria'])
+        second = await local_interface.read('2019-01-01', team='T1', player=['Faker', 'Keria'])
+        return first, second
+
+    first, second = asyncio.run(read_twice())
+    assert len(conn.copies) == 1
+    assert local_interface.result_cache.hits == 1
+    assert first.equals(second)
+    assert len(first) == len(frame)
+
+
+def test_read_cache_is_dropped_when_watermark_moves(monkeypatch):
+    local_interface, conn, _ = make_interface(monkeypatch, [1, 2])
+
+    async def read_twice():
+        await local_interface.read(tournament='LCK')
+        await local_interface.read(tournament='LCK')
+
+    asyncio.run(read_twice())
+    assert len(conn.copies) == 2
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+from pandas import Timestamp, Timedelta
+
+from DBInterface import JoinedAPIInterface, SGInterface, SPInterface
+from response_cache import CacheMiss, ResponseCache
+
+
+def recent_window() -> tuple[str, str]:
+    end = Timestamp.now('UTC').tz_localize(None).floor('D')
+    return str(end - Timedelta(days=1)), str(end)
+
+
+def test_replay_serves_stale_recent_windows(tmp_path):
+    api = SGInterface().api_interface
+    window = recent_window()
+    query_args = api.cargo_query_args(0, *window, 500)
+    ResponseCache(str(tmp_path)).put(query_args, [{'GameId': 'a'}], window)
+
+    stale = ResponseCache(str(tmp_path), recent_ttl=Timedelta(0))
+    time.sleep(0.01)
+    assert stale.get(query_args, window) is None
+
+    replay = ResponseCache(str(tmp_path), mode='replay', recent_ttl=Timedelta(0))
+    assert replay.get(query_args, window) == [{'GameId': 'a'}]
+    with pytest.raises(CacheMiss):
+        replay.get(api.cargo_query_args(500, *window, 500), window)
+
+
+def test_joined_and_plain_windows_keep_separate_manifests(tmp_path):
+    plain = SGInterface().api_interface
+    joined = JoinedAPIInterface(plain, SPInterface().api_interface)
+    cache = ResponseCache(str(tmp_path))
+    cache.put(plain.cargo_query_args(0, '2020-01-01', '2020-01-02', 500), [], ('2020-01-01', '2020-01-02'))
+    cache.put(joined.cargo_query_args(0, '2020-01-01', '2020-01-03', 500), [], ('2020-01-01', '2020-01-03'))
+
+    assert cache.recorded_windows(plain.cargo_tables, '2020-01-01', '2021-01-01') == [('2020-01-01', '2020-01-02')]
+    assert cache.recorded_windows(joined.cargo_tables, '2020-01-01', '2021-01-01') == [('2020-01-01', '2020-01-03')]
+
+
+def test_evicted_windows_leave_the_manifest(tmp_path):
+    api = SGInterface().api_interface
+    cache = ResponseCache(str(tmp_path), compress_level=0)
+    rows = [{'GameId': str(i) * 50} for i in range(20)]
+    windows = [('2020-01-01', '2020-01-02'), ('2020-01-02', '2020-01-03')]
+    for window in windows:
+        for offset in (0, 20):
+            cache.put(api.cargo_query_args(offset, *window, 20), rows, window)
+            time.sleep(0.01)
+    assert cache.recorded_windows(api.cargo_tables, '2020-01-01', '2021-01-01') == windows
+
+    cache.max_bytes = cache.size
+    cache.evict()
+    assert cache.recorded_windows(api.cargo_tables, '2020-01-01', '2021-01-01') == windows[1:]
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import synthetic_rows
+from fields import SGFields, SGDTypes, SPFields, SPDTypes
+from transform import TransformPlan, compile_plan, clean_changed_rows_ipc, frame_from_ipc
+
+
+def test_plan_types_and_renames_columns():
+    rows = [
+        {'Tournament': 'LCK 2020', 'DateTime UTC': '2020-02-05 08:00:00', 'Team1Score': '1', 'Gamelength Number': '31.5',
+         'Team1Bans': 'Azir,Lee Sin', 'Team1Dragons': '3.0'},
+        {'Tournament': '', 'DateTime UTC': '', 'Team1Score': '', 'Gamelength Number': None,
+         'Team1Bans': '', 'Team1Dragons': '0'},
+    ]
+    frame = TransformPlan(SGFields, SGDTypes)(rows)
+
+    assert list(frame.columns) == SGFields.list_names()
+    assert frame['tournament'].tolist() == ['LCK 2020', '']
+    assert frame['datetime_utc'].tolist()[0] == pd.Timestamp('2020-02-05 08:00:00')
+    assert frame['datetime_utc'].isna().tolist() == [False, True]
+    assert str(frame['team_1_score'].dtype) == 'Int64' and frame['team_1_score'].tolist() == [1, pd.NA]
+    assert str(frame['game_length'].dtype) == 'Float64' and frame['game_length'].tolist() == [31.5, pd.NA]
+    assert frame['team_1_dragons'].tolist() == [3, 0]
+    assert frame['team_1_bans'].tolist() == [['Azir', 'Lee Sin'], ['']]
+    # columns the api did not return are filled with missing values
+    assert frame['team2'].isna().all()
+
+
+def test_plan_handles_empty_pages():
+    frame = compile_plan(SPFields, SPDTypes)([])
+    assert len(frame) == 0
+    assert list(frame.columns) == SPFields.list_names()
+
+
+@pytest.mark.parametrize('value', ['12 kills', '1.5'])
+def test_plan_names_the_malformed_column(value):
+    with pytest.raises(ValueError, match='team_1_score'):
+        TransformPlan(SGFields, SGDTypes)([{'Team1Score': value}])
+
+
+def test_ipc_round_trip_keeps_the_plan_output():
+    rows = synthetic_rows(SPFields, SPDTypes, 200)
+    expected = compile_plan(SPFields, SPDTypes)(rows)
+    buffer, fingerprint = clean_changed_rows_ipc(SPFields, SPDTypes, rows, None)
+    frame = frame_from_ipc(buffer)
+
+    assert fingerprint[0] == 200
+    assert list(frame.columns) == list(expected.columns)
+    for col in expected.columns:
+        assert frame[col].tolist() == expected[col].tolist(), col
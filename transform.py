@@ -0,0 +1,204 @@
+import hashlib
+import json
+import multiprocessing
+from functools import lru_cache
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+from fields import FieldEnum, DTypeEnum
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+class TransformPlan:
+    """
+    Transform of raw cargo rows into typed columns, 
+    compiled once per FieldEnum and DTypeEnum pair.
+    Raw string values are parsed straight into integer, float, datetime, string and list arrays,
+    columns the api did not return are filled with missing values,
+    and columns are named after the FieldEnum names.
+    Empty values become missing in integer, float and datetime columns only,
+    string columns keep '' and list columns [''] as the previous cleaning path did.
+    """
+    def __init__(self, fields: FieldEnum, field_dtypes: DTypeEnum) -> None:
+        self.fields = fields
+        self.columns = []
+        for field in fields:
+            dtype = field_dtypes[field.value]
+            delimiter = dtype[-1] if 'delimiter:' in dtype.split(' ') else None
+            kind = 'list' if delimiter else dtype
+            self.columns.append((field.name, field.value, kind, delimiter))
+
+
+    def __call__(self, rows: list[dict]) -> pd.DataFrame:
+        """Return rows of a cargo query as a typed DataFrame"""
+        first_row = rows[0] if rows else {}
+        keys = {value: self.get_key(value, first_row) for _, value, _, _ in self.columns}
+        present = [key for key in keys.values() if key is not None]
+
+        raw_columns = {}
+        if rows and present:
+            getter = itemgetter(*present)
+            values = zip(*map(getter, rows)) if len(present) > 1 else [tuple(map(getter, rows))]
+            raw_columns = dict(zip(present, values))
+
+        n_rows = len(rows)
+        typed = {}
+        for name, value, kind, delimiter in self.columns:
+            raw = raw_columns.get(keys[value])
+            raw = np.full(n_rows, None, dtype=object) if raw is None else np.array(raw, dtype=object)
+            typed[name] = self.parse(raw, kind, delimiter, name)
+        return pd.DataFrame(typed, copy=False)
+
+
+    @staticmethod
+    def get_key(value: str, row: dict) -> str | None:
+        """Return the key cargo used for field value, which replaces underscores with spaces"""
+        for key in (value.replace('_', ' '), value):
+            if key in row:
+                return key
+        return None
+
+
+    @staticmethod
+    def parse(raw: np.ndarray, kind: str, delimiter: str | None, name: str):
+        missing = pd.isna(raw) | (raw == '')
+
+        if kind == 'Integer':
+            return pd.arrays.IntegerArray(parse_numbers(raw, missing, np.int64, name), missing)
+        if kind == 'Float':
+            return pd.arrays.FloatingArray(parse_numbers(raw, missing, np.float64, name), missing)
+        if kind == 'Datetime':
+            raw = raw.copy()
+            raw[missing] = 'NaT'
+            return pd.Series(raw.astype('datetime64[s]'))
+
+        # '' is kept rather than masked, key columns such as match_id compare equal on '' but not on NULL
+        strings = pd.array(raw, dtype='string')
+        if kind == 'list':
+            return pd.Series(strings).str.split(delimiter)
+        return strings
+
+
+def parse_numbers(raw: np.ndarray, missing: np.ndarray, dtype, name: str) -> np.ndarray:
+    """Parse numeric strings, raising ValueError naming the column on malformed values"""
+    raw = raw.copy()
+    raw[missing] = '0'
+    try:
+        return raw.astype(dtype)
+    except ValueError:
+        pass
+    try:
+        parsed = raw.astype(np.float64)
+    except ValueError as e:
+        raise ValueError(f'Column {name} has a value which is not a number: {e}') from e
+    if dtype is np.int64 and not np.array_equal(parsed, np.floor(parsed)):
+        raise ValueError(f'Column {name} has a value which is not an integer')
+    return parsed.astype(dtype)
+
+
+@lru_cache
+def compile_plan(fields: FieldEnum, field_dtypes: DTypeEnum) -> TransformPlan:
+    """Return the cached transform plan of a FieldEnum and DTypeEnum pair"""
+    return TransformPlan(fields, field_dtypes)
+
+
+def get_fingerprint(rows: list[dict], row_hashes: list[str] = None) -> tuple[int, str, dict[str, list[str]]]:
+    """
+    Return row count, payload hash and the hashes of raw cargo rows grouped by the day of their DateTime UTC,
+    so stored fingerprints do not depend on how the date range was split into windows and pages
+    """
+    if row_hashes is None:
+        row_hashes = get_row_hashes(rows)
+    payload_hash = hashlib.blake2b(''.join(row_hashes).encode(), digest_size=16).hexdigest()
+    day_hashes = {}
+    for row, row_hash in zip(rows, row_hashes):
+        day_hashes.setdefault(get_row_day(row), []).append(row_hash)
+    return len(rows), payload_hash, day_hashes
+
+
+def get_row_hashes(rows: list[dict]) -> list[str]:
+    return [
+        hashlib.blake2b(json.dumps(row, sort_keys=True).encode(), digest_size=16).hexdigest()
+        for row in rows
+    ]
+
+
+def get_row_day(row: dict) -> str:
+    return str(row.get('DateTime UTC') or '')[:10]
+
+
+def clean_changed_rows(
+        fields: FieldEnum, field_dtypes: DTypeEnum, rows: list[dict], known: set[str] | None
+    ) -> tuple[pd.DataFrame, tuple]:
+    """
+    Return the cleaned rows whose hashes are not among the known row hashes of their days, 
+    and the page's new fingerprint
+    """
+    row_hashes = get_row_hashes(rows)
+    fingerprint = get_fingerprint(rows, row_hashes)
+    if known:
+        rows = [row for row, row_hash in zip(rows, row_hashes) if row_hash not in known]
+    return compile_plan(fields, field_dtypes)(rows), fingerprint
+
+
+def split_malformed_rows(
+        fields: FieldEnum, field_dtypes: DTypeEnum, rows: list[dict]
+    ) -> tuple[list[dict], list[tuple[dict, Exception]]]:
+    """Clean rows one at a time, returning the rows which clean and each row which fails with its error"""
+    plan = compile_plan(fields, field_dtypes)
+    valid, malformed = [], []
+    for row in rows:
+        try:
+            plan([row])
+        except Exception as e:
+            malformed.append((row, e))
+        else:
+            valid.append(row)
+    return valid, malformed
+
+
+def clean_changed_rows_ipc(
+        fields: FieldEnum, field_dtypes: DTypeEnum, rows: list[dict], known: set[str] | None
+    ) -> tuple[bytes, tuple]:
+    """
+    clean_changed_rows for worker processes,
+    returning the cleaned rows as an Arrow IPC stream so they come back without pickling each column
+    """
+    entries, fingerprint = clean_changed_rows(fields, field_dtypes, rows, known)
+    table = pa.Table.from_pandas(entries, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes(), fingerprint
+
+
+def frame_from_ipc(buffer: bytes) -> pd.DataFrame:
+    """
+    Read cleaned rows back from an Arrow IPC stream with the dtypes the transform plan produces,
+    list columns are kept as arrow backed list columns
+    """
+    table = pa.ipc.open_stream(pa.py_buffer(buffer)).read_all()
+    return table.to_pandas(types_mapper=arrow_to_pandas_dtype)
+
+
+def arrow_to_pandas_dtype(arrow_type):
+    if pa.types.is_integer(arrow_type):
+        return pd.Int64Dtype()
+    if pa.types.is_floating(arrow_type):
+        return pd.Float64Dtype()
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype()
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+def get_process_context() -> multiprocessing.context.BaseContext:
+    """Return the forkserver start method where the platform has it, spawn otherwise"""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)